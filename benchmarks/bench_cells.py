@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""Compare ways of rendering cells: parsing each cell, parsing the table once, and caching.
+
+Run with ``python benchmarks/bench_cells.py [ROWS] [COLUMNS]``
+"""
+import ast
+import sys
+import time
+
+import libcst
+
+from table_format import (
+    DEFAULT_CELL_CACHE_SIZE,
+    cell_cache,
+    cst_node_to_code,
+    reformat,
+    reformat_as_single_line,
+    reformat_ast_as_single_line,
+)
+
+CELLS = ["None", "True", "123", "-4.5", "'text'", '"other text"', "foo(a, b=2)", "x + y * 2", "Enum.MEMBER", "(1, 2)"]
+
+
+def make_table(rows, columns):
+    lines = ["["]
+    for row in range(rows):
+        lines.append("    [" + ", ".join(CELLS[(row + col) % len(CELLS)] for col in range(columns)) + "],")
+    lines.append("]")
+    return "\n".join(lines)
+
+
+def render_per_cell(code, code_cst):
+    # How cells used to be rendered: each cell serialized, parsed and decompiled on its own.
+    return [
+        [reformat_as_single_line(cst_node_to_code(element.value)) for element in row.value.elements]
+        for row in code_cst.elements
+    ]
+
+
+def render_from_one_parse(code, code_cst):
+    code_ast = ast.parse(code, mode="eval").body
+    return [[reformat_ast_as_single_line(cell) for cell in row.elts] for row in code_ast.elts]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    columns = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    code = make_table(rows, columns)
+    code_cst = libcst.parse_expression(code)
+    cell_cache.resize(0)
+    per_cell = timed(render_per_cell, code, code_cst)
+    one_parse = timed(render_from_one_parse, code, code_cst)
+    no_cache = timed(reformat, code)
+    cell_cache.resize(DEFAULT_CELL_CACHE_SIZE)
+    cell_cache.clear()
+    with_cache = timed(reformat, code)
+    print(f"{rows * columns} cells, {len(CELLS)} distinct")
+    print(f"render cells, parsing each cell:  {per_cell:.3f}s")
+    print(f"render cells, parsing table once: {one_parse:.3f}s ({per_cell / one_parse:.1f}x faster)")
+    print(f"full reformat(), no cell cache:   {no_cache:.3f}s")
+    print(f"full reformat(), with cell cache: {with_cache:.3f}s ({cell_cache.info()})")
+
+
+if __name__ == "__main__":
+    main()
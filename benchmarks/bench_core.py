@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""Compare the speed of the compiled `table_format.core` with the pure Python version.
+
+Build the compiled version first (see "Testing" in the README), then run with
+``python benchmarks/bench_core.py [ROWS]``
+"""
+import ast
+import importlib.util
+import os
+import sys
+import time
+
+from table_format import QuoteStyle, core
+
+NODES = [ast.parse(code, mode="eval").body for code in ["1", "-2.5", "'a'", "name", "None", "b'x'"]]
+
+
+def load_interpreted_core():
+    """
+    Load the pure Python version of `table_format.core`, even if it is compiled.
+    """
+    path = os.path.join(os.path.dirname(core.__file__), "core.py")
+    spec = importlib.util.spec_from_file_location("table_format._interpreted_core", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def lay_out(module, rows):
+    """
+    Render cells and lay out a table using `module`, the way `reformat` does.
+    """
+    rendered = [[module.fast_render_cell(node, QuoteStyle.SINGLE) for node in NODES] for _ in range(rows)]
+    layout = module.TableLayout(
+        module.column_widths(rendered),
+        indent=" " * module.get_indent_size("        x"),
+        noqa_markers=module.NoqaMarkers(["E501"]),
+    )
+    output = [layout.head("", [])]
+    for idx, row in enumerate(rendered):
+        output.append(layout.row(row, "[", f"# row {idx % 10}", ""))
+    output.append(layout.tail([]))
+    return "".join(output)
+
+
+def best_time(func, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    if core.__file__.endswith(".py"):
+        print("table_format.core isn't compiled, so this compares it with itself")
+    interpreted = load_interpreted_core()
+    interpreted_time = best_time(lambda: lay_out(interpreted, rows))
+    compiled_time = best_time(lambda: lay_out(core, rows))
+    print(f"{rows} rows of {len(NODES)} cells")
+    print(f"pure Python: {interpreted_time * 1000:.1f} ms")
+    print(f"compiled:    {compiled_time * 1000:.1f} ms ({interpreted_time / compiled_time:.2f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark reformat(), end to end and stage by stage, on generated tables.
+
+Run with ``python benchmarks/bench_reformat.py``, which runs all the scenarios
+below. Use ``--scenario`` to pick some of them, or ``--rows``, ``--columns``
+etc. to run a custom one.
+
+To check for regressions, save the results from one version with
+``--save baseline.json``, then run again with ``--compare baseline.json``.
+Times that are slower than the baseline by more than ``--threshold`` are
+reported, and the exit status is 1 if there are any.
+
+Times are the best of ``--repeat`` runs, each with an empty cell cache, as in
+a fresh process. Peak memory is measured separately with tracemalloc, as it
+slows everything down.
+"""
+import argparse
+import ast
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import libcst
+
+from table_format import (
+    Engine,
+    cell_cache,
+    column_widths,
+    extract_comments,
+    extract_table_cst,
+    layout_table,
+    reformat,
+    render_rows,
+)
+from table_format.version import VERSION
+
+COMPLEXITIES = ["simple", "mixed", "complex"]
+
+# name: (rows, columns, complexity, comment density, raggedness)
+SCENARIOS = {
+    "small": (20, 5, "simple", 0.0, 0.0),
+    "typical": (200, 8, "mixed", 0.1, 0.0),
+    "commented": (500, 6, "mixed", 0.5, 0.2),
+    "wide": (100, 50, "simple", 0.0, 0.0),
+    "complex": (300, 6, "complex", 0.1, 0.0),
+    "big": (2000, 10, "mixed", 0.05, 0.05),
+}
+
+
+def make_cell(rng, complexity):
+    """
+    Return the source code of a random cell.
+
+    "simple" cells are names, numbers, constants and plain strings, "mixed"
+    cells add attributes, calls, operators and tuples, and "complex" cells add
+    nested containers, keyword arguments, lambdas, f-strings and comprehensions.
+    """
+    n = rng.randrange(100)
+    simple = [f"name_{n}", str(n), f"-{n}.5", "None", "True", f"'text {n}'", f'"other {n}"', f"0x{n:x}"]
+    mixed = [f"Enum.MEMBER_{n}", f"f(x, {n})", f"x + {n} * y", f"({n}, 'a')", f"obj.method(a, b={n})", f"not x{n}"]
+    complex_ = [
+        f"{{'key': [{n}, 2, 3], 'other': (None,)}}",
+        f"func(a, *args, key=value_{n}, **kwargs)",
+        f"lambda x: x * {n} + 1",
+        f"f'{{name_{n}!r:>10}} items'",
+        f"[i * {n} for i in range(10) if i % 2]",
+        f"a if cond_{n} else b",
+        f"x[{n}:2, ::3]",
+    ]
+    choices = simple
+    if complexity in ("mixed", "complex"):
+        choices = choices + mixed
+    if complexity == "complex":
+        choices = choices + complex_
+    return rng.choice(choices)
+
+
+def make_table(rows=100, columns=6, complexity="mixed", comments=0.0, ragged=0.0, seed=0):
+    """
+    Return the source code of a random list of lists.
+
+    `comments` is the fraction of rows that have an end of row comment (and,
+    separately, a comment line after them). `ragged` is the fraction of rows
+    that have a random number of cells, rather than `columns`.
+    """
+    rng = random.Random(seed)
+    lines = ["[  # Table"]
+    for row in range(rows):
+        width = rng.randrange(1, columns + 1) if rng.random() < ragged else columns
+        cells = ", ".join(make_cell(rng, complexity) for _ in range(width))
+        if row % 3 == 2:
+            line = f"    ({cells}{',' if width == 1 else ''}),"
+        else:
+            line = f"    [{cells}],"
+        if rng.random() < comments:
+            line += f"  # Comment {row}"
+        lines.append(line)
+        if rng.random() < comments:
+            lines.append(f"    # Comment after row {row}")
+    lines.append("]")
+    return "\n".join(lines)
+
+
+def time_best(func, repeat):
+    best = None
+    for _ in range(repeat):
+        cell_cache.clear()
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def peak_memory(func):
+    cell_cache.clear()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_scenario(code, repeat):
+    """
+    Time each stage of reformatting `code`, returning a dict of results.
+    """
+    code_cst = libcst.parse_expression(code)
+    code_ast = ast.parse(code, mode="eval").body
+    rows = render_rows(code_ast, code)
+    table = extract_table_cst(code_cst, code=code)
+    times = {
+        "parse_cst": time_best(lambda: libcst.parse_expression(code), repeat),
+        "parse_ast": time_best(lambda: ast.parse(code, mode="eval"), repeat),
+        "comments": time_best(lambda: extract_comments(code_cst), repeat),
+        "render": time_best(lambda: render_rows(code_ast, code), repeat),
+        "widths": time_best(lambda: column_widths(rows), repeat),
+        "layout": time_best(lambda: layout_table(table), repeat),
+        "reformat": time_best(lambda: reformat(code), repeat),
+        "reformat_fast": time_best(lambda: reformat(code, engine=Engine.FAST), repeat),
+    }
+    memory = {
+        "reformat": peak_memory(lambda: reformat(code)),
+        "reformat_fast": peak_memory(lambda: reformat(code, engine=Engine.FAST)),
+    }
+    return {"times": times, "peak_memory": memory}
+
+
+def print_results(name, params, results):
+    rows, columns, complexity, comments, ragged = params
+    print(f"{name}: {rows} rows x {columns} columns, {complexity}, comments={comments}, ragged={ragged}")
+    for stage, duration in results["times"].items():
+        print(f"  {stage:<14} {duration * 1000:10.2f} ms")
+    for stage, peak in results["peak_memory"].items():
+        print(f"  {stage:<14} {peak / 1e6:10.2f} MB peak")
+
+
+def compare(results, baseline, threshold, min_time):
+    """
+    Print the changes from the baseline, returning the number of regressions.
+    """
+    regressions = 0
+    print(f"Compared with {baseline['version']} (Python {baseline['python']}):")
+    for name, scenario in results.items():
+        if name not in baseline["scenarios"]:
+            continue
+        old = baseline["scenarios"][name]
+        if old["params"] != scenario["params"]:
+            print(f"  {name}: parameters differ from the baseline, skipped")
+            continue
+        for kind, unit, scale in [("times", "ms", 1000), ("peak_memory", "MB", 1e-6)]:
+            for stage, value in scenario[kind].items():
+                old_value = old[kind].get(stage)
+                if old_value is None:
+                    continue
+                ratio = value / old_value if old_value else 1.0
+                regressed = ratio > 1 + threshold and (kind != "times" or value - old_value > min_time)
+                regressions += regressed
+                print(
+                    f"  {name:<10} {stage:<14} {old_value * scale:10.2f} -> {value * scale:10.2f} {unit}"
+                    f"  {ratio:5.2f}x{'  REGRESSION' if regressed else ''}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Scenario to run (all)")
+    parser.add_argument("--rows", type=int, help="Run a custom scenario with this many rows")
+    parser.add_argument("--columns", type=int, default=6)
+    parser.add_argument("--complexity", choices=COMPLEXITIES, default="mixed")
+    parser.add_argument("--comments", type=float, default=0.0, help="Fraction of rows with comments")
+    parser.add_argument("--ragged", type=float, default=0.0, help="Fraction of rows with fewer cells")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs to take the best time of (5)")
+    parser.add_argument("--save", metavar="FILE", help="Save the results as JSON, for --compare")
+    parser.add_argument("--compare", metavar="FILE", help="Compare with results saved with --save")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Slowdown reported as a regression (0.1)")
+    parser.add_argument("--min-time", type=float, default=0.001, help="Ignore slowdowns smaller than this (0.001s)")
+    args = parser.parse_args()
+
+    if args.rows is not None:
+        scenarios = {"custom": (args.rows, args.columns, args.complexity, args.comments, args.ragged)}
+    else:
+        scenarios = {name: SCENARIOS[name] for name in args.scenario or SCENARIOS}
+
+    results = {}
+    for name, params in scenarios.items():
+        code = make_table(*params)
+        results[name] = dict(params=list(params), **run_scenario(code, args.repeat))
+        print_results(name, params, results[name])
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {"version": VERSION, "python": platform.python_version(), "scenarios": results}, f, indent=2
+            )
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_time)
+        if regressions:
+            print(f"{regressions} regression(s)")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,14 @@
 #!/usr/bin/env python
+import os
+
 from setuptools import setup
 
-setup()
+ext_modules = []
+if os.environ.get("TABLE_FORMAT_USE_MYPYC") == "1":
+    # Optional compiled build of the code that runs for every row and cell. It
+    # needs mypy installed, and the pure Python version is used without it.
+    from mypyc.build import mypycify
+
+    ext_modules = mypycify(["src/table_format/core.py"], opt_level="3")
+
+setup(ext_modules=ext_modules)
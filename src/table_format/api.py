@@ -1,3 +1,1105 @@
 # -*- coding: utf-8 -*-
 
 """Main code."""
+import array
+import ast
+import math
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import ast_decompiler.decompiler
+import libcst
+import libcst.metadata
+from libcst._nodes.internal import CodegenState
+
+from . import Engine, QuoteStyle
+
+# Some of these are only imported so that they can still be used from here.
+from .core import (  # noqa: F401
+    CLOSER,
+    ITEM_SEP,
+    ONE_INDENT,
+    NoqaMarkers,
+    TableLayout,
+    add_noqa_markers,
+    append_comment,
+    column_widths,
+    fast_render_cell,
+    fast_render_number,
+    get_indent_size,
+    parse_noqa_from_comment,
+    render_string,
+)
+
+OPENER = {
+    libcst.List: "[",
+    libcst.Tuple: "(",
+}
+
+
+def reformat(
+    python_code: str,
+    align_commas: bool = False,
+    guess_indent: bool = False,
+    add_noqa: List[str] = None,
+    quote_style: QuoteStyle = QuoteStyle.SINGLE,
+    engine: Engine = Engine.LIBCST,
+    stats: "ReformatStats" = None,
+    workers: int = 1,
+    timeout_ms: Optional[float] = None,
+    max_cells: Optional[int] = None,
+):
+    """
+    Reformat list of lists as fixed width table
+
+    With ``engine="fast"``, the table is split up using the tokenizer rather
+    than libcst, falling back to libcst for anything the tokenizer engine
+    doesn't handle. The output is the same either way.
+
+    With more than one of `workers`, big tables with many cells that need the
+    decompiler have those cells rendered in that many worker processes.
+
+    `timeout_ms` and `max_cells` limit how long reformatting can take, and how
+    many cells the table can have. Going over either raises `BudgetExceeded`.
+    They are checked between stages and between rows, so a single stage that
+    can't be split up, like parsing, can go over the time limit.
+
+    Pass a `ReformatStats` as ``stats`` to find out where the time goes. To
+    reformat many tables with the same options, use a `TableFormatter`.
+    """
+    formatter = TableFormatter(
+        align_commas=align_commas,
+        guess_indent=guess_indent,
+        add_noqa=add_noqa,
+        quote_style=quote_style,
+        engine=engine,
+        workers=workers,
+        timeout_ms=timeout_ms,
+        max_cells=max_cells,
+    )
+    return formatter.format(python_code, stats=stats)
+
+
+class TableFormatter:
+    """
+    Reformats tables with a fixed set of options, like `reformat`.
+
+    The options are checked and normalized once, and the ``noqa`` comments
+    that are worked out are kept for later tables, so reuse one of these to
+    reformat many tables.
+    """
+
+    def __init__(
+        self,
+        align_commas: bool = False,
+        guess_indent: bool = False,
+        add_noqa: List[str] = None,
+        quote_style: QuoteStyle = QuoteStyle.SINGLE,
+        engine: Engine = Engine.LIBCST,
+        workers: int = 1,
+        timeout_ms: Optional[float] = None,
+        max_cells: Optional[int] = None,
+    ):
+        if workers < 1:
+            raise ValueError(f"workers must be at least 1, not {workers!r}")
+        if timeout_ms is not None and timeout_ms <= 0:
+            raise ValueError(f"timeout_ms must be positive, not {timeout_ms!r}")
+        if max_cells is not None and max_cells < 0:
+            raise ValueError(f"max_cells can't be negative, not {max_cells!r}")
+        self.align_commas = align_commas
+        self.guess_indent = guess_indent
+        self.quote_style = QuoteStyle(quote_style)
+        self.engine = Engine(engine)
+        self.workers = workers
+        self.timeout_ms = timeout_ms
+        self.max_cells = max_cells
+        self.noqa_markers = NoqaMarkers(add_noqa or [])
+
+    @property
+    def add_noqa(self) -> List[str]:
+        return self.noqa_markers.items
+
+    def format(self, python_code: str, stats: "ReformatStats" = None) -> str:
+        """
+        Reformat list of lists as fixed width table.
+        """
+        if python_code.strip() == "":
+            return ""
+        budget = None
+        if self.timeout_ms is not None or self.max_cells is not None:
+            # The time limit is for each call.
+            budget = Budget(timeout_ms=self.timeout_ms, max_cells=self.max_cells)
+        table = extract_table(
+            python_code.strip(),
+            quote_style=self.quote_style,
+            engine=self.engine,
+            stats=stats,
+            workers=self.workers,
+            budget=budget,
+        )
+        indent, initial_indent, final_indent = table_indents(python_code, guess_indent=self.guess_indent)
+        if stats is not None:
+            stats.count_table(table)
+        with timed_stage(stats, "layout"):
+            return layout_table(
+                table,
+                indent=indent,
+                initial_indent=initial_indent,
+                final_indent=final_indent,
+                align_commas=self.align_commas,
+                noqa_markers=self.noqa_markers,
+                budget=budget,
+            )
+
+
+def extract_table(
+    code: str,
+    quote_style: QuoteStyle = QuoteStyle.SINGLE,
+    engine: Engine = Engine.LIBCST,
+    stats: "ReformatStats" = None,
+    workers: int = 1,
+    budget: "Budget" = None,
+):
+    """
+    Parse a list of lists, and extract a Table from it with the given engine.
+
+    With more than one of `workers`, the cells that need the decompiler are
+    rendered after the rest, in that many processes if there are enough.
+    `budget` is checked between stages and between rows.
+    """
+    if Engine(engine) == Engine.FAST:
+        from .tokens import Unsupported, tokenize_table
+
+        direct_cells = stats.direct_cells if stats is not None else 0
+        deferred = DeferredCells() if workers > 1 else None
+        try:
+            with timed_stage(stats, "tokenize"):
+                table = tokenize_table(code, quote_style=quote_style, stats=stats, deferred=deferred, budget=budget)
+            if deferred is not None:
+                check_budget(budget)
+                with timed_stage(stats, "render"):
+                    try:
+                        deferred.fill(table.rows, quote_style, workers=workers, stats=stats)
+                    except SyntaxError:
+                        raise Unsupported()
+            return table
+        except Unsupported:
+            if stats is not None:
+                # The libcst engine will count these cells again.
+                stats.direct_cells = direct_cells
+                stats.engine_fallbacks += 1
+            if budget is not None:
+                budget.cells = 0
+    check_budget(budget)
+    try:
+        with timed_stage(stats, "parse"):
+            code_cst = libcst.parse_expression(code)
+    except Exception:
+        raise AssertionError("Couldn't parse input as Python code")
+    check_budget(budget)
+    # Only the extracted cells and comments are returned, so the CST can be
+    # freed before the table is laid out.
+    deferred = DeferredCells() if workers > 1 else None
+    table = extract_table_cst(
+        code_cst, code=code, quote_style=quote_style, stats=stats, deferred=deferred, budget=budget
+    )
+    if deferred is not None:
+        # Freed before starting worker processes too, which are copies of this one.
+        del code_cst
+        check_budget(budget)
+        with timed_stage(stats, "render"):
+            deferred.fill(table.rows, quote_style, workers=workers, stats=stats)
+    return table
+
+
+def table_indents(python_code: str, guess_indent: bool = False):
+    """
+    Return the indent for rows, and the indents before the opening and closing brackets, for the code of a table.
+    """
+    # Restore the initial indent, so code will copy-paste directly into
+    # where it came from.
+    initial_indent_size = get_indent_size(python_code)
+    second_line = None
+    if guess_indent:
+        # We assuming code looks like this:
+        # def test_foo():
+        #     assert answer == [
+        #         [a, b, c],
+        #         [def, ghi, jkl],
+        #     ]
+        #
+        # The user has selected text from first '['
+        # We remove any comment lines
+        lines = python_code.strip().split("\n")
+        lines = [line for line in lines if not line.strip().startswith("#")]
+        if len(lines) > 1:
+            second_line = lines[1]
+    return indents_from_lines(initial_indent_size, second_line)
+
+
+def indents_from_lines(initial_indent_size: int, second_line: Optional[str] = None):
+    """
+    Return the indents like `table_indents`, from the spaces before the code, and
+    the second line that isn't a comment, if the indent is to be guessed from it.
+    """
+    indent = " " * ONE_INDENT
+    final_indent = ""
+    if second_line is not None:
+        indent_size = get_indent_size(second_line)
+        indent = " " * indent_size
+        final_indent = " " * max(indent_size - ONE_INDENT, 0)
+    return indent, " " * initial_indent_size, final_indent
+
+
+def reformat_table_cst(
+    code_cst: libcst.BaseExpression,
+    code: str = None,
+    indent: str = " " * ONE_INDENT,
+    initial_indent: str = "",
+    final_indent: str = "",
+    align_commas: bool = False,
+    add_noqa: List[str] = None,
+    quote_style: QuoteStyle = QuoteStyle.SINGLE,
+    stats: "ReformatStats" = None,
+    noqa_markers: "NoqaMarkers" = None,
+):
+    """
+    Reformat an already parsed list of lists as fixed width table
+
+    `code` is the source code that `code_cst` was parsed from. It will be
+    regenerated from `code_cst` if not passed, which is slow for big tables.
+    `noqa_markers` can be passed instead of `add_noqa`, as for `layout_table`.
+    """
+    table = extract_table_cst(code_cst, code=code, quote_style=quote_style, stats=stats)
+    if stats is not None:
+        stats.count_table(table)
+    with timed_stage(stats, "layout"):
+        return layout_table(
+            table,
+            indent=indent,
+            initial_indent=initial_indent,
+            final_indent=final_indent,
+            align_commas=align_commas,
+            add_noqa=add_noqa,
+            noqa_markers=noqa_markers,
+        )
+
+
+class ReformatStats:
+    """
+    Timings and counts from `reformat` and `reformat_file`, for finding out where the time goes.
+
+    Pass an instance as ``stats``. Times and counts are added to, so one instance
+    can collect stats for many calls.
+    """
+
+    def __init__(self):
+        self.durations = {}  # Seconds spent in each stage
+        self.tables = 0
+        self.rows = 0
+        self.cells = 0
+        self.direct_cells = 0  # Written directly, without the decompiler
+        self.decompiled_cells = 0  # Rendered with the decompiler, rather than taken from the cell cache
+        self.engine_fallbacks = 0  # Times the fast engine had to fall back to libcst
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.perf_counter() - start
+
+    def count_table(self, table: "Table"):
+        self.tables += 1
+        self.rows += len(table.rows)
+        self.cells += sum(len(row) for row in table.rows)
+
+    @property
+    def cached_cells(self):
+        return self.cells - self.direct_cells - self.decompiled_cells
+
+    def report(self):
+        """
+        Return a summary of the stats, for people to read.
+        """
+        total = sum(self.durations.values())
+        lines = []
+        for name, duration in self.durations.items():
+            percent = duration / total * 100 if total else 0.0
+            lines.append(f"{name:<12} {duration * 1000:10.2f} ms {percent:5.1f}%")
+        lines.append(f"{'total':<12} {total * 1000:10.2f} ms")
+        lines.append(f"tables: {self.tables}, rows: {self.rows}, cells: {self.cells}")
+        lines.append(
+            f"cells written directly: {self.direct_cells}, from cache: {self.cached_cells}, "
+            f"decompiled: {self.decompiled_cells}"
+        )
+        if self.engine_fallbacks:
+            lines.append(f"fast engine fallbacks to libcst: {self.engine_fallbacks}")
+        return "".join(line + "\n" for line in lines)
+
+
+def timed_stage(stats: ReformatStats, name: str):
+    """
+    Time a stage into `stats`, or do nothing if it is None.
+    """
+    return nullcontext() if stats is None else stats.stage(name)
+
+
+class BudgetExceeded(Exception):
+    """
+    Reformatting was stopped because it went over the `timeout_ms` or `max_cells` given to `reformat`.
+    """
+
+
+class Budget:
+    """
+    The limits on a single call to `reformat`, and how much of them has been used.
+    """
+
+    def __init__(self, timeout_ms: Optional[float] = None, max_cells: Optional[int] = None):
+        self.timeout_ms = timeout_ms
+        self.deadline = None if timeout_ms is None else time.perf_counter() + timeout_ms / 1000
+        self.max_cells = max_cells
+        self.cells = 0
+
+    def check(self, cells: int = 0):
+        """
+        Add `cells` to the cells used, and raise BudgetExceeded if over either limit.
+        """
+        self.cells += cells
+        if self.max_cells is not None and self.cells > self.max_cells:
+            raise BudgetExceeded(f"Table has more than {self.max_cells} cells")
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise BudgetExceeded(f"Reformatting took more than {self.timeout_ms} ms")
+
+
+def check_budget(budget: Budget, cells: int = 0):
+    """
+    Check `budget`, or do nothing if it is None.
+    """
+    if budget is not None:
+        budget.check(cells)
+
+
+class Table(NamedTuple):
+    """
+    The parts of a table needed to lay it out, with each cell already rendered.
+    """
+
+    rows: List[List[str]]
+    row_types: List[str]  # Opening bracket of each row
+    opening_comment: str  # On the same line as the opening bracket
+    initial_comments: List[str]  # Lines before the first row
+    end_of_row_comments: List[str]
+    after_row_comments: List[str]  # Lines after each row, joined with newlines
+    final_comments: List[str]  # Lines after the last row
+
+
+def extract_table_cst(
+    code_cst: libcst.BaseExpression,
+    code: str = None,
+    quote_style: QuoteStyle = QuoteStyle.SINGLE,
+    stats: "ReformatStats" = None,
+    deferred: "DeferredCells" = None,
+    budget: Budget = None,
+):
+    """
+    Extract a Table from a list of lists parsed with libcst.
+
+    If `deferred` is passed, cells that need the decompiler are added to it,
+    and left as None in the rows.
+    """
+    # Validate input
+    if not isinstance(code_cst, libcst.List):
+        raise AssertionError("Expected a list expression as single input expression.")
+    for element in code_cst.elements:
+        if not isinstance(element.value, (libcst.List, libcst.Tuple)):
+            raise AssertionError(f"Expected each sub element to be a list or tuple, found {element.value}.")
+
+    if code is None:
+        code = cst_node_to_code(code_cst)
+    code = code.strip()
+    with timed_stage(stats, "render"):
+        code_ast = ast.parse(code, mode="eval").body
+        check_budget(budget)
+        rows = render_rows(code_ast, code, quote_style=quote_style, stats=stats, deferred=deferred, budget=budget)
+    check_budget(budget)
+    with timed_stage(stats, "comments"):
+        comments = extract_comments(code_cst)
+    return Table(rows=rows, row_types=[OPENER[type(element.value)] for element in code_cst.elements], **comments)
+
+
+def render_rows(
+    code_ast: ast.List,
+    code: str,
+    quote_style: QuoteStyle = QuoteStyle.SINGLE,
+    stats: "ReformatStats" = None,
+    deferred: "DeferredCells" = None,
+    budget: Budget = None,
+):
+    """
+    Render the cells of each row of a list of lists parsed with `ast` from `code`.
+    """
+    # Parsing the whole table with `ast` once, and then rendering each cell
+    # from that, is much faster than parsing each cell separately.
+    get_source = source_segment_getter(code)
+    rows = []
+    for row_ast in code_ast.elts:
+        row = [
+            render_cell(cell_ast, get_source, quote_style, stats=stats, deferred=deferred)
+            for cell_ast in unwrap_starred(row_ast).elts
+        ]
+        check_budget(budget, len(row))
+        rows.append(row)
+    return rows
+
+
+def extract_comments(code_cst: libcst.List):
+    """
+    Collect the comments from a list of lists parsed with libcst, as a dict of Table fields.
+    """
+    # This is the most fragile bit - it would be easy to miss things here. The
+    # alternative would a very different structure for the whole code, that
+    # transforms code_cst, adjusting whitespace as we go. It might be harder and
+    # more bug prone however. We cannot support comments in every location either,
+    # so it might be simpler this way.
+
+    # Comment on the same line as the opening bracket
+    if getattr(getattr(code_cst.lbracket.whitespace_after, "first_line", None), "comment", None):
+        opening_comment = code_cst.lbracket.whitespace_after.first_line.comment.value
+    else:
+        opening_comment = ""
+
+    # Comments before first row
+    if hasattr(code_cst.lbracket.whitespace_after, "empty_lines"):
+        initial_comments = [
+            (line.comment.value if line.comment is not None else "") + "\n"
+            for line in code_cst.lbracket.whitespace_after.empty_lines
+        ]
+    else:
+        initial_comments = []
+
+    # Comments at the end of each row - paired with rows
+    end_of_row_comments = []
+    for element in code_cst.elements:
+        if (
+            hasattr(element.comma, "whitespace_after")
+            and hasattr(element.comma.whitespace_after, "first_line")
+            and getattr(element.comma.whitespace_after.first_line, "comment", None)
+        ):
+            comment = element.comma.whitespace_after.first_line.comment.value
+        else:
+            comment = ""
+        end_of_row_comments.append(comment)
+    # Last row comment is attached to rbracket of main expression
+    if hasattr(code_cst.rbracket.whitespace_before, "first_line") and getattr(
+        code_cst.rbracket.whitespace_before.first_line, "comment", None
+    ):
+        end_of_row_comments[-1] = code_cst.rbracket.whitespace_before.first_line.comment.value
+
+    # Comments on their own lines after each row - these will be paired with rows
+    after_row_comments = []
+    for element in code_cst.elements:
+        if hasattr(element.comma, "whitespace_after") and hasattr(element.comma.whitespace_after, "empty_lines"):
+            comment = "\n".join(
+                getattr(line.comment, "value", "") for line in element.comma.whitespace_after.empty_lines
+            )
+        else:
+            comment = ""
+        after_row_comments.append(comment)
+
+    # Comments on their own lines after the last row
+    if hasattr(code_cst.rbracket.whitespace_before, "empty_lines"):
+        final_comments = [
+            (line.comment.value if line.comment is not None else "") + "\n"
+            for line in code_cst.rbracket.whitespace_before.empty_lines
+        ]
+    else:
+        final_comments = []
+
+    return dict(
+        opening_comment=opening_comment,
+        initial_comments=initial_comments,
+        end_of_row_comments=end_of_row_comments,
+        after_row_comments=after_row_comments,
+        final_comments=final_comments,
+    )
+
+
+def layout_table(
+    table: Table,
+    indent: str = " " * ONE_INDENT,
+    initial_indent: str = "",
+    final_indent: str = "",
+    align_commas: bool = False,
+    add_noqa: List[str] = None,
+    col_widths: List[int] = None,
+    noqa_markers: "NoqaMarkers" = None,
+    budget: Budget = None,
+):
+    """
+    Lay out a Table with fixed width columns
+
+    This is linear in the number of cells, and builds each output line as a
+    single string, so that very big tables don't need lots of small fragments.
+    `col_widths` are worked out from the rows, if not passed. `noqa_markers`
+    can be passed instead of `add_noqa`, to share its work between tables.
+    The time limit of `budget` is checked between rows.
+    """
+    if noqa_markers is None:
+        noqa_markers = NoqaMarkers(add_noqa or [])
+
+    if col_widths is None:
+        col_widths = column_widths(table.rows)
+    layout = TableLayout(
+        col_widths,
+        indent=indent,
+        initial_indent=initial_indent,
+        final_indent=final_indent,
+        align_commas=align_commas,
+        noqa_markers=noqa_markers,
+    )
+    output = [layout.head(table.opening_comment, table.initial_comments)]
+    lines = map(layout.row, table.rows, table.row_types, table.end_of_row_comments, table.after_row_comments)
+    if budget is not None:
+        lines = budget_checked(lines, budget)
+    output.extend(lines)
+    output.append(layout.tail(table.final_comments))
+    return "".join(output)
+
+
+def budget_checked(items: Iterable, budget: Budget) -> Iterator:
+    """
+    Yield the items, checking the time limit of `budget` before each one.
+    """
+    for item in items:
+        budget.check()
+        yield item
+
+
+def reformat_file(
+    source: str,
+    align_commas: bool = False,
+    add_noqa: List[str] = None,
+    quote_style: QuoteStyle = QuoteStyle.SINGLE,
+    stats: "ReformatStats" = None,
+    lines: List[Tuple[int, int]] = None,
+):
+    """
+    Reformat all the tables found in a Python module.
+
+    A table is a multi-line list of lists/tuples that appears inside a
+    ``# fmt: off`` / ``# fmt: on`` block. The module is parsed once, and the
+    tables are reformatted using the indentation of the line they start on.
+
+    If `lines` is given, as a list of (start, end) line numbers, only the tables
+    that overlap those lines are reformatted. The module isn't parsed with
+    libcst then, just those tables.
+    """
+    if lines is None:
+        tables, newline = find_tables(source, stats=stats)
+    else:
+        from .git_diff import find_changed_tables
+
+        tables, newline = find_changed_tables(source, lines, stats=stats)
+    noqa_markers = NoqaMarkers(add_noqa or [])
+    output = []
+    last_offset = 0
+    for table in tables:
+        reformatted = reformat_table_cst(
+            table.cst,
+            code=source[table.start : table.end],
+            indent=table.indent + " " * ONE_INDENT,
+            final_indent=table.indent,
+            align_commas=align_commas,
+            quote_style=quote_style,
+            stats=stats,
+            noqa_markers=noqa_markers,
+        )
+        if newline != "\n":
+            reformatted = reformatted.replace("\n", newline)
+        output.append(source[last_offset : table.start])
+        output.append(reformatted)
+        last_offset = table.end
+    output.append(source[last_offset:])
+    return "".join(output)
+
+
+class FoundTable(NamedTuple):
+    cst: libcst.List
+    start: int  # Offsets in the source code
+    end: int
+    indent: str  # Of the line that the table starts on
+
+
+def find_tables(source: str, stats: ReformatStats = None):
+    """
+    Find the tables in a Python module that `reformat_file` would reformat.
+
+    Returns a list of FoundTable, and the newline used by the module.
+    """
+    try:
+        with timed_stage(stats, "parse"):
+            module = libcst.parse_module(source)
+    except Exception:
+        raise AssertionError("Couldn't parse input as Python code")
+
+    lines = split_lines(source)
+    line_offsets = [0]
+    for line in lines:
+        line_offsets.append(line_offsets[-1] + len(line))
+
+    with timed_stage(stats, "find tables"):
+        finder = TableFinder(find_fmt_off_lines(lines))
+        libcst.metadata.MetadataWrapper(module, unsafe_skip_copy=True).visit(finder)
+
+    tables = [
+        FoundTable(
+            cst=table_cst,
+            start=line_offsets[code_range.start.line - 1] + code_range.start.column,
+            end=line_offsets[code_range.end.line - 1] + code_range.end.column,
+            indent=" " * get_indent_size(lines[code_range.start.line - 1]),
+        )
+        for table_cst, code_range in finder.tables
+    ]
+    return tables, module.default_newline
+
+
+def find_fmt_off_lines(lines: List[str]):
+    """
+    Return the set of (1-based) line numbers that are inside ``# fmt: off`` blocks
+    """
+    fmt_off_lines = set()
+    fmt_off = False
+    for lineno, line in enumerate(lines, start=1):
+        stripped = line.strip()
+        if stripped == "# fmt: off":
+            fmt_off = True
+        elif stripped == "# fmt: on":
+            fmt_off = False
+        elif fmt_off:
+            fmt_off_lines.add(lineno)
+    return fmt_off_lines
+
+
+class TableFinder(libcst.CSTVisitor):
+    METADATA_DEPENDENCIES = (libcst.metadata.PositionProvider,)
+
+    def __init__(self, fmt_off_lines):
+        super().__init__()
+        self.fmt_off_lines = fmt_off_lines
+        self.tables = []
+
+    def visit_List(self, node):
+        code_range = self.get_metadata(libcst.metadata.PositionProvider, node)
+        if code_range.start.line in self.fmt_off_lines and is_table(node, code_range):
+            self.tables.append((node, code_range))
+            return False
+        return True
+
+
+def is_table(node: libcst.List, code_range):
+    """
+    Return True if the list node should be formatted as a table.
+    """
+    return code_range.start.line != code_range.end.line and has_table_rows(node)
+
+
+def has_table_rows(node: libcst.List):
+    """
+    Return True if the list node is made up of rows that can be reformatted.
+    """
+    if not node.elements:
+        return False
+    for element in node.elements:
+        if isinstance(element, libcst.StarredElement) or not isinstance(element.value, (libcst.List, libcst.Tuple)):
+            return False
+        # Comments inside rows would be lost when reformatting.
+        if contains_comment(element.value):
+            return False
+    return True
+
+
+def contains_comment(node: libcst.CSTNode):
+    finder = CommentFinder()
+    node.visit(finder)
+    return finder.found
+
+
+class CommentFinder(libcst.CSTVisitor):
+    def __init__(self):
+        super().__init__()
+        self.found = False
+
+    def visit_Comment(self, node):
+        self.found = True
+
+
+def cst_node_to_code(node):
+    state = CodegenState(default_indent=4, default_newline="\n")
+    node._codegen(state)
+    return "".join(state.tokens)
+
+
+def reformat_as_single_line(python_code, quote_style: QuoteStyle = QuoteStyle.SINGLE):
+    python_code = python_code.strip()
+    return cell_cache.get_or_render(
+        (python_code, quote_style),
+        lambda: reformat_ast_as_single_line(ast.parse(python_code).body[0].value, quote_style=quote_style),
+    )
+
+
+def render_cell(
+    node: ast.expr, get_source, quote_style: QuoteStyle, stats: "ReformatStats" = None, deferred: "DeferredCells" = None
+):
+    """
+    Render a cell from its AST node.
+
+    Simple literals and names are written directly. Anything else goes through
+    the decompiler, using the cache keyed on the cell's source code. If
+    `deferred` is passed, cells that aren't in the cache are added to it, and
+    None is returned for them.
+    """
+    rendered = fast_render_cell(node, quote_style)
+    if rendered is not None:
+        if stats is not None:
+            stats.direct_cells += 1
+        # Big tables often repeat the same values, so share the strings.
+        return sys.intern(rendered)
+    if deferred is not None:
+        source = get_source(node)
+        rendered = cell_cache.get((source, quote_style))
+        if rendered is None:
+            deferred.add(source, node)
+        return rendered
+
+    def render():
+        rendered = reformat_ast_as_single_line(node, quote_style=quote_style)
+        if stats is not None:
+            stats.decompiled_cells += 1
+        return rendered
+
+    return cell_cache.get_or_render((get_source(node), quote_style), render)
+
+
+def parse_cell(source: str) -> ast.expr:
+    # Parentheses allow line breaks inside the cell, like the brackets around
+    # it did, and don't change the meaning of anything that isn't a tuple.
+    return ast.parse(f"({source})", mode="eval").body
+
+
+# Below this many different cells to decompile, they are rendered in-process
+# even with more than one worker, as starting the worker processes would take
+# longer. Each takes about 0.1 ms.
+PARALLEL_RENDER_MIN_CELLS = 2000
+
+
+class DeferredCells:
+    """
+    Cells that need the decompiler, collected while a table is extracted, to be rendered together afterwards.
+
+    This lets them be rendered in worker processes. Only the source code of
+    each cell is sent to the workers, which parse it again, as that is much
+    quicker than sending AST nodes.
+    """
+
+    def __init__(self):
+        # The source of each cell left out of the rows, in order
+        self.sources = []
+        # The AST node for each different source, or None if there isn't one
+        self.nodes = {}
+
+    def add(self, source: str, node: ast.expr = None):
+        self.sources.append(source)
+        if source not in self.nodes:
+            self.nodes[source] = node
+
+    def fill(self, rows: List[list], quote_style: QuoteStyle, workers: int = 1, stats: "ReformatStats" = None):
+        """
+        Render the cells, and put them in place of the Nones in `rows`.
+
+        Raises SyntaxError if a cell without an AST node doesn't parse.
+        """
+        rendered = self.render(quote_style, workers=workers, stats=stats)
+        sources = iter(self.sources)
+        for row in rows:
+            for idx, cell in enumerate(row):
+                if cell is None:
+                    row[idx] = rendered[next(sources)]
+
+    def render(self, quote_style: QuoteStyle, workers: int = 1, stats: "ReformatStats" = None) -> Dict[str, str]:
+        sources = list(self.nodes)
+        rendered = {}
+        if workers > 1 and len(sources) >= PARALLEL_RENDER_MIN_CELLS:
+            from .batch import parallel_map
+
+            # A few chunks for each worker, to even out the work.
+            chunksize = max(1, min(256, math.ceil(len(sources) / (workers * 4))))
+            outputs = parallel_map(
+                partial(render_cell_source_or_none, quote_style=quote_style), sources, jobs=workers, chunksize=chunksize
+            )
+            rendered.update(zip(sources, outputs))
+        for source in sources:
+            output = rendered.get(source)
+            if output is None:
+                node = self.nodes[source]
+                output = reformat_ast_as_single_line(parse_cell(source) if node is None else node, quote_style)
+                rendered[source] = output
+            cell_cache.put((source, quote_style), output)
+            # Counted as they are cached, like other cells, in case a later one doesn't parse.
+            if stats is not None:
+                stats.decompiled_cells += 1
+        return rendered
+
+
+def render_cell_source_or_none(source: str, quote_style: QuoteStyle) -> Optional[str]:
+    """
+    Render a cell from its source code, in a worker process, or return None if it doesn't parse on its own.
+    """
+    try:
+        return reformat_ast_as_single_line(parse_cell(source), quote_style=quote_style)
+    except SyntaxError:
+        return None
+
+
+def reformat_ast_as_single_line(node: ast.expr, quote_style: QuoteStyle = QuoteStyle.SINGLE):
+    # The following has the unfortunate effect of not preserving quote style.
+    # But so far, for getting code formatted using normal PEP8 conventions, in a
+    # single line, this approach seems much easier compared to other approaches
+    # I've tried.
+    #
+    # Tried:
+    #
+    # - Using Black as a library: adds lots of vertical and horizontal
+    #   whitespace in for long argument lists etc.
+    #
+    # - Using libcst - would require complicated manipulation of whitespace elements
+    #   to produce the PEP8 spacings around operators etc. ast_decompiler does approx
+    #   PEP8 formatting by default.
+
+    # Wrap in an expression statement, so that the decompiler behaves exactly
+    # as if the node had been parsed on its own.
+    reformatted = ast_decompiler_decompile(ast.Expr(value=node), quote_style=quote_style).strip()
+
+    # This has the unfortunate problem of stripping `(` and `)` for tuples, which is not what we want
+    if isinstance(node, ast.Tuple):
+        reformatted = f"({reformatted})"
+    return reformatted
+
+
+def unwrap_starred(node: ast.expr):
+    return node.value if isinstance(node, ast.Starred) else node
+
+
+NEWLINES_RE = re.compile(r"\r\n|\r|\n")
+NEWLINES_BYTES_RE = re.compile(rb"\r\n|\r|\n")
+
+
+def split_lines(source: str) -> List[str]:
+    """
+    Split source code into lines, keeping the line endings.
+
+    Unlike `str.splitlines`, this only splits on the line breaks that Python
+    counts, so line numbers match those from libcst and the tokenizer.
+    """
+    lines = []
+    start = 0
+    for match in NEWLINES_RE.finditer(source):
+        lines.append(source[start : match.end()])
+        start = match.end()
+    if start < len(source):
+        lines.append(source[start:])
+    return lines
+
+
+def source_segment_getter(code: str):
+    """
+    Return a function that gets the source code of an AST node parsed from `code`.
+
+    This is like `ast.get_source_segment`, without re-splitting the source on
+    every call.
+    """
+    # AST column offsets are in UTF-8 bytes, so slice bytes unless we know they are the same.
+    if code.isascii():
+        data, newlines = code, NEWLINES_RE
+    else:
+        data, newlines = code.encode("utf-8"), NEWLINES_BYTES_RE
+    line_offsets = array.array("q", [0])
+    line_offsets.extend(m.end() for m in newlines.finditer(data))
+
+    def get_source(node):
+        start = line_offsets[node.lineno - 1] + node.col_offset
+        end = line_offsets[node.end_lineno - 1] + node.end_col_offset
+        segment = data[start:end]
+        return segment if isinstance(segment, str) else segment.decode("utf-8")
+
+    return get_source
+
+
+DEFAULT_CELL_CACHE_SIZE = 10000
+
+
+class CellCache:
+    """
+    Thread-safe LRU cache of rendered cells, keyed on (cell source, quote style).
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_CELL_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return value
+        # Render without holding the lock. Another thread may render the same
+        # thing at the same time, but the result will be the same.
+        value = render()
+        with self._lock:
+            self._data[key] = value
+            self._evict()
+        return value
+
+    def get(self, key) -> Optional[str]:
+        """
+        Return the entry for `key`, or None if there isn't one.
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value: str):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._evict()
+
+    def resize(self, maxsize: int):
+        """
+        Change the maximum number of entries. Use 0 to disable the cache.
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        """
+        Remove all entries and reset the hit/miss counters.
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(hits=self.hits, misses=self.misses, maxsize=self.maxsize, currsize=len(self._data))
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+cell_cache = CellCache()
+
+
+# Similar to ast_decompiler.decompile, with our modifications
+def ast_decompiler_decompile(code_ast, quote_style=QuoteStyle.SINGLE):
+    return get_decompiler(quote_style).decompile(code_ast)
+
+
+# A decompiler for each quote style, in each thread, as they aren't thread-safe.
+decompilers = threading.local()
+
+
+def get_decompiler(quote_style: QuoteStyle):
+    try:
+        by_quote_style = decompilers.by_quote_style
+    except AttributeError:
+        by_quote_style = decompilers.by_quote_style = {}
+    try:
+        return by_quote_style[quote_style]
+    except KeyError:
+        decompiler = by_quote_style[quote_style] = CustomDecompiler(
+            indentation=0,
+            line_length=1000000,
+            starting_indentation=0,
+            quote_style=quote_style,
+        )
+        return decompiler
+
+
+# The default quote, and the other one, for each quote style
+QUOTES = {
+    QuoteStyle.SINGLE: ("'", '"'),
+    QuoteStyle.DOUBLE: ('"', "'"),
+}
+
+
+class CustomDecompiler(ast_decompiler.decompiler.Decompiler):
+    def __init__(self, indentation, line_length, starting_indentation, quote_style=QuoteStyle.SINGLE):
+        super().__init__(indentation, line_length, starting_indentation)
+        self.quote_style = quote_style
+        self.starting_indentation = starting_indentation
+        self.quote_styles = QUOTES[QuoteStyle(quote_style)]
+
+    def decompile(self, code_ast):
+        """
+        Like `run`, but can be called many times.
+        """
+        self.lines = []
+        self.current_line = []
+        self.current_indentation = self.starting_indentation
+        self.node_stack = []
+        return self.run(code_ast)
+
+    def _get_quote_styles(self):
+        return self.quote_styles
+
+    def write_string(self, string_value, kind=None):
+        # Copy paste from super()
+        if kind is not None:
+            self.write(kind)
+        default_quote, other_quote = self._get_quote_styles()
+        if sys.version_info >= (3, 6) and self.has_parent_of_type(ast.FormattedValue):
+            delimiter = other_quote
+        else:
+            delimiter = default_quote
+        self.write(delimiter)
+        s = string_value.encode("unicode-escape").decode("ascii")
+        self.write(s.replace(delimiter, "\\" + delimiter))
+        self.write(delimiter)
+
+    @contextmanager
+    def f_literalise_if(self, condition):
+        if condition:
+            default_quote, _ = self._get_quote_styles()
+            self.write("f" + default_quote)
+            yield
+            self.write(default_quote)
+        else:
+            yield
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""Reformat many snippets of code in one process, optionally using a pool of worker processes.
+
+This is for tools that produce lots of tables, which would otherwise spend most
+of their time starting ``table-format`` for each one. Everything stays loaded
+between snippets, including the cache of rendered cells, which also applies in
+each worker process.
+"""
+import itertools
+import queue
+import threading
+from functools import partial
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Optional
+
+__all__ = ["SnippetResult", "parallel_map", "reformat_many"]
+
+
+class SnippetResult(NamedTuple):
+    output: Optional[str] = None
+    error: Optional[str] = None
+
+
+def reformat_many(snippets: Iterable[str], jobs: int = 1, **options) -> List[SnippetResult]:
+    """
+    Reformat each snippet like `reformat`, returning a SnippetResult for each, in the same order.
+
+    Errors in the snippets are returned in the results rather than raised.
+    With more than one job, the snippets are spread over that many worker
+    processes.
+    """
+    from .api import TableFormatter
+
+    if jobs < 1:
+        raise ValueError(f"jobs must be at least 1, not {jobs!r}")
+    formatter = TableFormatter(**options)
+    snippets = list(snippets)
+    # Batch snippets so that the IPC overhead is small compared to the work.
+    chunksize = max(1, min(64, len(snippets) // (jobs * 4)))
+    return list(parallel_map(partial(format_snippet, formatter), snippets, jobs=jobs, chunksize=chunksize))
+
+
+def format_snippet(formatter, code: str) -> SnippetResult:
+    try:
+        return SnippetResult(output=formatter.format(code))
+    except Exception as e:
+        return SnippetResult(error=repr(e))
+
+
+def parallel_map(func: Callable, items: Iterable, jobs: int = 1, chunksize: int = 1) -> Iterator:
+    """
+    Like `map`, but using `jobs` worker processes if it's more than 1.
+
+    Results are yielded in order, as soon as they are ready. Unlike
+    `Executor.map`, `items` is only read a little ahead of the results, in
+    another thread, so it can be a stream like the lines of stdin, and results
+    are yielded while waiting for more items. A chunk of `chunksize` items is
+    read before any of them are handled.
+    """
+    if jobs <= 1:
+        yield from map(func, items)
+        return
+    # Imported here as it's slow to import, and not always needed.
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Enough chunks to keep every worker busy, with another waiting for each.
+    futures = queue.Queue(maxsize=jobs * 2)
+    end = object()
+
+    def submit_all():
+        try:
+            iterator = iter(items)
+            while True:
+                chunk = list(itertools.islice(iterator, chunksize))
+                if not chunk:
+                    break
+                futures.put(executor.submit(map_chunk, func, chunk))
+        except BaseException as e:
+            futures.put(e)
+        futures.put(end)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        threading.Thread(target=submit_all, daemon=True).start()
+        while True:
+            future = futures.get()
+            if future is end:
+                break
+            if isinstance(future, BaseException):
+                raise future
+            yield from future.result()
+
+
+def map_chunk(func, chunk):
+    return [func(item) for item in chunk]
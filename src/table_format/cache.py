@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+"""A cache of files that are known to be formatted, so they can be skipped on the next run.
+
+There is one cache file for each combination of :mod:`table_format` version
+and formatting options, so changing either starts a new cache. It maps the
+absolute path of each file to a hash of its contents when it was last found to
+be formatted. A file whose contents still have that hash is skipped without
+being parsed.
+
+The cache files are kept in ``$TABLE_FORMAT_CACHE_DIR`` if that is set, or a
+``table-format`` directory in the user's cache directory otherwise. They can
+be deleted at any time.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from typing import Dict, Optional
+
+from .version import VERSION
+
+__all__ = ["Cache", "content_hash", "get_cache_dir"]
+
+
+def get_cache_dir() -> str:
+    """
+    Return the directory to keep cache files in.
+    """
+    cache_dir = os.environ.get("TABLE_FORMAT_CACHE_DIR")
+    if cache_dir:
+        return cache_dir
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "table-format")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return content_hash(f.read())
+
+
+class Cache:
+    """
+    The files known to be formatted with a given set of options.
+
+    Use `is_formatted` to see if a file can be skipped, `mark_formatted` once a
+    file has been found to be formatted (or has just been reformatted), and
+    `write` to save the changes.
+    """
+
+    def __init__(self, options: dict, cache_dir: str = None):
+        self.options = dict(options)
+        if "add_noqa" in self.options:
+            # The order and repeats don't change the output.
+            self.options["add_noqa"] = sorted(set(self.options["add_noqa"] or []))
+        self.cache_dir = get_cache_dir() if cache_dir is None else cache_dir
+        # Hashes from this run, so that files are only read and hashed once.
+        self.hashes: Dict[str, str] = {}
+        self.files: Dict[str, str] = {}
+        self.changed = False
+
+    @property
+    def path(self) -> str:
+        key = json.dumps([VERSION, sorted(self.options.items())], default=str)
+        return os.path.join(self.cache_dir, f"cache.{hashlib.sha256(key.encode()).hexdigest()[:16]}.json")
+
+    @classmethod
+    def read(cls, options: dict, cache_dir: str = None) -> "Cache":
+        """
+        Load the cache for these options, which is empty if there isn't one yet, or it can't be read.
+        """
+        cache = cls(options, cache_dir=cache_dir)
+        try:
+            with open(cache.path, encoding="utf-8") as f:
+                files = json.load(f)
+        except (OSError, ValueError):
+            return cache
+        if isinstance(files, dict):
+            cache.files = files
+        return cache
+
+    def is_formatted(self, path: str) -> bool:
+        path = os.path.abspath(path)
+        cached_hash = self.files.get(path)
+        if cached_hash is None:
+            return False
+        try:
+            self.hashes[path] = file_hash(path)
+        except OSError:
+            return False
+        return self.hashes[path] == cached_hash
+
+    def mark_formatted(self, path: str, formatted_hash: Optional[str] = None):
+        """
+        Record that a file is formatted.
+
+        `formatted_hash` is the `content_hash` of the contents that were found
+        to be formatted, or were written. Without it, the file is read again,
+        so a change made since it was checked would be recorded as formatted.
+        """
+        path = os.path.abspath(path)
+        if formatted_hash is None:
+            formatted_hash = self.hashes.get(path)
+        if formatted_hash is None:
+            try:
+                formatted_hash = self.hashes[path] = file_hash(path)
+            except OSError:
+                return
+        if self.files.get(path) != formatted_hash:
+            self.files[path] = formatted_hash
+            self.changed = True
+
+    def write(self):
+        """
+        Save the cache if it has changed, replacing the old one atomically.
+
+        Errors are ignored, as the cache is only there to save time.
+        """
+        if not self.changed:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".cache.", suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with open(fd, "w", encoding="utf-8") as f:
+                json.dump(self.files, f)
+            os.replace(temp_path, self.path)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.unlink(temp_path)
+            return
+        self.changed = False
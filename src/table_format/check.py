@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+"""Check whether code is already formatted, without reformatting it if possible.
+
+Most tables that are checked, e.g. in CI, are already formatted. Rather than
+rendering every cell and comparing the output, the tables are split up using the
+tokenizer, and laid out with each cell as it is written. If that doesn't give
+the same code, the table needs reformatting. If it does, the table is formatted
+if each cell is written as it would be rendered. Simple cells are checked
+directly, so the decompiler is only needed for the others. Anything that the
+tokenizer can't handle is checked by reformatting it.
+
+For whole files, the tables are also found using the tokenizer if possible,
+since parsing a module with libcst is much slower than checking its tables.
+"""
+import ast
+import io
+import keyword
+import tokenize
+from typing import List, NamedTuple
+
+from . import QuoteStyle
+from .api import (
+    NEWLINES_RE,
+    find_fmt_off_lines,
+    find_tables,
+    layout_table,
+    reformat,
+    reformat_table_cst,
+    split_lines,
+    table_indents,
+)
+from .core import ONE_INDENT, get_indent_size
+from .tokens import CLOSING_BRACKETS, OPENING_BRACKETS, TableTokenParser, Unsupported, render_cell_source
+
+__all__ = ["is_file_formatted", "is_formatted"]
+
+
+def is_formatted(
+    python_code: str,
+    align_commas: bool = False,
+    guess_indent: bool = False,
+    add_noqa: List[str] = None,
+    quote_style: QuoteStyle = QuoteStyle.SINGLE,
+    **options,
+) -> bool:
+    """
+    Return True if `reformat` would return the code unchanged, apart from trailing whitespace.
+    """
+    code = python_code.rstrip()
+    if code.strip() == "":
+        return True
+    indent, initial_indent, final_indent = table_indents(python_code, guess_indent=guess_indent)
+    formatted = check_table(
+        code,
+        indent=indent,
+        initial_indent=initial_indent,
+        final_indent=final_indent,
+        align_commas=align_commas,
+        add_noqa=add_noqa,
+        quote_style=quote_style,
+    )
+    if formatted is None:
+        formatted = reformat(
+            python_code,
+            align_commas=align_commas,
+            guess_indent=guess_indent,
+            add_noqa=add_noqa,
+            quote_style=quote_style,
+            **options,
+        ) == code
+    return formatted
+
+
+def is_file_formatted(
+    source: str,
+    align_commas: bool = False,
+    add_noqa: List[str] = None,
+    quote_style: QuoteStyle = QuoteStyle.SINGLE,
+) -> bool:
+    """
+    Return True if `reformat_file` would return the source code unchanged.
+    """
+    options = dict(align_commas=align_commas, add_noqa=add_noqa, quote_style=quote_style)
+    formatted = check_file_tables(source, **options)
+    if formatted is not None:
+        return formatted
+
+    tables, newline = find_tables(source)
+    for table in tables:
+        code = source[table.start : table.end]
+        layout_options = dict(indent=table.indent + " " * ONE_INDENT, final_indent=table.indent, **options)
+        formatted = check_table(code, newline=newline, **layout_options)
+        if formatted is None:
+            formatted = reformat_table_cst(table.cst, code=code, **layout_options).replace("\n", newline) == code
+        if not formatted:
+            return False
+    return True
+
+
+def check_file_tables(source: str, **options):
+    """
+    Check the tables in a module, finding them with the tokenizer rather than libcst.
+
+    Returns None if we can't be sure which lists `reformat_file` treats as tables.
+    """
+    if has_lone_carriage_returns(source):
+        # The tokenizer reads lines that only end with `\r` as one line.
+        return None
+    lines = split_lines(source)
+    fmt_off_lines = find_fmt_off_lines(lines)
+    try:
+        # The module must be valid for `reformat_file`, even if it has no tables.
+        ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    if not fmt_off_lines:
+        return True
+    try:
+        spans = find_list_spans(source)
+    except (tokenize.TokenError, SyntaxError):
+        return None
+    newline_match = NEWLINES_RE.search(source)
+    newline = newline_match.group() if newline_match else "\n"
+    table_end = 0
+    for span in spans:
+        if span.start < table_end or span.start_line not in fmt_off_lines or span.start_line == span.end_line:
+            continue
+        if span.uncertain:
+            return None
+        indent = " " * get_indent_size(lines[span.start_line - 1])
+        formatted = check_table(
+            source[span.start : span.end],
+            newline=newline,
+            indent=indent + " " * ONE_INDENT,
+            final_indent=indent,
+            **options,
+        )
+        if formatted is None:
+            if span.first_token in ("[", "("):
+                # Could be a table that the tokenizer can't handle.
+                return None
+            # Not a table, but there could be tables inside it.
+            continue
+        if not formatted:
+            return False
+        table_end = span.end
+    return True
+
+
+def has_lone_carriage_returns(source):
+    """
+    Return True if the source has a `\\r` without a `\\n`, which `find_list_spans` doesn't count as a line break.
+    """
+    return "\r" in source.replace("\r\n", "")
+
+
+# Tokens that a `[` is a subscript after, rather than the start of a list.
+VALUE_KEYWORDS = {"None", "True", "False"}
+SUBSCRIPTABLE_OPS = {")", "]", "}", "..."}
+
+
+class ListSpan(NamedTuple):
+    start: int
+    end: int
+    start_line: int
+    end_line: int
+    first_token: str  # The first token inside the list
+    # It might not be a list, or might be wrapped in its own parentheses, which
+    # libcst includes in the list.
+    uncertain: bool
+
+
+def find_list_spans(source: str) -> List[ListSpan]:
+    """
+    Find the list displays in a module, ordered by where they start.
+    """
+    line_offsets = [0]
+
+    def readline(_readline=io.StringIO(source).readline):
+        line = _readline()
+        line_offsets.append(line_offsets[-1] + len(line))
+        return line
+
+    spans = []
+    # For each open bracket, the start of the list if it is one
+    stack = []
+    previous = before_previous = None
+    for token in tokenize.generate_tokens(readline):
+        if token.type in (tokenize.COMMENT, tokenize.NL):
+            continue
+        if stack and stack[-1] is not None and stack[-1][-1] is None:
+            stack[-1][-1] = token.string
+        if token.type == tokenize.OP and token.string in OPENING_BRACKETS:
+            if token.string == "[" and not is_subscript(previous):
+                start = line_offsets[token.start[0] - 1] + token.start[1]
+                uncertain = (
+                    previous is not None and previous.string == "(" and not is_subscript(before_previous)
+                ) or is_soft_keyword(previous)
+                stack.append([start, token.start[0], uncertain, None])
+            else:
+                stack.append(None)
+        elif token.type == tokenize.OP and token.string in CLOSING_BRACKETS:
+            opened = stack.pop()
+            if opened is not None:
+                start, start_line, uncertain, first_token = opened
+                end = line_offsets[token.end[0] - 1] + token.end[1]
+                spans.append(ListSpan(start, end, start_line, token.end[0], first_token, uncertain))
+        before_previous, previous = previous, token
+    spans.sort()
+    return spans
+
+
+def is_subscript(previous):
+    """
+    Return True if a `[` after the token `previous` is a subscript.
+    """
+    if previous is None:
+        return False
+    if previous.type == tokenize.NAME:
+        return not keyword.iskeyword(previous.string) or previous.string in VALUE_KEYWORDS
+    if previous.type in (tokenize.NUMBER, tokenize.STRING):
+        return True
+    return previous.type == tokenize.OP and previous.string in SUBSCRIPTABLE_OPS
+
+
+def is_soft_keyword(token):
+    # e.g. `match [a, b]:`, which might be a subscript or the start of a match statement.
+    return token is not None and token.type == tokenize.NAME and token.string in ("match", "case", "type")
+
+
+def check_table(code: str, newline: str = "\n", quote_style: QuoteStyle = QuoteStyle.SINGLE, **layout_options):
+    """
+    Return whether `code` is a table laid out with `layout_options`, or None if we can't tell cheaply.
+    """
+    parser = CheckingTableTokenParser(code, quote_style=quote_style)
+    try:
+        table = parser.parse()
+    except Unsupported:
+        return None
+    if layout_table(table, **layout_options).replace("\n", newline) != code:
+        return False
+    if parser.mismatched_cells:
+        return False
+    for source in parser.unchecked_cells:
+        try:
+            if render_cell_source(source, quote_style) != source:
+                return False
+        except SyntaxError:
+            return None
+    return True
+
+
+class CheckingTableTokenParser(TableTokenParser):
+    """
+    Like TableTokenParser, but leaves each cell as it is written.
+
+    Simple cells are checked against how they would be rendered as they are
+    found, and the others are kept in `unchecked_cells`.
+    """
+
+    def __init__(self, code, quote_style=QuoteStyle.SINGLE):
+        super().__init__(code, quote_style=quote_style)
+        self.mismatched_cells = 0
+        self.unchecked_cells = []
+
+    def render_cell(self, cell_tokens):
+        source = self.cell_source(cell_tokens)
+        rendered = self.fast_render_cell(cell_tokens)
+        if rendered is None:
+            self.unchecked_cells.append(source)
+        elif rendered != source:
+            self.mismatched_cells += 1
+        return source
@@ -12,45 +12,269 @@ later, but that will cause problems--the code will get executed twice:
 
 """
 import argparse
+import contextlib
+import re
 import sys
 
 __all__ = ["main"]
 
-from . import QuoteStyle, reformat
-
-argument_parser = argparse.ArgumentParser(usage="Reads Python code from stdin and prints reformatted code to stdout")
-argument_parser.add_argument("--align-commas", action="store_true", help="Pass this to make commas aligned")
-argument_parser.add_argument(
-    "--guess-indent",
-    action="store_true",
-    help="Pass this to attempt to guess indent (from second line of text)",
-)
-argument_parser.add_argument(
-    "--add-noqa",
-    action="store",
-    help="A comma separated lists of 'noqa' items to add at the end of each line e.g. E202,E501",
-)
-argument_parser.add_argument(
-    "--quote-style",
-    action="store",
-    default="single",
-    choices=[q.value for q in QuoteStyle],
-    help="Choose which type of quote to prefer for writing strings.",
-)
+from . import Engine, QuoteStyle
+from .runner import DEFAULT_EXCLUDES, DEFAULT_INCLUDES
+
+# Exit status when reformatting stdin goes over --budget, so that editors can
+# tell it apart from input that can't be reformatted (1) and usage errors (2).
+BUDGET_EXCEEDED_STATUS = 3
+
+
+def make_argument_parser():
+    argument_parser = argparse.ArgumentParser(
+        description="Reads Python code from stdin and prints reformatted code to stdout. "
+        "If files or directories are given, all the tables inside '# fmt: off' blocks in those files are "
+        "reformatted in place."
+    )
+    argument_parser.add_argument(
+        "paths",
+        nargs="*",
+        metavar="PATH",
+        help="Python files, or directories to search for them, to reformat in place",
+    )
+    argument_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes to use when reformatting files (defaults to the number of CPUs)",
+    )
+    argument_parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Number of worker processes to render the items of a big table from stdin with (default: 1). "
+        "Only worth it for tables with thousands of different items that aren't simple values.",
+    )
+    argument_parser.add_argument(
+        "--budget",
+        type=parse_budget,
+        default={},
+        metavar="LIMITS",
+        help="Give up on reformatting a table from stdin if it takes too long or has too many items, e.g. 200ms, "
+        "5000cells or 200ms,5000cells. The input is written back unchanged, with exit status "
+        f"{BUDGET_EXCEEDED_STATUS}.",
+    )
+    argument_parser.add_argument(
+        "--include",
+        action="append",
+        metavar="GLOB",
+        help=f"Glob for files to reformat inside directories, can be repeated (default: {' '.join(DEFAULT_INCLUDES)})",
+    )
+    argument_parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="GLOB",
+        help=f"Glob for files and directories to skip, can be repeated. Always skipped: {' '.join(DEFAULT_EXCLUDES)}",
+    )
+    argument_parser.add_argument(
+        "--jsonl",
+        action="store_true",
+        help='Read JSON lines like {"id": 1, "code": "...", "options": {"align_commas": true}} from stdin, and write '
+        'a line like {"id": 1, "output": "..."} or {"id": 1, "error": "..."} for each, as soon as it is done. '
+        "Options default to those given on the command line. Use -j to spread the work over worker processes.",
+    )
+    argument_parser.add_argument(
+        "--lsp",
+        action="store_true",
+        help="Run a Language Server Protocol server on stdin and stdout, for editors. It supports formatting a "
+        "selection (textDocument/rangeFormatting), with the formatting options given here as defaults.",
+    )
+    argument_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Reformat a table from stdin by reading it twice, keeping only one row in memory at a time, for tables "
+        "too big to reformat otherwise. Input from a pipe is copied to a temporary file first.",
+    )
+    argument_parser.add_argument(
+        "--from-csv",
+        nargs="?",
+        const="excel",
+        choices=["excel", "excel-tab", "unix"],
+        metavar="DIALECT",
+        help="Read CSV data from stdin, and write it as a table of strings. The dialect is one of those of Python's "
+        "csv module: excel (the default), excel-tab for tab separated values, or unix. Like --stream, the input is "
+        "read twice, keeping only one row in memory at a time.",
+    )
+    argument_parser.add_argument(
+        "--csv-numbers",
+        action="store_true",
+        help="With --from-csv, write items that look like numbers, e.g. 12 or -3.5, as numbers rather than strings",
+    )
+    argument_parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running, and reformat the files found in the paths given (or the current directory) whenever "
+        "they change. Only the tables that overlap the changed lines are reformatted.",
+    )
+    argument_parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Don't write anything, just exit with status 1 if anything would be reformatted",
+    )
+    argument_parser.add_argument(
+        "--diff",
+        action="store_true",
+        help="Don't write anything, print a diff of what would be reformatted to stdout instead",
+    )
+    argument_parser.add_argument(
+        "--changed-only",
+        action="store_true",
+        help="Only reformat the tables that overlap lines changed since the last commit, according to git. "
+        "Files are found under the current directory if no paths are given.",
+    )
+    argument_parser.add_argument(
+        "--since",
+        metavar="REF",
+        help="Like --changed-only, but for the changes since this git commit or branch",
+    )
+    argument_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't skip files that were already formatted the last time they were checked, or update the cache",
+    )
+    argument_parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        metavar="PSTATS_FILE",
+        help="Print how long each stage of reformatting took to stderr, and save a cProfile profile if a file is "
+        "given. Files are then reformatted in a single process.",
+    )
+    add_format_arguments(argument_parser)
+    return argument_parser
+
+
+def add_format_arguments(parser):
+    """
+    Add the arguments that control formatting to an argument parser, returning their actions.
+    """
+    return [
+        parser.add_argument("--align-commas", action="store_true", help="Pass this to make commas aligned"),
+        parser.add_argument(
+            "--guess-indent",
+            action="store_true",
+            help="Pass this to attempt to guess indent (from second line of text)",
+        ),
+        parser.add_argument(
+            "--add-noqa",
+            action="store",
+            help="A comma separated lists of 'noqa' items to add at the end of each line e.g. E202,E501",
+        ),
+        parser.add_argument(
+            "--quote-style",
+            action="store",
+            default="single",
+            choices=[q.value for q in QuoteStyle],
+            help="Choose which type of quote to prefer for writing strings.",
+        ),
+        parser.add_argument(
+            "--engine",
+            action="store",
+            default="libcst",
+            choices=[e.value for e in Engine],
+            help="Choose how to parse the input. 'fast' uses the tokenizer for the common cases, "
+            "falling back to 'libcst' for anything else. The output is the same.",
+        ),
+    ]
+
+
+def parse_budget(value):
+    """
+    Parse a --budget value into keyword arguments for `reformat`. A number without a unit is in milliseconds.
+    """
+    budget = {}
+    for part in value.split(","):
+        match = re.fullmatch(r"\s*(\d+)\s*(ms|cells)?\s*", part)
+        if match is None:
+            raise argparse.ArgumentTypeError(f"invalid budget {part!r}, expected e.g. 200ms or 5000cells")
+        if int(match[1]) == 0:
+            raise argparse.ArgumentTypeError(f"invalid budget {part!r}, it must be more than 0")
+        budget["max_cells" if match[2] == "cells" else "timeout_ms"] = int(match[1])
+    return budget
+
+
+def format_options(args):
+    """
+    Convert the parsed formatting arguments to keyword arguments for `reformat`.
+    """
+    return dict(
+        align_commas=args.align_commas,
+        guess_indent=args.guess_indent,
+        add_noqa=args.add_noqa.split(",") if args.add_noqa else None,
+        quote_style=QuoteStyle(args.quote_style),
+        engine=Engine(args.engine),
+    )
 
 
 def main():
+    argument_parser = make_argument_parser()
     args = argument_parser.parse_args()
+    if args.since is not None:
+        args.changed_only = True
+    check_arguments(argument_parser, args)
+    status = run(args) if args.profile is None else run_profiled(args)
+    if status:
+        sys.exit(status)
+
+
+def check_arguments(argument_parser, args):
+    """
+    Exit with a usage error if arguments are given that would be ignored.
+    """
+    if args.lsp or args.jsonl or not (args.paths or args.changed_only or args.watch):
+        return
+    # Files are always parsed with libcst, and the indent taken from them.
+    ignored = [
+        name
+        for name, given in [
+            ("--workers", args.workers != 1),
+            ("--budget", bool(args.budget)),
+            ("--stream", args.stream),
+            ("--from-csv", args.from_csv is not None),
+            ("--guess-indent", args.guess_indent),
+            ("--engine", args.engine != "libcst"),
+        ]
+        if given
+    ]
+    if ignored:
+        argument_parser.error(f"{', '.join(ignored)} can't be used with files, only with stdin")
+
+
+def run(args, stats=None):
+    if args.lsp:
+        from .lsp import serve
+
+        return serve(defaults=args)
+    if args.jsonl:
+        return run_jsonl(args)
+    if args.watch:
+        return run_watch(args)
+    if args.paths or args.changed_only:
+        return reformat_files(args, stats=stats)
+    if args.from_csv is not None:
+        return run_from_csv(args)
+    if args.stream and not (args.check or args.diff):
+        return run_stream(args)
     input_data = sys.stdin.read()
+    if input_data.strip() == "":
+        # Nothing to reformat, so don't spend time importing the formatting code.
+        return 0
+    if args.check or args.diff:
+        return check_input(args, input_data, stats=stats)
+    # Imported here for the sake of startup time, see __init__.py
+    from .api import BudgetExceeded, reformat
+
     try:
         sys.stdout.write(
-            reformat(
-                input_data,
-                align_commas=args.align_commas,
-                guess_indent=args.guess_indent,
-                add_noqa=args.add_noqa.split(",") if args.add_noqa else None,
-                quote_style=QuoteStyle(args.quote_style),
-            )
+            reformat(input_data, stats=stats, workers=args.workers, **args.budget, **format_options(args))
         )
     except Exception as e:
         # For the sake of tools that are piping output as replacement,
@@ -58,7 +282,263 @@ def main():
         sys.stdout.write(input_data)
         # And then write the error to stderr and exit
         sys.stderr.write(repr(e) + "\n")
-        sys.exit(1)
+        return BUDGET_EXCEEDED_STATUS if isinstance(e, BudgetExceeded) else 1
+    return 0
+
+
+def check_input(args, input_data, stats=None):
+    from . import is_formatted
+    from .api import BudgetExceeded, reformat
+    from .runner import make_diff
+
+    options = format_options(args)
+    try:
+        if args.diff or args.budget:
+            # The quick check for --check doesn't keep to a budget.
+            output = reformat(input_data, stats=stats, workers=args.workers, **args.budget, **options)
+            changed = output != input_data.rstrip()
+            if changed and args.diff:
+                sys.stdout.write(make_diff(input_data.rstrip() + "\n", output + "\n", "stdin"))
+        else:
+            changed = not is_formatted(input_data, **options)
+    except Exception as e:
+        sys.stderr.write(repr(e) + "\n")
+        return BUDGET_EXCEEDED_STATUS if isinstance(e, BudgetExceeded) else 1
+    return 1 if changed and args.check else 0
+
+
+def run_stream(args):
+    """
+    Reformat stdin with `iter_reformat`, writing the output as it is produced.
+    """
+    from .stream import iter_reformat
+
+    options = format_options(args)
+    # The tokenizer is always used, with `reformat` as the fallback.
+    del options["engine"]
+    with contextlib.ExitStack() as stack:
+        file = seekable_input(sys.stdin, stack)
+        return write_pieces(file, iter_reformat(file, **options))
+
+
+def run_from_csv(args):
+    """
+    Write the CSV data from stdin as a table, with `iter_table_from_csv`.
+    """
+    import io
+
+    from .csv_table import iter_table_from_csv
+
+    options = format_options(args)
+    # There is no Python code to parse, or take the indent from.
+    del options["engine"]
+    del options["guess_indent"]
+    # Newlines inside quoted items are kept as they are, as the csv module
+    # needs, and a byte order mark, which spreadsheets often write, is skipped.
+    stdin = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+    with contextlib.ExitStack() as stack:
+        file = seekable_input(stdin, stack)
+        return write_pieces(
+            file, iter_table_from_csv(file, dialect=args.from_csv, numbers=args.csv_numbers, **options)
+        )
+
+
+def seekable_input(file, stack):
+    """
+    Return `file`, or a copy of it in a temporary file if it can't be seeked, like a pipe.
+    """
+    if file.seekable():
+        return file
+    import shutil
+    import tempfile
+
+    copy = stack.enter_context(tempfile.TemporaryFile("w+", encoding="utf-8", newline=""))
+    shutil.copyfileobj(file, copy)
+    copy.seek(0)
+    return copy
+
+
+def write_pieces(file, pieces):
+    """
+    Write the output of `iter_reformat` or similar to stdout, or the input from `file` if there is an error.
+    """
+    import shutil
+
+    start = file.tell()
+    try:
+        # Errors are raised before the first piece of output.
+        sys.stdout.write(next(pieces))
+    except Exception as e:
+        # Return what our input was, as in `run`.
+        file.seek(start)
+        shutil.copyfileobj(file, sys.stdout)
+        sys.stderr.write(repr(e) + "\n")
+        return 1
+    for piece in pieces:
+        sys.stdout.write(piece)
+    return 0
+
+
+def run_watch(args):
+    """
+    Reformat files as they change, until interrupted.
+    """
+    from .watch import watch
+
+    options = format_options(args)
+    # The indent is taken from the file, which is always parsed with libcst.
+    del options["guess_indent"]
+    del options["engine"]
+
+    def on_ready(count):
+        sys.stderr.write(f"Watching {plural(count, 'file')} for changes, press Ctrl-C to stop.\n")
+        sys.stderr.flush()
+
+    try:
+        for result in watch(
+            args.paths or ["."],
+            include=args.include,
+            exclude=DEFAULT_EXCLUDES + (args.exclude or []),
+            on_ready=on_ready,
+            **options,
+        ):
+            if result.error is not None:
+                sys.stderr.write(f"error: cannot format {result.path}: {result.error}\n")
+            else:
+                sys.stderr.write(f"reformatted {result.path}\n")
+            sys.stderr.flush()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def run_jsonl(args):
+    from functools import partial
+
+    from .batch import parallel_map
+
+    status = 0
+    for output, ok in parallel_map(partial(reformat_record, defaults=args), sys.stdin, jobs=args.jobs or 1):
+        sys.stdout.write(output)
+        sys.stdout.flush()
+        if not ok:
+            status = 1
+    return status
+
+
+def reformat_record(line, defaults):
+    """
+    Reformat the code in a line of JSON, returning the line of JSON to write for it, and whether it worked.
+    """
+    if not line.strip():
+        return "", True
+    import json
+
+    from .api import reformat
+    from .daemon import parse_options
+
+    result = {"id": None}
+    try:
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise AssertionError("Expected a JSON object")
+        result["id"] = record.get("id")
+        result["output"] = reformat(record["code"], **parse_options(record.get("options", {}), defaults=defaults))
+    except Exception as e:
+        result["error"] = repr(e)
+    return json.dumps(result) + "\n", "error" not in result
+
+
+def run_profiled(args):
+    """
+    Run, then write the stats to stderr, and save a cProfile profile if asked for.
+    """
+    import cProfile
+
+    from .api import ReformatStats
+
+    stats = ReformatStats()
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        return run(args, stats=stats)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        sys.stderr.write(stats.report())
+
+
+def reformat_files(args, stats=None):
+    from .runner import reformat_paths
+
+    options = format_options(args)
+    # The indent is taken from the file, which is always parsed with libcst.
+    del options["guess_indent"]
+    del options["engine"]
+    cache = None
+    if not args.no_cache:
+        from .cache import Cache
+
+        cache = Cache.read(options)
+    options.update(check=args.check, diff=args.diff)
+    paths = args.paths
+    if args.changed_only:
+        from .git_diff import changed_lines
+
+        paths = paths or ["."]
+        try:
+            options["changed_lines"] = changed_lines(paths, since=args.since)
+        except AssertionError as e:
+            sys.stderr.write(f"error: {e}\n")
+            return 1
+    dry_run = args.check or args.diff
+    jobs = args.jobs
+    if stats is not None:
+        # Stats can only be collected in this process.
+        options["stats"] = stats
+        jobs = 1
+    changed = unchanged = failed = bytes_written = 0
+    try:
+        for result in reformat_paths(
+            paths,
+            jobs=jobs,
+            include=args.include,
+            exclude=DEFAULT_EXCLUDES + (args.exclude or []),
+            cache=cache,
+            **options,
+        ):
+            if result.error is not None:
+                sys.stderr.write(f"error: cannot format {result.path}: {result.error}\n")
+                failed += 1
+            elif result.changed:
+                if result.diff:
+                    sys.stdout.write(result.diff)
+                sys.stderr.write(f"{'would reformat' if dry_run else 'reformatted'} {result.path}\n")
+                changed += 1
+                bytes_written += result.bytes_written
+            else:
+                unchanged += 1
+    finally:
+        # Files are only added once they are done, so a partial run can be saved too.
+        if cache is not None:
+            cache.write()
+    if dry_run:
+        sys.stderr.write(
+            f"{plural(changed, 'file')} would be reformatted, {plural(unchanged, 'file')} would be left unchanged, "
+            f"{plural(failed, 'file')} would fail to reformat.\n"
+        )
+    else:
+        sys.stderr.write(
+            f"{plural(changed, 'file')} reformatted ({plural(bytes_written, 'byte')} written), "
+            f"{plural(unchanged, 'file')} left unchanged, {plural(failed, 'file')} failed to reformat.\n"
+        )
+    return 1 if failed or (changed and args.check) else 0
+
+
+def plural(count, noun):
+    return f"{count} {noun}" + ("" if count == 1 else "s")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+"""The parts of formatting that run for every row and cell of a table.
+
+Laying out rows, rendering simple cells and adding ``noqa`` comments are kept
+here, apart from the parsing code in :mod:`table_format.api`, and fully type
+annotated, so that this module can be compiled with mypyc for speed (see
+``setup.py``). Without that, it is used as it is. Either way, the names are
+also available from :mod:`table_format.api`.
+"""
+import ast
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import parsy
+
+from . import QuoteStyle
+
+ONE_INDENT = 4  # spaces. As God intended
+
+
+CLOSER: Dict[str, str] = {
+    "[": "]",
+    "(": ")",
+}
+
+
+ITEM_SEP = ", "
+
+
+def get_indent_size(text: str) -> int:
+    return len(text) - len(text.lstrip(" "))
+
+
+# 'noqa: EXXX' markers:
+# We follow the formatting in https://flake8.pycqa.org/en/3.1.1/user/ignoring-errors.html
+# with some tolerance when parsing
+def add_noqa_markers(comment: str, new_noqa_items: List[str]) -> str:
+    return NoqaMarkers(new_noqa_items).add_to(comment)
+
+
+class NoqaMarkers:
+    """
+    Adds a fixed set of `noqa` items to comments, like `add_noqa_markers`.
+
+    Tables often have the same comment on many rows, often none at all, so the
+    result for each comment is kept.
+    """
+
+    # Comments to keep results for. The only cost of going over is that some are worked out again.
+    MAX_COMMENTS = 10000
+
+    def __init__(self, items: List[str]):
+        self.items = sorted(set(items))
+        self._item_set = set(self.items)
+        self._comments: Dict[str, str] = {}
+
+    def __reduce__(self) -> Tuple[type, Tuple[List[str]]]:
+        # For sending to worker processes. This also works when compiled, and
+        # leaves out the results, which the worker can work out again.
+        return (NoqaMarkers, (self.items,))
+
+    def add_to(self, comment: str) -> str:
+        try:
+            return self._comments[comment]
+        except KeyError:
+            pass
+        stripped = comment.lstrip(" ").lstrip("#")
+        existing_noqa_parts, main_comment = parse_noqa_from_comment(stripped)
+        noqa_parts = sorted(self._item_set.union(existing_noqa_parts))
+        if noqa_parts:
+            adjusted = ("noqa: " + ",".join(noqa_parts) + "  " + main_comment.strip()).strip()
+        else:
+            adjusted = main_comment.strip()
+        if len(self._comments) >= self.MAX_COMMENTS:
+            self._comments.clear()
+        self._comments[comment] = adjusted
+        return adjusted
+
+
+# Parsing noqa bits
+noqa_start = parsy.regex(r"noqa:\s*")
+noqa_item = parsy.regex("[A-Z][0-9]+")
+noqa_full = noqa_start >> noqa_item.sep_by(parsy.string(","))
+
+
+def parse_noqa_from_comment(comment: str) -> Tuple[List[str], str]:
+    comment = comment.strip()
+
+    try:
+        items, rest = noqa_full.parse_partial(comment)
+    except parsy.ParseError:
+        return [], comment
+    return items, rest
+
+
+def append_comment(output: List[str], indent: str, comment: str) -> None:
+    line = indent + comment
+    if not line.strip():
+        # Whitespace only, preserve only vertical whitespace
+        # so that we're not adding trailing whitespace to lines
+        output.append(line.lstrip(" "))
+    else:
+        output.append(line)
+
+
+class TableLayout:
+    """
+    Lays out the parts of a table, given the widths of its columns.
+
+    This lets a table be output a row at a time, without having all of it in
+    memory, as well as being used by `layout_table`.
+    """
+
+    def __init__(
+        self,
+        col_widths: List[int],
+        indent: str = " " * ONE_INDENT,
+        initial_indent: str = "",
+        final_indent: str = "",
+        align_commas: bool = False,
+        noqa_markers: Optional[NoqaMarkers] = None,
+    ):
+        self.col_widths = col_widths
+        self.indent = indent
+        self.initial_indent = initial_indent
+        self.final_indent = final_indent
+        self.align_commas = align_commas
+        self.noqa_markers = NoqaMarkers([]) if noqa_markers is None else noqa_markers
+
+        # Padding before end of row comments, indexed by the number of cells in the
+        # row, so that comments on ragged rows line up with the others.
+        col_count = len(col_widths)
+        comment_paddings = [0] * (col_count + 1)
+        for idx in reversed(range(col_count)):
+            comment_paddings[idx] = comment_paddings[idx + 1] + col_widths[idx] + (len(ITEM_SEP) if idx > 0 else 0)
+        self.comment_starts = [" " * padding + "  # " for padding in comment_paddings]
+
+    def head(self, opening_comment: str, initial_comments: List[str]) -> str:
+        """
+        Return the opening bracket line, and any comments before the first row.
+        """
+        output = [self.initial_indent + "["]
+        if opening_comment:
+            output.append("  " + opening_comment)
+        output.append("\n")
+        for comment in initial_comments:
+            append_comment(output, self.indent, comment)
+        return "".join(output)
+
+    def row(self, row: List[str], row_type: str, end_of_row_comment: str, after_row_comment: str) -> str:
+        """
+        Return the line for a row, and any comment lines after it.
+        """
+        col_widths = self.col_widths
+        if self.align_commas:
+            cells = ITEM_SEP.join([item.ljust(width) for item, width in zip(row, col_widths)])
+        else:
+            last_idx = len(row) - 1
+            cells = "".join(
+                [
+                    (item + ITEM_SEP).ljust(width + len(ITEM_SEP)) if idx < last_idx else item.ljust(width)
+                    for idx, (item, width) in enumerate(zip(row, col_widths))
+                ]
+            )
+        if end_of_row_comment or self.noqa_markers.items:
+            adjusted_end_of_row_comment = self.noqa_markers.add_to(end_of_row_comment)
+        else:
+            adjusted_end_of_row_comment = ""
+        if adjusted_end_of_row_comment:
+            comment = self.comment_starts[len(row)] + adjusted_end_of_row_comment
+        else:
+            comment = ""
+        line = f"{self.indent}{row_type}{cells}{CLOSER[row_type]},{comment}\n"
+        if not after_row_comment:
+            return line
+        output = [line]
+        for comment in after_row_comment.split("\n"):
+            if comment.strip():
+                output.append(self.indent + comment + "\n")
+            else:
+                output.append("\n")
+        return "".join(output)
+
+    def tail(self, final_comments: List[str]) -> str:
+        """
+        Return any comments after the last row, and the closing bracket.
+        """
+        output: List[str] = []
+        for comment in final_comments:
+            append_comment(output, self.indent, comment)
+        output.append(self.final_indent + "]")
+        return "".join(output)
+
+
+def column_widths(rows: Iterable[List[str]]) -> List[int]:
+    """
+    Return the width of the widest cell in each column.
+    """
+    col_widths: List[int] = []
+    for row in rows:
+        if len(row) > len(col_widths):
+            col_widths.extend([0] * (len(row) - len(col_widths)))
+        for idx, item in enumerate(row):
+            if len(item) > col_widths[idx]:
+                col_widths[idx] = len(item)
+    return col_widths
+
+
+def fast_render_cell(node: ast.expr, quote_style: QuoteStyle) -> Optional[str]:
+    """
+    Render simple cells exactly as CustomDecompiler would, without using it.
+
+    Returns None for anything that isn't simple.
+    """
+    if type(node) is ast.Name:
+        return node.id
+    if type(node) is ast.UnaryOp:
+        if type(node.op) is not ast.USub:
+            return None
+        operand = fast_render_number(node.operand)
+        return None if operand is None else "-" + operand
+    if type(node) is not ast.Constant:
+        return None
+    value = node.value
+    if type(value) is str:
+        return render_string(value, quote_style, kind=node.kind)
+    if value is None or value is True or value is False:
+        return repr(value)
+    if type(value) is bytes:
+        return repr(value)
+    return fast_render_number(node)
+
+
+def render_string(value: str, quote_style: QuoteStyle, kind: Optional[str] = None) -> str:
+    """
+    Render a string literal exactly as CustomDecompiler.write_string would.
+    """
+    delimiter = "'" if quote_style == QuoteStyle.SINGLE else '"'
+    if not (value.isascii() and value.isprintable() and "\\" not in value):
+        value = value.encode("unicode-escape").decode("ascii")
+    return (kind or "") + delimiter + value.replace(delimiter, "\\" + delimiter) + delimiter
+
+
+def fast_render_number(node: ast.expr) -> Optional[str]:
+    if type(node) is not ast.Constant:
+        return None
+    value = node.value
+    if type(value) is int or (type(value) is float and math.isfinite(value)):
+        return repr(value)
+    return None
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""Write rows of CSV data as a fixed width table, without parsing any Python code.
+
+Like `iter_reformat`, the input is read twice: once to find the width of each
+column, and again to write out each row as soon as it is read, so only one row
+is in memory at a time. Each item is a string, written with the same quotes and
+escapes as the decompiler would use, or optionally a number.
+"""
+import ast
+import csv
+import re
+from typing import Iterator, List, Optional, TextIO
+
+from . import QuoteStyle
+from .core import NoqaMarkers, TableLayout, column_widths, fast_render_number, render_string
+
+__all__ = ["iter_table_from_csv"]
+
+# Decimal numbers that Python would read the same way. Others, like "007" or
+# "1_000", are left as strings.
+NUMBER_RE = re.compile(r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?")
+
+
+def iter_table_from_csv(
+    file: TextIO,
+    dialect: str = "excel",
+    numbers: bool = False,
+    align_commas: bool = False,
+    add_noqa: List[str] = None,
+    quote_style: QuoteStyle = QuoteStyle.SINGLE,
+) -> Iterator[str]:
+    """
+    Read CSV data, and yield a list of lists of its items, laid out like `reformat` would, in pieces.
+
+    `file` is a text file that can be seeked, which is read from its current
+    position to the end, twice. It should be opened with ``newline=""``, as
+    for the `csv` module. `dialect` is one of the names from
+    `csv.list_dialects`, e.g. "excel-tab" for tab separated values. With
+    `numbers`, items that look like numbers are written as numbers rather
+    than strings. Blank lines are skipped. Nothing is yielded until the first
+    pass is done, so errors are raised before any output.
+    """
+    quote_style = QuoteStyle(quote_style)
+    start = file.tell()
+    col_widths = column_widths(iter_csv_rows(file, dialect, numbers, quote_style))
+    file.seek(start)
+    layout = TableLayout(col_widths, align_commas=align_commas, noqa_markers=NoqaMarkers(add_noqa or []))
+    yield layout.head("", [])
+    for row in iter_csv_rows(file, dialect, numbers, quote_style):
+        yield layout.row(row, "[", "", "")
+    yield layout.tail([])
+
+
+def iter_csv_rows(file: TextIO, dialect: str, numbers: bool, quote_style: QuoteStyle) -> Iterator[List[str]]:
+    """
+    Yield the rendered items of each row of CSV data that isn't blank.
+    """
+    for row in csv.reader(file, dialect):
+        if row:
+            yield [render_csv_item(item, numbers, quote_style) for item in row]
+
+
+def render_csv_item(item: str, numbers: bool, quote_style: QuoteStyle) -> str:
+    if numbers:
+        rendered = render_number(item)
+        if rendered is not None:
+            return rendered
+    return render_string(item, quote_style)
+
+
+def render_number(item: str) -> Optional[str]:
+    """
+    Render a number the way `reformat` renders it in Python code, or return None if it isn't one.
+    """
+    if NUMBER_RE.fullmatch(item) is None:
+        return None
+    try:
+        value = ast.literal_eval(item.lstrip("-"))
+    except ValueError:
+        # An integer with too many digits to convert
+        return None
+    rendered = fast_render_number(ast.Constant(value))
+    if rendered is None:
+        # Too big for a float, which the decompiler can't write out
+        return None
+    return "-" + rendered if item.startswith("-") else rendered
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+"""A local HTTP server that keeps :mod:`table_format` loaded, for fast editor integrations.
+
+Run ``table-formatd`` to start the server, then POST the code to reformat to it.
+Formatting options are passed as headers named after the ``table-format``
+command line options, e.g. ``X-Align-Commas: true``, ``X-Add-Noqa: E202,E501``
+or ``X-Quote-Style: double``. The response is the reformatted code with status
+200, or an error message with status 400.
+
+Alternatively, POST a JSON body with ``Content-Type: application/json`` like
+``{"code": "...", "options": {"align_commas": true}}``, and the response will
+be JSON like ``{"output": "..."}`` or ``{"error": "..."}``.
+
+``table-formatd --client`` is a small client that behaves like ``table-format``
+reading from stdin, but has the server do the work.
+"""
+import argparse
+import http.client
+import json
+import sys
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .cli import add_format_arguments, format_options
+from .version import VERSION
+
+__all__ = ["main", "make_server", "parse_options"]
+
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 45485
+
+TRUE_VALUES = {"1", "true", "yes", "on"}
+FALSE_VALUES = {"0", "false", "no", "off"}
+
+
+class OptionsError(ValueError):
+    pass
+
+
+class OptionsParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise OptionsError(message)
+
+
+options_parser = OptionsParser(add_help=False)
+# Map from option name e.g. "align-commas" to argparse action
+OPTION_ACTIONS = {action.option_strings[0][2:]: action for action in add_format_arguments(options_parser)}
+
+
+def parse_options(options: dict, defaults: argparse.Namespace = None):
+    """
+    Convert a dict of formatting options to keyword arguments for `reformat`.
+
+    Option names are those of the ``table-format`` command line options, with
+    or without the leading ``--``, and with either ``-`` or ``_``. A list can
+    be given for ``add_noqa``. Options that aren't given are taken from
+    `defaults`, parsed command line arguments, if given.
+    """
+    namespace = argparse.Namespace(**vars(defaults)) if defaults is not None else argparse.Namespace()
+    argv = []
+    for name, value in options.items():
+        name = name.lstrip("-").replace("_", "-").lower()
+        action = OPTION_ACTIONS.get(name)
+        if action is None:
+            raise OptionsError(f"unknown option {name!r}")
+        if action.nargs == 0:
+            value = str(value).lower()
+            if value not in TRUE_VALUES | FALSE_VALUES:
+                raise OptionsError(f"invalid value for option {name!r}: {value!r}")
+            setattr(namespace, action.dest, value in TRUE_VALUES)
+        else:
+            if isinstance(value, list):
+                value = ",".join(map(str, value))
+            argv.append(f"--{name}={value}")
+    return format_options(options_parser.parse_args(argv, namespace))
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = f"table-formatd/{VERSION}"
+
+    def do_POST(self):
+        is_json = self.headers.get_content_type() == "application/json"
+        try:
+            content_length = int(self.headers.get("Content-Length", ""))
+            if content_length < 0:
+                raise ValueError(content_length)
+        except ValueError:
+            # The body can't be read without its length, so neither can any
+            # request after it on this connection.
+            self.close_connection = True
+            self.respond(HTTPStatus.BAD_REQUEST, "Missing or invalid Content-Length header", is_json, "error")
+            return
+        body = self.rfile.read(content_length)
+        try:
+            if is_json:
+                request = json.loads(body)
+                code = request["code"]
+                options = request.get("options", {})
+            else:
+                code = body.decode("utf-8")
+                options = {
+                    name[2:]: value
+                    for name, value in self.headers.items()
+                    if name.lower().startswith("x-") and name[2:].lower() in OPTION_ACTIONS
+                }
+            output = self.server.reformat(code, **parse_options(options))
+        except Exception as e:
+            self.respond(HTTPStatus.BAD_REQUEST, repr(e), is_json, "error")
+        else:
+            self.respond(HTTPStatus.OK, output, is_json, "output")
+
+    def respond(self, status, text, is_json, json_key):
+        if is_json:
+            content_type = "application/json"
+            body = json.dumps({json_key: text}).encode("utf-8")
+        else:
+            content_type = "text/plain; charset=utf-8"
+            body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, verbose: bool = False):
+    """
+    Create the server, ready for ``serve_forever()`` to be called.
+    """
+    # Not imported at the top, so that the client starts quickly.
+    from .api import reformat
+
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    server.verbose = verbose
+    server.reformat = reformat
+    # Warm up, so the first request is as fast as the rest.
+    reformat("[[a]]")
+    return server
+
+
+argument_parser = argparse.ArgumentParser(
+    description="Runs a server that reformats code sent to it, keeping table_format loaded between requests. "
+    "With --client, reads Python code from stdin, has the server reformat it and prints it to stdout."
+)
+argument_parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to bind/connect to ({DEFAULT_HOST})")
+argument_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to bind/connect to ({DEFAULT_PORT})")
+argument_parser.add_argument("--verbose", action="store_true", help="Log each request")
+argument_parser.add_argument("--client", action="store_true", help="Run as a client, with the formatting options below")
+add_format_arguments(argument_parser)
+
+
+def main():
+    args = argument_parser.parse_args()
+    if args.client:
+        sys.exit(run_client(args))
+    server = make_server(args.host, args.port, verbose=args.verbose)
+    host, port = server.server_address[:2]
+    sys.stderr.write(f"table-formatd listening on http://{host}:{port}/\n")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def run_client(args):
+    input_data = sys.stdin.read()
+    headers = {"Content-Type": "text/plain; charset=utf-8"}
+    for name in OPTION_ACTIONS:
+        value = getattr(args, name.replace("-", "_"))
+        if value not in (None, False):
+            headers[f"X-{name}"] = "true" if value is True else value
+    try:
+        connection = http.client.HTTPConnection(args.host, args.port, timeout=10)
+        connection.request("POST", "/", body=input_data.encode("utf-8"), headers=headers)
+        response = connection.getresponse()
+        output = response.read().decode("utf-8")
+        if response.status != HTTPStatus.OK:
+            raise AssertionError(output)
+    except Exception as e:
+        # Like table-format, return the input, so tools replacing text with
+        # our output don't lose anything.
+        sys.stdout.write(input_data)
+        sys.stderr.write((str(e) if isinstance(e, AssertionError) else repr(e)) + "\n")
+        return 1
+    sys.stdout.write(output)
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""Find the lines changed according to git, and the tables that overlap them.
+
+This is for ``--changed-only``, which only reformats the tables touched by the
+current changes. Only the files in the diff are read, and in those, the tables
+are found using the tokenizer, so that only tables that overlap the changes are
+parsed with libcst and rendered.
+"""
+import ast
+import codecs
+import os
+import re
+import subprocess  # noqa: S404
+import tokenize
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import libcst
+
+from .api import NEWLINES_RE, FoundTable, find_fmt_off_lines, find_tables, has_table_rows, split_lines, timed_stage
+from .check import find_list_spans, has_lone_carriage_returns
+from .core import get_indent_size
+
+__all__ = ["LineRange", "changed_lines", "find_changed_tables"]
+
+
+class LineRange(NamedTuple):
+    """
+    Changed lines, `start` to `end` inclusive, numbered from 1.
+
+    Where lines were only deleted, `end` is `start - 1`, and the range is the
+    gap between lines `end` and `start`.
+    """
+
+    start: int
+    end: int
+
+
+# All of a file, for files that are new to git
+WHOLE_FILE = [LineRange(1, 2**62)]
+
+HUNK_RE = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+
+def changed_lines(paths: Iterable[str], since: Optional[str] = None) -> Dict[str, List[LineRange]]:
+    """
+    Return the changed lines in each changed file under `paths`, keyed by real path (see `os.path.realpath`).
+
+    Changes are between the working tree and `since`, or ``HEAD`` by default, so
+    uncommitted changes, staged or not, are always included. Untracked files
+    that aren't ignored count as changed throughout.
+    """
+    paths = list(paths) or ["."]
+    top_level = run_git(["rev-parse", "--show-toplevel"]).rstrip("\n")
+    # The prefixes are given, as they can be changed in git's config.
+    diff = run_git(
+        ["-c", "core.quotePath=false", "diff", "--unified=0", "--no-color", "--no-ext-diff"]
+        + ["--src-prefix=a/", "--dst-prefix=b/", since or "HEAD", "--"]
+        + paths
+    )
+    changes = parse_diff(diff, top_level)
+    untracked = run_git(["ls-files", "--others", "--exclude-standard", "--full-name", "-z", "--"] + paths)
+    for name in untracked.split("\0"):
+        if name:
+            changes[os.path.normpath(os.path.join(top_level, name))] = WHOLE_FILE
+    # So that files can be looked up whichever symlinks they were found through.
+    return {os.path.realpath(path): ranges for path, ranges in changes.items()}
+
+
+def run_git(args: List[str]) -> str:
+    try:
+        result = subprocess.run(["git"] + args, capture_output=True, encoding="utf-8")  # noqa: S603,S607
+    except OSError as e:
+        raise AssertionError(f"Couldn't run git: {e}")
+    if result.returncode != 0:
+        raise AssertionError(f"git failed: {result.stderr.strip()}")
+    return result.stdout
+
+
+def parse_diff(diff: str, top_level: str) -> Dict[str, List[LineRange]]:
+    """
+    Parse the output of ``git diff --unified=0``, returning the changed lines in each file.
+    """
+    changes = {}
+    current = None
+    # Whether we are between a ``diff --git`` line and the first hunk, where a
+    # line starting with ``+++`` names the file rather than being an added line.
+    in_header = False
+    for line in diff.split("\n"):
+        if line.startswith("diff --git "):
+            in_header = True
+            current = None
+        elif in_header and line.startswith("+++ "):
+            name = line[4:]
+            if name == "/dev/null":
+                # A deleted file
+                current = None
+                continue
+            if name.startswith('"'):
+                name = codecs.escape_decode(name[1:-1].encode("utf-8"))[0].decode("utf-8")
+            current = changes.setdefault(os.path.normpath(os.path.join(top_level, name[2:])), [])
+        elif line.startswith("@@"):
+            in_header = False
+            if current is None:
+                continue
+            match = HUNK_RE.match(line)
+            start = int(match.group(1))
+            count = 1 if match.group(2) is None else int(match.group(2))
+            if count == 0:
+                # Only deletions, after line `start`
+                current.append(LineRange(start + 1, start))
+            else:
+                current.append(LineRange(start, start + count - 1))
+    return {path: ranges for path, ranges in changes.items() if ranges}
+
+
+def overlaps(start_line: int, end_line: int, lines: List[LineRange]) -> bool:
+    return any(start_line <= line_range.end and end_line >= line_range.start for line_range in lines)
+
+
+def find_changed_tables(source: str, lines: List[LineRange], stats=None):
+    """
+    Find the tables that `reformat_file` would reformat which overlap `lines`.
+
+    Returns a list of FoundTable, and the newline used by the module, like `find_tables`.
+    """
+    lines = [LineRange(*line_range) for line_range in lines]
+    try:
+        # The module must be valid, as it is for `find_tables`, even if only some of it is reformatted.
+        with timed_stage(stats, "parse"):
+            ast.parse(source)
+    except (SyntaxError, ValueError):
+        raise AssertionError("Couldn't parse input as Python code")
+    if has_lone_carriage_returns(source):
+        # The tokenizer reads lines that only end with `\r` as one line.
+        return find_tables_by_line(source, lines, stats=stats)
+    newline_match = NEWLINES_RE.search(source)
+    newline = newline_match.group() if newline_match else "\n"
+    source_lines = split_lines(source)
+    fmt_off_lines = find_fmt_off_lines(source_lines)
+    if not lines or not fmt_off_lines:
+        return [], newline
+
+    with timed_stage(stats, "find tables"):
+        try:
+            spans = find_list_spans(source)
+        except (tokenize.TokenError, SyntaxError):
+            raise AssertionError("Couldn't parse input as Python code")
+
+    tables = []
+    table_end = 0
+    for span in spans:
+        if span.start < table_end or span.start_line not in fmt_off_lines or span.start_line == span.end_line:
+            continue
+        if not overlaps(span.start_line, span.end_line, lines):
+            continue
+        if span.uncertain:
+            # libcst might see this differently, so let it decide.
+            return find_tables_by_line(source, lines, stats=stats)
+        with timed_stage(stats, "parse"):
+            try:
+                table_cst = libcst.parse_expression(source[span.start : span.end])
+            except Exception:
+                raise AssertionError("Couldn't parse input as Python code")
+        if isinstance(table_cst, libcst.List) and has_table_rows(table_cst):
+            tables.append(
+                FoundTable(
+                    cst=table_cst,
+                    start=span.start,
+                    end=span.end,
+                    indent=" " * get_indent_size(source_lines[span.start_line - 1]),
+                )
+            )
+            table_end = span.end
+    return tables, newline
+
+
+def find_tables_by_line(source: str, lines: List[LineRange], stats=None):
+    """
+    Like `find_changed_tables`, but using `find_tables`, which parses the whole module with libcst.
+    """
+    tables, newline = find_tables(source, stats=stats)
+    changed_tables = []
+    for table in tables:
+        start_line = source.count("\n", 0, table.start) + 1
+        end_line = start_line + source.count("\n", table.start, table.end)
+        if overlaps(start_line, end_line, lines):
+            changed_tables.append(table)
+    return changed_tables, newline
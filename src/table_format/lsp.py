@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+
+"""A Language Server Protocol server, for editors that want to reformat a selected table.
+
+Run ``table-format --lsp`` to talk LSP (JSON-RPC) over stdin and stdout. It
+supports ``textDocument/rangeFormatting``: the selected text is reformatted
+like ``table-format`` would reformat it on stdin, and the result is returned
+as the smallest edits that turn the selection into it. Options are those given
+on the command line, overridden by ``initializationOptions``, which take the
+same names and values as the JSON options of ``table-formatd``.
+
+The server stays loaded, so the cache of rendered cells stays warm between
+requests. Requests are handled one at a time. A request that has been
+cancelled, or made stale by a later change to the document or a later request
+for the same document, is answered with an error without doing any work, so
+requests don't pile up while the user is typing.
+"""
+import bisect
+import json
+import queue
+import re
+import sys
+import threading
+from collections import deque
+from typing import BinaryIO, Callable, Deque, Dict, List, Optional
+
+from .daemon import parse_options
+from .version import VERSION
+
+__all__ = ["LanguageServer", "serve"]
+
+# JSON-RPC and LSP error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+REQUEST_FAILED = -32803
+SERVER_CANCELLED = -32802
+CONTENT_MODIFIED = -32801
+REQUEST_CANCELLED = -32800
+
+# TextDocumentSyncKind.Incremental
+INCREMENTAL_SYNC = 2
+
+LINE_BREAK_RE = re.compile(r"\r\n|\r|\n")
+LEADING_BLANK_LINES_RE = re.compile(r"(?:[ \t\f]*(?:\r\n|\r|\n))*")
+
+
+class ProtocolError(Exception):
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+def read_message(stream: BinaryIO) -> Optional[dict]:
+    """
+    Read a message with its ``Content-Length`` header, returning None at the end of the stream.
+
+    Raises ProtocolError if the message isn't a JSON object.
+    """
+    content_length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            if content_length is not None:
+                break
+            continue
+        name, _, value = line.decode("ascii", "replace").partition(":")
+        if name.strip().lower() == "content-length":
+            content_length = value.strip()
+    try:
+        length = int(content_length)
+    except ValueError:
+        length = -1
+    if length < 0:
+        # The body can't be skipped without its length, so the next message
+        # might not be read properly either.
+        raise ProtocolError(PARSE_ERROR, f"Invalid Content-Length {content_length!r}")
+    content_length = length
+    body = stream.read(content_length)
+    if len(body) < content_length:
+        return None
+    try:
+        message = json.loads(body)
+    except ValueError as e:
+        raise ProtocolError(PARSE_ERROR, repr(e))
+    if not isinstance(message, dict):
+        raise ProtocolError(INVALID_REQUEST, "Expected a JSON object")
+    return message
+
+
+def write_message(stream: BinaryIO, message: dict):
+    body = json.dumps(message).encode("utf-8")
+    stream.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    stream.flush()
+
+
+class Document:
+    def __init__(self, text: str, version: Optional[int] = None):
+        self.text = text
+        self.version = version
+        self._line_starts = None
+
+    @property
+    def line_starts(self) -> List[int]:
+        if self._line_starts is None:
+            self._line_starts = [0] + [match.end() for match in LINE_BREAK_RE.finditer(self.text)]
+        return self._line_starts
+
+    def offset(self, position: dict, encoding: str) -> int:
+        """
+        Convert an LSP position to an offset in the text.
+
+        Positions past the end of a line are taken as the end of the line.
+        """
+        line_starts = self.line_starts
+        line = position["line"]
+        if line >= len(line_starts):
+            return len(self.text)
+        start = line_starts[line]
+        end = line_starts[line + 1] if line + 1 < len(line_starts) else len(self.text)
+        line_text = self.text[start:end].rstrip("\r\n")
+        return start + code_points(line_text, position["character"], encoding)
+
+    def position(self, offset: int, encoding: str) -> dict:
+        line = bisect.bisect_right(self.line_starts, offset) - 1
+        return {"line": line, "character": code_units(self.text[self.line_starts[line] : offset], encoding)}
+
+    def apply_change(self, change: dict, encoding: str):
+        if "range" in change:
+            start = self.offset(change["range"]["start"], encoding)
+            end = self.offset(change["range"]["end"], encoding)
+            self.text = self.text[:start] + change["text"] + self.text[end:]
+        else:
+            self.text = change["text"]
+        self._line_starts = None
+
+
+def code_units(text: str, encoding: str) -> int:
+    """
+    Return the length of `text` in the units of the position encoding.
+    """
+    if encoding == "utf-32":
+        return len(text)
+    if text.isascii():
+        return len(text)
+    if encoding == "utf-16":
+        return len(text.encode("utf-16-le")) // 2
+    return len(text.encode("utf-8"))
+
+
+def code_points(text: str, units: int, encoding: str) -> int:
+    """
+    Return how many characters at the start of `text` make up `units` units of the position encoding.
+    """
+    if encoding == "utf-32" or text.isascii():
+        return min(units, len(text))
+    count = 0
+    for index, char in enumerate(text):
+        count += code_units(char, encoding)
+        if count > units:
+            return index
+    return len(text)
+
+
+def minimal_edits(old: str, new: str) -> List[tuple]:
+    """
+    Return edits that turn `old` into `new`, as (start, end, new text) with offsets in `old`.
+
+    Lines are matched up with difflib, then each block of changed lines is
+    trimmed to the part that actually changed, which for a table is mostly
+    spaces added or removed.
+    """
+    import difflib
+
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    old_starts = [0]
+    for line in old_lines:
+        old_starts.append(old_starts[-1] + len(line))
+    edits = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        old_block = "".join(old_lines[i1:i2])
+        new_block = "".join(new_lines[j1:j2])
+        prefix = 0
+        limit = min(len(old_block), len(new_block))
+        while prefix < limit and old_block[prefix] == new_block[prefix]:
+            prefix += 1
+        suffix = 0
+        limit -= prefix
+        while suffix < limit and old_block[-1 - suffix] == new_block[-1 - suffix]:
+            suffix += 1
+        edits.append(
+            (
+                old_starts[i1] + prefix,
+                old_starts[i2] - suffix,
+                new_block[prefix : len(new_block) - suffix],
+            )
+        )
+    return edits
+
+
+def reformat_selection(formatter, text: str) -> str:
+    """
+    Reformat selected text, keeping the blank lines and whitespace around the table, and its line breaks.
+    """
+    leading = LEADING_BLANK_LINES_RE.match(text).group()
+    code = text[len(leading) :]
+    stripped = code.rstrip()
+    if not stripped:
+        return text
+    output = formatter.format(stripped)
+    newline = LINE_BREAK_RE.search(text)
+    if newline is not None and newline.group() != "\n":
+        output = output.replace("\n", newline.group())
+    return leading + output + code[len(stripped) :]
+
+
+def document_uri(message: dict) -> Optional[str]:
+    return ((message.get("params") or {}).get("textDocument") or {}).get("uri")
+
+
+class LanguageServer:
+    """
+    Handles LSP messages, writing responses with `write`.
+
+    Formatting options not given by the client are taken from `defaults`,
+    parsed command line arguments.
+    """
+
+    def __init__(self, write: Callable[[dict], None], defaults=None):
+        self.write = write
+        self.defaults = defaults
+        self.formatter = None
+        self.encoding = "utf-16"
+        self.documents: Dict[str, Document] = {}
+        # Ids of requests cancelled by the client, and of requests that have
+        # arrived but not been answered. These can be added to by another
+        # thread, as messages arrive.
+        self.cancelled = set()
+        self.unanswered = set()
+        self.lock = threading.Lock()
+        self.shutdown_requested = False
+        self.exit_status = None
+
+    def note_cancelled(self, message: dict, pending: Deque[dict] = ()) -> bool:
+        """
+        Record the request cancelled by a ``$/cancelRequest`` message, returning whether it was one.
+
+        Other requests are recorded as unanswered, as only those, and the
+        `pending` ones, can still be cancelled.
+        """
+        method = message.get("method")
+        with self.lock:
+            if method != "$/cancelRequest":
+                if method is not None and "id" in message:
+                    self.unanswered.add(message["id"])
+                return False
+            request_id = (message.get("params") or {}).get("id")
+            if request_id in self.unanswered or any(
+                isinstance(other, dict) and other.get("method") is not None and other.get("id") == request_id
+                for other in pending
+            ):
+                self.cancelled.add(request_id)
+        return True
+
+    def process(self, pending: Deque[dict]):
+        """
+        Handle the first of the `pending` messages, which are the ones that have
+        arrived but haven't been handled yet, oldest first.
+        """
+        message = pending.popleft()
+        if isinstance(message, ProtocolError):
+            # A message that couldn't be read
+            self.respond_error(None, message.code, str(message))
+            return
+        if self.note_cancelled(message, pending):
+            return
+        method = message.get("method")
+        request_id = message.get("id")
+        is_request = "id" in message
+        if method is None:
+            # A response to a request from us, which we never send.
+            return
+        handler = getattr(self, "handle_" + re.sub(r"\W", "_", method), None)
+        if is_request:
+            if request_id in self.cancelled:
+                self.respond_error(request_id, REQUEST_CANCELLED, "Request cancelled")
+                return
+            if self.shutdown_requested and method != "shutdown":
+                self.respond_error(request_id, INVALID_REQUEST, "Server is shutting down")
+                return
+            if handler is None:
+                self.respond_error(request_id, METHOD_NOT_FOUND, f"Unknown method {method!r}")
+                return
+        elif handler is None:
+            # Unknown notifications are ignored.
+            return
+        params = message.get("params") or {}
+        try:
+            result = handler(params, pending) if is_request else handler(params)
+        except Exception as e:
+            if is_request:
+                if isinstance(e, ProtocolError):
+                    self.respond_error(request_id, e.code, str(e))
+                else:
+                    self.respond_error(request_id, REQUEST_FAILED, repr(e))
+        else:
+            if is_request:
+                self.respond(request_id, {"result": result})
+
+    def respond(self, request_id, response: dict):
+        self.write({"jsonrpc": "2.0", "id": request_id, **response})
+        # It can't be cancelled now.
+        with self.lock:
+            self.unanswered.discard(request_id)
+            self.cancelled.discard(request_id)
+
+    def respond_error(self, request_id, code: int, message: str):
+        self.respond(request_id, {"error": {"code": code, "message": message}})
+
+    def handle_initialize(self, params: dict, pending):
+        # Imported here, as it's slow to import.
+        from .api import TableFormatter
+
+        try:
+            options = parse_options(params.get("initializationOptions") or {}, defaults=self.defaults)
+        except ValueError as e:
+            raise ProtocolError(INVALID_PARAMS, str(e))
+        self.formatter = TableFormatter(**options)
+        # Warm up, so the first request is as fast as the rest.
+        self.formatter.format("[[a]]")
+        encodings = ((params.get("capabilities") or {}).get("general") or {}).get("positionEncodings") or []
+        self.encoding = "utf-32" if "utf-32" in encodings else "utf-16"
+        return {
+            "capabilities": {
+                "positionEncoding": self.encoding,
+                "textDocumentSync": {"openClose": True, "change": INCREMENTAL_SYNC},
+                "documentRangeFormattingProvider": True,
+            },
+            "serverInfo": {"name": "table-format", "version": VERSION},
+        }
+
+    def handle_shutdown(self, params: dict, pending):
+        self.shutdown_requested = True
+        return None
+
+    def handle_exit(self, params: dict):
+        self.exit_status = 0 if self.shutdown_requested else 1
+
+    def handle_textDocument_didOpen(self, params: dict):
+        document = params["textDocument"]
+        self.documents[document["uri"]] = Document(document["text"], document.get("version"))
+
+    def handle_textDocument_didChange(self, params: dict):
+        document = self.documents[params["textDocument"]["uri"]]
+        for change in params["contentChanges"]:
+            document.apply_change(change, self.encoding)
+        document.version = params["textDocument"].get("version")
+
+    def handle_textDocument_didClose(self, params: dict):
+        self.documents.pop(params["textDocument"]["uri"], None)
+
+    def handle_textDocument_rangeFormatting(self, params: dict, pending):
+        uri = params["textDocument"]["uri"]
+        for message in pending:
+            if not isinstance(message, dict) or document_uri(message) != uri:
+                continue
+            if message.get("method") == "textDocument/didChange":
+                # The user is still typing.
+                raise ProtocolError(CONTENT_MODIFIED, "Document changed before it could be formatted")
+            if message.get("method") == "textDocument/rangeFormatting":
+                raise ProtocolError(SERVER_CANCELLED, "Superseded by a later request")
+        document = self.documents.get(uri)
+        if document is None:
+            raise ProtocolError(INVALID_PARAMS, f"Unknown document {uri!r}")
+        if self.formatter is None:
+            raise ProtocolError(INVALID_REQUEST, "Server not initialized")
+        start = document.offset(params["range"]["start"], self.encoding)
+        end = document.offset(params["range"]["end"], self.encoding)
+        old = document.text[start:end]
+        new = reformat_selection(self.formatter, old)
+        return [
+            {
+                "range": {
+                    "start": document.position(start + edit_start, self.encoding),
+                    "end": document.position(start + edit_end, self.encoding),
+                },
+                "newText": new_text,
+            }
+            for edit_start, edit_end, new_text in minimal_edits(old, new)
+        ]
+
+
+def serve(stdin: BinaryIO = None, stdout: BinaryIO = None, defaults=None) -> int:
+    """
+    Run the server on stdin and stdout until the client exits, returning the exit status.
+    """
+    stdin = sys.stdin.buffer if stdin is None else stdin
+    stdout = sys.stdout.buffer if stdout is None else stdout
+    server = LanguageServer(lambda message: write_message(stdout, message), defaults=defaults)
+    incoming = queue.Queue()
+
+    def read_all():
+        # Messages are read as soon as they arrive, so that the server knows
+        # about cancellations and changes before it handles earlier requests.
+        while True:
+            try:
+                message = read_message(stdin)
+            except ProtocolError as e:
+                incoming.put(e)
+                continue
+            if message is None:
+                break
+            if not server.note_cancelled(message):
+                incoming.put(message)
+        incoming.put(None)
+
+    threading.Thread(target=read_all, daemon=True).start()
+    pending = deque()
+    while server.exit_status is None:
+        if not pending:
+            pending.append(incoming.get())
+        while True:
+            try:
+                pending.append(incoming.get_nowait())
+            except queue.Empty:
+                break
+        if pending[0] is None:
+            # The client went away without saying so.
+            return 1
+        server.process(pending)
+    return server.exit_status
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+"""A table that is parsed once, and can then be laid out many times and edited row by row.
+
+This is for editor integrations, which often lay out the same table again with
+different options, or after a change to one row.
+"""
+import ast
+from typing import Dict, List
+
+import libcst
+
+from . import Engine, QuoteStyle
+from .api import (
+    OPENER,
+    Table,
+    extract_table,
+    layout_table,
+    render_cell,
+    source_segment_getter,
+    table_indents,
+    unwrap_starred,
+)
+
+__all__ = ["TableModel", "parse_table"]
+
+
+def parse_table(
+    python_code: str,
+    quote_style: QuoteStyle = QuoteStyle.SINGLE,
+    engine: Engine = Engine.LIBCST,
+) -> "TableModel":
+    """
+    Parse a list of lists, returning a TableModel for it.
+    """
+    code = python_code.strip()
+    table = extract_table(code, quote_style=quote_style, engine=engine)
+    indents = {guess_indent: table_indents(python_code, guess_indent=guess_indent) for guess_indent in (False, True)}
+    return TableModel(table, code, quote_style, indents)
+
+
+class TableModel:
+    """
+    A table with each cell rendered, which can be laid out with `render`.
+
+    Rows can be changed with `replace_row`, `insert_row` and `delete_row`. These
+    only render the cells of the row that changed, and keep the column widths
+    up to date using a count of the cells of each width in each column, so they
+    take time proportional to the size of the row rather than the table.
+    """
+
+    def __init__(self, table: Table, code: str, quote_style: QuoteStyle, indents: Dict[bool, tuple]):
+        self.rows = table.rows
+        self.row_types = table.row_types
+        self.opening_comment = table.opening_comment
+        self.initial_comments = table.initial_comments
+        self.end_of_row_comments = table.end_of_row_comments
+        self.after_row_comments = table.after_row_comments
+        self.final_comments = table.final_comments
+        self.quote_style = QuoteStyle(quote_style)
+        self._code = code
+        self._indents = indents
+        # The source code of each row, or its index in `_code` if it hasn't
+        # been changed. This is only needed to render the cells again with a
+        # different quote style, so the original rows are found when needed.
+        self._row_sources = list(range(len(self.rows)))
+        self._original_row_sources = None
+        self._count_all_widths()
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def col_widths(self) -> List[int]:
+        return list(self._col_widths)
+
+    @property
+    def table(self) -> Table:
+        return Table(
+            rows=self.rows,
+            row_types=self.row_types,
+            opening_comment=self.opening_comment,
+            initial_comments=self.initial_comments,
+            end_of_row_comments=self.end_of_row_comments,
+            after_row_comments=self.after_row_comments,
+            final_comments=self.final_comments,
+        )
+
+    def render(
+        self,
+        align_commas: bool = False,
+        guess_indent: bool = False,
+        add_noqa: List[str] = None,
+        quote_style: QuoteStyle = None,
+    ) -> str:
+        """
+        Lay out the table, with the same options as `reformat`.
+
+        The indents are those of the code the table was parsed from. Passing a
+        different `quote_style` from the last one renders every cell again.
+        """
+        if quote_style is not None and QuoteStyle(quote_style) != self.quote_style:
+            self.quote_style = QuoteStyle(quote_style)
+            self.rows[:] = [self._render_cells(self._row_source(idx)) for idx in range(len(self.rows))]
+            self._count_all_widths()
+        indent, initial_indent, final_indent = self._indents[bool(guess_indent)]
+        return layout_table(
+            self.table,
+            indent=indent,
+            initial_indent=initial_indent,
+            final_indent=final_indent,
+            align_commas=align_commas,
+            add_noqa=add_noqa,
+            col_widths=self._col_widths,
+        )
+
+    def replace_row(self, index: int, row_code: str):
+        """
+        Replace a row with a new one, given as code like ``"[1, 2, 3]"``, keeping its comments.
+        """
+        row_code = row_code.strip()
+        row_type, row = self._parse_row(row_code)
+        self._count_widths(self.rows[index], -1)
+        self.rows[index] = row
+        self.row_types[index] = row_type
+        self._row_sources[index] = row_code
+        self._count_widths(row, 1)
+
+    def insert_row(self, index: int, row_code: str, comment: str = ""):
+        """
+        Insert a row before `index`, given as code like ``"[1, 2, 3]"``, with an optional end of row comment.
+        """
+        row_code = row_code.strip()
+        row_type, row = self._parse_row(row_code)
+        self.rows.insert(index, row)
+        self.row_types.insert(index, row_type)
+        self.end_of_row_comments.insert(index, comment)
+        self.after_row_comments.insert(index, "")
+        self._row_sources.insert(index, row_code)
+        self._count_widths(row, 1)
+
+    def delete_row(self, index: int):
+        """
+        Delete a row, along with its comments.
+        """
+        self._count_widths(self.rows[index], -1)
+        del self.rows[index]
+        del self.row_types[index]
+        del self.end_of_row_comments[index]
+        del self.after_row_comments[index]
+        del self._row_sources[index]
+
+    def _parse_row(self, row_code):
+        try:
+            row_cst = libcst.parse_expression(row_code)
+        except Exception:
+            raise AssertionError("Couldn't parse row as Python code")
+        # A tuple needs its own brackets to be a row, not just to be valid code.
+        if not isinstance(row_cst, (libcst.List, libcst.Tuple)) or (
+            isinstance(row_cst, libcst.Tuple) and not row_cst.lpar
+        ):
+            raise AssertionError(f"Expected a list or tuple as a row, found {row_code!r}.")
+        return OPENER[type(row_cst)], self._render_cells(row_code)
+
+    def _render_cells(self, row_code):
+        row_ast = ast.parse(row_code, mode="eval").body
+        get_source = source_segment_getter(row_code)
+        return [render_cell(cell_ast, get_source, self.quote_style) for cell_ast in row_ast.elts]
+
+    def _row_source(self, idx):
+        source = self._row_sources[idx]
+        if isinstance(source, str):
+            return source
+        if self._original_row_sources is None:
+            get_source = source_segment_getter(self._code)
+            self._original_row_sources = [
+                get_source(unwrap_starred(row_ast)) for row_ast in ast.parse(self._code, mode="eval").body.elts
+            ]
+        return self._original_row_sources[source]
+
+    def _count_all_widths(self):
+        # For each column, a dict from cell width to the number of cells with that width.
+        self._width_counts = []
+        self._col_widths = []
+        for row in self.rows:
+            self._count_widths(row, 1)
+
+    def _count_widths(self, row, change):
+        """
+        Add (`change` = 1) or remove (-1) the cells of a row from the width counts.
+        """
+        for idx, item in enumerate(row):
+            if idx == len(self._width_counts):
+                self._width_counts.append({})
+                self._col_widths.append(0)
+            counts = self._width_counts[idx]
+            width = len(item)
+            count = counts.get(width, 0) + change
+            if count:
+                counts[width] = count
+            else:
+                del counts[width]
+            if width > self._col_widths[idx]:
+                self._col_widths[idx] = width
+            elif width == self._col_widths[idx] and not count:
+                # The widest cell went, so look for the next widest.
+                self._col_widths[idx] = max(counts, default=0)
+        # Drop columns that no longer have any cells
+        while self._width_counts and not self._width_counts[-1]:
+            self._width_counts.pop()
+            self._col_widths.pop()
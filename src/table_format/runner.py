@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+"""Reformat many files, optionally using a pool of worker processes."""
+import contextlib
+import fnmatch
+import os
+import stat
+import tempfile
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from . import QuoteStyle
+
+__all__ = [
+    "DEFAULT_EXCLUDES",
+    "DEFAULT_INCLUDES",
+    "FileResult",
+    "is_included",
+    "iter_python_files",
+    "make_diff",
+    "reformat_path",
+    "reformat_paths",
+    "write_atomic",
+]
+
+DEFAULT_INCLUDES = ["*.py"]
+
+DEFAULT_EXCLUDES = [
+    ".git",
+    ".hg",
+    ".tox",
+    ".nox",
+    ".venv",
+    "venv",
+    ".eggs",
+    "*.egg-info",
+    "__pycache__",
+    "build",
+    "dist",
+    "node_modules",
+]
+
+
+class FileResult(NamedTuple):
+    path: str
+    changed: bool = False  # Or would be changed, when checking
+    error: Optional[str] = None
+    diff: Optional[str] = None
+    bytes_written: int = 0
+    # The `content_hash` of the contents that were found to be formatted, or written
+    formatted_hash: Optional[str] = None
+
+
+def iter_python_files(
+    paths: Iterable[str],
+    include: List[str] = None,
+    exclude: List[str] = None,
+) -> Iterator[str]:
+    """
+    Yield the files to reformat from a list of files and directories.
+
+    Directories are walked recursively, yielding files that match one of the
+    ``include`` globs. Anything matching one of the ``exclude`` globs is skipped.
+    Globs are matched against both the file/directory name and its path
+    relative to the directory being walked. Files passed explicitly are always
+    yielded.
+    """
+    if include is None:
+        include = DEFAULT_INCLUDES
+    if exclude is None:
+        exclude = DEFAULT_EXCLUDES
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            rel_root = os.path.relpath(root, path)
+            dirs[:] = sorted(d for d in dirs if not _matches(os.path.join(rel_root, d), d, exclude))
+            for name in sorted(files):
+                rel_path = os.path.join(rel_root, name)
+                if _matches(rel_path, name, include) and not _matches(rel_path, name, exclude):
+                    yield os.path.join(root, name)
+
+
+def is_included(rel_path: str, include: List[str], exclude: List[str]) -> bool:
+    """
+    Return whether `iter_python_files` would yield a file, given its path relative to the directory being walked.
+    """
+    parts = os.path.normpath(rel_path).split(os.sep)
+    for idx in range(len(parts)):
+        if _matches(os.path.join(*parts[: idx + 1]), parts[idx], exclude):
+            return False
+    return _matches(rel_path, parts[-1], include)
+
+
+def _matches(rel_path, name, patterns):
+    rel_path = os.path.normpath(rel_path)
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel_path, pattern) for pattern in patterns)
+
+
+def reformat_path(
+    path: str,
+    align_commas: bool = False,
+    add_noqa: List[str] = None,
+    quote_style: QuoteStyle = QuoteStyle.SINGLE,
+    stats=None,
+    check: bool = False,
+    diff: bool = False,
+    lines: List[Tuple[int, int]] = None,
+) -> FileResult:
+    """
+    Reformat the tables in a file in place, returning a FileResult rather than raising.
+
+    With `check` or `diff`, the file is left as it is, and the result says
+    whether it would be changed. With `diff`, the result includes a diff of the
+    changes. With `lines`, only the tables that overlap those lines are
+    reformatted, as for `reformat_file`.
+
+    Files that are already formatted aren't written to, so their modification
+    time stays the same. Others are replaced atomically, with `write_atomic`.
+    """
+    from .api import reformat_file
+    from .cache import content_hash
+
+    try:
+        with open(path, encoding="utf-8", newline="") as f:
+            source = f.read()
+        if check and not diff and lines is None:
+            from .check import is_file_formatted
+
+            formatted = is_file_formatted(source, align_commas=align_commas, add_noqa=add_noqa, quote_style=quote_style)
+            if not formatted:
+                return FileResult(path, changed=True)
+            return FileResult(path, formatted_hash=content_hash(source.encode("utf-8")))
+        reformatted = reformat_file(
+            source, align_commas=align_commas, add_noqa=add_noqa, quote_style=quote_style, stats=stats, lines=lines
+        )
+        if reformatted == source:
+            return FileResult(path, formatted_hash=content_hash(source.encode("utf-8")))
+        if check or diff:
+            return FileResult(path, changed=True, diff=make_diff(source, reformatted, path) if diff else None)
+        data = reformatted.encode("utf-8")
+        write_atomic(path, data)
+        return FileResult(path, changed=True, bytes_written=len(data), formatted_hash=content_hash(data))
+    except Exception as e:
+        return FileResult(path, error=repr(e))
+
+
+def write_atomic(path: str, data: bytes):
+    """
+    Replace the contents of a file by writing a temporary file next to it, and renaming it over the file.
+
+    Anything reading the file sees either the old or the new contents, and an
+    error part way through leaves the old contents. The permissions, and the
+    owner where possible, are copied from the old file. A symlink is followed,
+    so the file it points to is replaced rather than the link.
+    """
+    path = os.path.realpath(path)
+    directory, name = os.path.split(path)
+    old_stat = os.stat(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    try:
+        with open(fd, "wb") as f:
+            f.write(data)
+        os.chmod(temp_path, stat.S_IMODE(old_stat.st_mode))
+        if hasattr(os, "chown") and (old_stat.st_uid, old_stat.st_gid) != (os.getuid(), os.getgid()):
+            # Only allowed for some users, and it's better to write the file anyway.
+            with contextlib.suppress(OSError):
+                os.chown(temp_path, old_stat.st_uid, old_stat.st_gid)
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temp_path)
+        raise
+
+
+def make_diff(before: str, after: str, name: str) -> str:
+    """
+    Return a unified diff between two versions of a file.
+    """
+    import difflib
+
+    return "".join(
+        difflib.unified_diff(
+            before.splitlines(keepends=True),
+            after.splitlines(keepends=True),
+            fromfile=f"{name}\t(original)",
+            tofile=f"{name}\t(reformatted)",
+        )
+    )
+
+
+def reformat_paths(
+    paths: Iterable[str],
+    jobs: Optional[int] = None,
+    include: List[str] = None,
+    exclude: List[str] = None,
+    cache=None,
+    changed_lines: Dict[str, List[Tuple[int, int]]] = None,
+    **options,
+) -> Iterator[FileResult]:
+    """
+    Reformat all the files found in ``paths``, yielding a FileResult for each.
+
+    With more than one file and more than one job, files are spread over a
+    process pool (``jobs`` defaults to the number of CPUs). Each worker imports
+    the formatting code once and then handles many files. Results are yielded
+    in the same order as the files.
+
+    If a `table_format.cache.Cache` is given, files that it knows are formatted
+    are skipped, and files found to be formatted are added to it. The cache
+    isn't saved, that is up to the caller.
+
+    If `changed_lines` is given, as a dict from real paths to line ranges
+    (see `table_format.git_diff.changed_lines`), only the files in it are
+    reformatted, and only the tables in them that overlap those lines.
+    """
+    files = list(iter_python_files(paths, include=include, exclude=exclude))
+    if changed_lines is not None:
+        files = [path for path in files if os.path.realpath(path) in changed_lines]
+    if cache is None:
+        yield from _reformat_files(files, jobs, options, changed_lines)
+        return
+    skipped = [cache.is_formatted(path) for path in files]
+    results = _reformat_files([path for path, skip in zip(files, skipped) if not skip], jobs, options, changed_lines)
+    for path, skip in zip(files, skipped):
+        if skip:
+            yield FileResult(path)
+            continue
+        result = next(results)
+        # Only some of the tables are looked at with `changed_lines`, so the
+        # others might not be formatted.
+        if result.formatted_hash is not None and changed_lines is None:
+            cache.mark_formatted(path, result.formatted_hash)
+        yield result
+
+
+def _reformat_files(files, jobs, options, changed_lines=None):
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(files))
+    worker = partial(_reformat_path, **options)
+    if changed_lines is None:
+        lines = [None] * len(files)
+    else:
+        lines = [changed_lines[os.path.realpath(path)] for path in files]
+    if jobs <= 1:
+        yield from map(worker, files, lines)
+        return
+    # Imported here as it's slow to import, and not always needed.
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # Batch files so that the IPC overhead is small compared to the work.
+        chunksize = max(1, min(16, len(files) // (jobs * 4)))
+        yield from executor.map(worker, files, lines, chunksize=chunksize)
+
+
+def _reformat_path(path, lines, **options):
+    # For `map`, which can only pass arguments by position.
+    return reformat_path(path, lines=lines, **options)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+"""Reformat a table without having all of it in memory, by reading it twice.
+
+The first pass reads the rows one at a time, keeping only the width of each
+column. The second pass reads the input again, and outputs each row as soon as
+it has been read. The memory needed is set by the longest row, rather than the
+size of the table, so this suits tables that are too big to reformat otherwise.
+
+Tables are read with the tokenizer used by the fast engine. Anything it doesn't
+handle is reformatted with `reformat` instead, which reads all of the input.
+"""
+from typing import Callable, Iterator, List, Optional, TextIO
+
+from . import Engine, QuoteStyle
+from .api import TableFormatter, indents_from_lines
+from .core import TableLayout, column_widths, get_indent_size
+from .tokens import StreamTableTokenParser, TableRow, TableTail, Unsupported
+
+__all__ = ["iter_reformat"]
+
+
+def iter_reformat(
+    file: TextIO,
+    align_commas: bool = False,
+    guess_indent: bool = False,
+    add_noqa: List[str] = None,
+    quote_style: QuoteStyle = QuoteStyle.SINGLE,
+) -> Iterator[str]:
+    """
+    Reformat list of lists as fixed width table, like `reformat`, yielding the output in pieces.
+
+    `file` is a text file that can be seeked, which is read from its current
+    position to the end, twice. Joined together, the pieces are the same as
+    `reformat(file.read(), ...)`. Nothing is yielded until the first pass is
+    done, so errors are raised before any output.
+    """
+    formatter = TableFormatter(
+        align_commas=align_commas,
+        guess_indent=guess_indent,
+        add_noqa=add_noqa,
+        quote_style=quote_style,
+        engine=Engine.FAST,
+    )
+    start = file.tell()
+
+    # First pass
+    lines = LeadingLines(file.readline)
+    parser = StreamTableTokenParser(lines.readline, quote_style=formatter.quote_style)
+    try:
+        col_widths = column_widths(part.cells for part in parser.iter_parse() if type(part) is TableRow)
+    except Unsupported:
+        file.seek(start)
+        yield formatter.format(file.read())
+        return
+    indent, initial_indent, final_indent = indents_from_lines(
+        lines.initial_indent_size, lines.second_line if guess_indent else None
+    )
+
+    # Second pass
+    file.seek(start)
+    layout = TableLayout(
+        col_widths,
+        indent=indent,
+        initial_indent=initial_indent,
+        final_indent=final_indent,
+        align_commas=formatter.align_commas,
+        noqa_markers=formatter.noqa_markers,
+    )
+    parts = StreamTableTokenParser(file.readline, quote_style=formatter.quote_style).iter_parse()
+    head = next(parts)
+    yield layout.head(head.opening_comment, head.initial_comments)
+    for part in parts:
+        if type(part) is TableTail:
+            yield layout.tail(part.final_comments)
+        else:
+            yield layout.row(part.cells, part.row_type, part.end_of_row_comment, part.after_row_comment)
+
+
+class LeadingLines:
+    """
+    Passes on lines from `readline`, noting what `table_indents` would find in them.
+
+    That is the number of spaces at the start, and the second line of the
+    code, ignoring blank lines around it and comment lines, if there is one.
+    """
+
+    def __init__(self, readline: Callable[[], str]):
+        self.source_readline = readline
+        self.initial_indent_size: Optional[int] = None
+        self.started = False
+        self.candidate: Optional[str] = None
+        # Whether there is code after the start of `candidate`, so it isn't
+        # removed along with blank lines at the end.
+        self.confirmed = False
+
+    def readline(self) -> str:
+        line = self.source_readline()
+        if self.initial_indent_size is None:
+            self.initial_indent_size = get_indent_size(line)
+        if self.confirmed or not line:
+            return line
+        stripped = line.strip()
+        if not self.started:
+            self.started = bool(stripped)
+        elif self.candidate is None:
+            if not stripped.startswith("#"):
+                self.candidate = line
+                self.confirmed = bool(stripped)
+        elif stripped:
+            self.confirmed = True
+        return line
+
+    @property
+    def second_line(self) -> Optional[str]:
+        return self.candidate if self.confirmed else None
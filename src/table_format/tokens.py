@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+
+"""Extract tables using the :mod:`tokenize` module, as a faster alternative to libcst.
+
+This is used by ``reformat(..., engine="fast")``. It handles the common case of
+a list of lists/tuples with comments between rows. For anything else it raises
+:class:`Unsupported`, and the caller falls back to libcst, so the results are
+always the same as with libcst.
+"""
+import array
+import ast
+import io
+import keyword
+import sys
+import tokenize
+from typing import Callable, Iterator, List, NamedTuple, Union
+
+from . import QuoteStyle
+from .api import Budget, DeferredCells, ReformatStats, Table, cell_cache, parse_cell, reformat_ast_as_single_line
+from .core import CLOSER, fast_render_cell
+
+__all__ = ["StreamTableTokenParser", "TableHead", "TableRow", "TableTail", "Unsupported", "tokenize_table"]
+
+GAP_TOKENS = {tokenize.COMMENT, tokenize.NL}
+
+OPENING_BRACKETS = {"(", "[", "{"}
+CLOSING_BRACKETS = {")", "]", "}"}
+
+CONSTANT_NAMES = {"None": None, "True": True, "False": False}
+
+# Keywords that would make a row something other than a list or tuple display
+# e.g. a list comprehension.
+UNSUPPORTED_ROW_KEYWORDS = {"for", "async", "yield"}
+
+
+class Unsupported(Exception):
+    """
+    The input is something that the tokenizer engine doesn't handle.
+    """
+
+
+class TableHead(NamedTuple):
+    opening_comment: str
+    initial_comments: List[str]
+
+
+class TableRow(NamedTuple):
+    row_type: str
+    cells: List[str]
+    end_of_row_comment: str
+    after_row_comment: str
+
+
+class TableTail(NamedTuple):
+    final_comments: List[str]
+
+
+def tokenize_table(
+    code: str,
+    quote_style: QuoteStyle = QuoteStyle.SINGLE,
+    stats: ReformatStats = None,
+    deferred: DeferredCells = None,
+    budget: Budget = None,
+) -> Table:
+    """
+    Extract a Table from source code using the tokenizer, raising Unsupported if we can't.
+
+    If `deferred` is passed, cells that need the decompiler are added to it,
+    and left as None in the rows, like `render_cell`. `budget` is checked
+    after each row.
+    """
+    return TableTokenParser(code, quote_style=quote_style, stats=stats, deferred=deferred).parse(budget=budget)
+
+
+class TableTokenParser:
+    # Interning saves memory when many cells are the same and all the rows are
+    # kept, but the interned strings table never shrinks.
+    intern_cells = True
+
+    def __init__(
+        self,
+        code: str,
+        quote_style: QuoteStyle = QuoteStyle.SINGLE,
+        stats: ReformatStats = None,
+        deferred: DeferredCells = None,
+    ):
+        self.code = code.strip()
+        self.quote_style = quote_style
+        self.stats = stats
+        self.deferred = deferred
+        # Offset in `code` of the start of each line, filled in as the tokenizer
+        # reads lines. Tokens are consumed as they are generated, rather than
+        # being collected in a list, to keep memory use down for big tables.
+        self.line_offsets = array.array("q", [0])
+        self.code_readline = io.StringIO(self.code).readline
+        self.tokens = tokenize.generate_tokens(self.readline)
+        self.token = None
+
+    def readline(self):
+        line = self.code_readline()
+        self.line_offsets.append(self.line_offsets[-1] + len(line))
+        return line
+
+    def parse(self, budget: Budget = None) -> Table:
+        rows = []
+        row_types = []
+        end_of_row_comments = []
+        after_row_comments = []
+        parts = self.iter_parse()
+        head = next(parts)
+        for part in parts:
+            if type(part) is TableTail:
+                tail = part
+            else:
+                if budget is not None:
+                    budget.check(len(part.cells))
+                rows.append(part.cells)
+                row_types.append(part.row_type)
+                end_of_row_comments.append(part.end_of_row_comment)
+                after_row_comments.append(part.after_row_comment)
+        return Table(
+            rows=rows,
+            row_types=row_types,
+            opening_comment=head.opening_comment,
+            initial_comments=head.initial_comments,
+            end_of_row_comments=end_of_row_comments,
+            after_row_comments=after_row_comments,
+            final_comments=tail.final_comments,
+        )
+
+    def iter_parse(self) -> Iterator[Union["TableHead", "TableRow", "TableTail"]]:
+        """
+        Yield the parts of the table as they are read: a TableHead, a TableRow for each row, then a TableTail.
+        """
+        try:
+            self.advance()
+            yield from self.iter_table()
+        except (tokenize.TokenError, SyntaxError):
+            raise Unsupported()
+
+    def advance(self):
+        token = self.token
+        self.token = next(self.tokens, None)
+        return token
+
+    def iter_table(self):
+        if not self.is_op("["):
+            raise Unsupported()
+        self.advance()
+        opening_comment, initial_comments = self.read_gap()
+        yield TableHead(opening_comment, [comment + "\n" for comment in initial_comments])
+
+        if self.is_op("]"):
+            # Empty list, which libcst handles in its own way
+            raise Unsupported()
+        while True:
+            row_type, row = self.read_row()
+            # Comments between a row and its comma are dropped by the libcst
+            # engine, so anything other than spaces is unsupported.
+            if self.token.type in GAP_TOKENS:
+                gap = self.read_gap()
+                if not self.is_op("]"):
+                    raise Unsupported()
+            elif self.is_op(","):
+                self.advance()
+                gap = self.read_gap()
+            elif self.is_op("]"):
+                gap = "", []
+            else:
+                raise Unsupported()
+
+            if self.is_op("]"):
+                # The last row, and `gap` is before the closing bracket.
+                end_of_row_comment, final_comments = gap
+                yield TableRow(row_type, row, end_of_row_comment, "")
+                break
+            end_of_row_comment, comments = gap
+            yield TableRow(row_type, row, end_of_row_comment, "\n".join(comments))
+
+        self.advance()
+        while self.token is not None:
+            if self.advance().type not in (tokenize.NEWLINE, tokenize.DEDENT, tokenize.ENDMARKER):
+                raise Unsupported()
+        yield TableTail([comment + "\n" for comment in final_comments])
+
+    def is_op(self, string):
+        token = self.token
+        return token.type == tokenize.OP and token.string == string
+
+    def read_gap(self):
+        """
+        Read the comments and newlines between two tokens.
+
+        Returns the comment on the first line (or "") and a list of the
+        following lines, each a comment or "" for blank lines. This matches how
+        libcst divides whitespace.
+        """
+        lines = []
+        comment = ""
+        while self.token.type in GAP_TOKENS:
+            token = self.advance()
+            if token.type == tokenize.COMMENT:
+                comment = token.string
+            else:
+                lines.append(comment)
+                comment = ""
+        if not lines:
+            # No newline, so any whitespace is just spaces
+            return "", []
+        return lines[0], lines[1:]
+
+    def read_row(self):
+        opener = self.advance()
+        if opener.type != tokenize.OP or opener.string not in ("[", "("):
+            raise Unsupported()
+        depth = 1
+        cells = []
+        cell_tokens = []
+        has_comma = False
+        while True:
+            token = self.advance()
+            if token.type == tokenize.COMMENT:
+                raise Unsupported()
+            if token.type == tokenize.NL:
+                continue
+            if token.type == tokenize.OP:
+                if token.string in OPENING_BRACKETS:
+                    depth += 1
+                elif token.string in CLOSING_BRACKETS:
+                    depth -= 1
+                    if depth == 0:
+                        if token.string != CLOSER[opener.string]:
+                            raise Unsupported()
+                        if cell_tokens:
+                            cells.append(self.render_cell(cell_tokens))
+                        break
+                elif token.string == "," and depth == 1:
+                    if not cell_tokens:
+                        raise Unsupported()
+                    cells.append(self.render_cell(cell_tokens))
+                    cell_tokens = []
+                    has_comma = True
+                    continue
+            elif token.type == tokenize.NAME and depth == 1 and token.string in UNSUPPORTED_ROW_KEYWORDS:
+                raise Unsupported()
+            elif token.type in (tokenize.ENDMARKER, tokenize.NEWLINE, tokenize.ERRORTOKEN):
+                raise Unsupported()
+            cell_tokens.append(token)
+        if opener.string == "(" and cells and not has_comma:
+            # Just parentheses, not a tuple
+            raise Unsupported()
+        return opener.string, cells
+
+    def render_cell(self, cell_tokens):
+        rendered = self.fast_render_cell(cell_tokens)
+        if rendered is not None:
+            if self.stats is not None:
+                self.stats.direct_cells += 1
+            return rendered
+        source = self.cell_source(cell_tokens)
+        if self.deferred is not None:
+            rendered = cell_cache.get((source, self.quote_style))
+            if rendered is None:
+                self.deferred.add(source)
+            return rendered
+        try:
+            return render_cell_source(source, self.quote_style, stats=self.stats)
+        except SyntaxError:
+            raise Unsupported()
+
+    def fast_render_cell(self, cell_tokens):
+        """
+        Render a simple cell straight from its tokens, or return None if it isn't simple.
+        """
+        node = None
+        if len(cell_tokens) == 1:
+            node = token_to_node(cell_tokens[0])
+        elif len(cell_tokens) == 2 and cell_tokens[0].string == "-" and cell_tokens[1].type == tokenize.NUMBER:
+            operand = token_to_node(cell_tokens[1])
+            if operand is not None:
+                node = ast.UnaryOp(op=ast.USub(), operand=operand)
+        if node is None:
+            return None
+        rendered = fast_render_cell(node, self.quote_style)
+        if rendered is None or not self.intern_cells:
+            return rendered
+        return sys.intern(rendered)
+
+    def cell_source(self, cell_tokens):
+        start = self.line_offsets[cell_tokens[0].start[0] - 1] + cell_tokens[0].start[1]
+        end = self.line_offsets[cell_tokens[-1].end[0] - 1] + cell_tokens[-1].end[1]
+        return self.code[start:end]
+
+
+class StreamTableTokenParser(TableTokenParser):
+    """
+    Like TableTokenParser, but reading the code a line at a time with `readline`.
+
+    Only the lines of the row being read are kept, so with `iter_parse`, a
+    table of any length can be read in the memory needed for its longest row.
+    Unlike TableTokenParser, the code may start with blank lines and an indent.
+    """
+
+    intern_cells = False
+
+    def __init__(
+        self, readline: Callable[[], str], quote_style: QuoteStyle = QuoteStyle.SINGLE, stats: ReformatStats = None
+    ):
+        self.quote_style = quote_style
+        self.stats = stats
+        self.deferred = None
+        self.source_readline = readline
+        # Lines by line number, from `first_line` on
+        self.lines = {}
+        self.first_line = 1
+        self.line_count = 0
+        self.tokens = tokenize.generate_tokens(self.readline)
+        self.token = None
+
+    def readline(self):
+        line = self.source_readline()
+        if line:
+            self.line_count += 1
+            self.lines[self.line_count] = line
+        return line
+
+    def iter_table(self):
+        while self.token.type in (tokenize.NL, tokenize.INDENT):
+            self.advance()
+        yield from super().iter_table()
+
+    def read_row(self):
+        row = super().read_row()
+        # The next row starts at the current token, at the earliest.
+        keep_from = self.token.start[0] if self.token is not None else self.line_count
+        while self.first_line < keep_from:
+            del self.lines[self.first_line]
+            self.first_line += 1
+        return row
+
+    def cell_source(self, cell_tokens):
+        (start_line, start_col), (end_line, end_col) = cell_tokens[0].start, cell_tokens[-1].end
+        if start_line == end_line:
+            return self.lines[start_line][start_col:end_col]
+        return "".join(
+            [self.lines[start_line][start_col:]]
+            + [self.lines[line] for line in range(start_line + 1, end_line)]
+            + [self.lines[end_line][:end_col]]
+        )
+
+
+def render_cell_source(source: str, quote_style: QuoteStyle, stats: ReformatStats = None):
+    """
+    Render a cell from its source code with the decompiler, using the cell cache.
+    """
+
+    def render():
+        rendered = reformat_ast_as_single_line(parse_cell(source), quote_style=quote_style)
+        if stats is not None:
+            stats.decompiled_cells += 1
+        return rendered
+
+    return cell_cache.get_or_render((source, quote_style), render)
+
+
+def token_to_node(token):
+    """
+    Return an AST node for a single token cell, if it's a simple one.
+    """
+    string = token.string
+    if token.type == tokenize.NAME:
+        if string in CONSTANT_NAMES:
+            return ast.Constant(value=CONSTANT_NAMES[string])
+        if keyword.iskeyword(string) or not string.isascii():
+            # Not valid on its own, or needs normalizing
+            return None
+        return ast.Name(id=string)
+    if token.type == tokenize.NUMBER:
+        try:
+            return ast.Constant(value=int(string, 0))
+        except ValueError:
+            pass
+        if string[-1] in "jJ" or not any(c in string for c in ".eE"):
+            return None
+        try:
+            return ast.Constant(value=float(string))
+        except ValueError:
+            return None
+    if token.type == tokenize.STRING:
+        quote_index = min(i for i in (string.find("'"), string.find('"')) if i >= 0)
+        prefix = string[:quote_index]
+        if prefix not in ("", "u", "U") or string[quote_index : quote_index + 3] in ("'''", '"""'):
+            return None
+        value = string[quote_index + 1 : -1]
+        if "\\" in value:
+            return None
+        return ast.Constant(value=value, kind="u" if prefix == "u" else None)
+    return None
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+"""Keep the tables in files formatted, by reformatting files whenever they change.
+
+This is for ``table-format --watch``. Everything stays loaded between changes,
+including the cache of rendered cells, so a change is handled in milliseconds.
+Changes are found with inotify on Linux, and otherwise by checking the
+modification times of the files a few times a second.
+
+The contents of each file are kept from when they were last read or written.
+When a file changes, only the tables that overlap the changed lines are
+reformatted, and a file whose contents are the same as before, like one that
+this has just written, is left alone.
+"""
+import ctypes
+import ctypes.util
+import difflib
+import os
+import select
+import struct
+import sys
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from .git_diff import LineRange
+from .runner import DEFAULT_EXCLUDES, DEFAULT_INCLUDES, FileResult, is_included, iter_python_files, write_atomic
+
+__all__ = ["InotifyWatcher", "PollingWatcher", "WatchedFiles", "changed_line_ranges", "watch"]
+
+# How long to wait after a change for more changes, in seconds. Editors often
+# write a file in several steps, and this collects them into one change.
+DEBOUNCE = 0.05
+
+
+def watch(
+    paths: Iterable[str],
+    include: List[str] = None,
+    exclude: List[str] = None,
+    polling: bool = False,
+    on_ready: Callable[[int], None] = None,
+    **options,
+) -> Iterator[FileResult]:
+    """
+    Watch the files found in `paths` like `reformat_paths` would, and reformat them when they change, forever.
+
+    Yields a FileResult for each changed file that is reformatted or fails to
+    be, but not for files that are already formatted. `options` are passed to
+    `reformat_file`. `on_ready` is called with the number of files being
+    watched, once changes will be noticed.
+    """
+    from .api import reformat_file
+
+    if include is None:
+        include = DEFAULT_INCLUDES
+    if exclude is None:
+        exclude = DEFAULT_EXCLUDES
+    paths = [os.path.normpath(path) for path in paths]
+    watched = WatchedFiles(paths, include, exclude, options)
+    # Import and warm up the formatting code now, rather than on the first change.
+    reformat_file("# fmt: off\nx = [\n    [a],\n]\n", **options)
+    if not polling and InotifyWatcher.available():
+        watcher = InotifyWatcher(paths, include, exclude)
+    else:
+        watcher = PollingWatcher(lambda: watched.find_files())
+    try:
+        if on_ready is not None:
+            on_ready(len(watched.contents))
+        while True:
+            changed = watcher.wait(None)
+            while True:
+                more = watcher.wait(DEBOUNCE)
+                if not more:
+                    break
+                changed |= more
+            yield from watched.handle(changed)
+    finally:
+        watcher.close()
+
+
+class WatchedFiles:
+    """
+    The contents of the watched files, and how to reformat them when they change.
+    """
+
+    def __init__(self, paths: List[str], include: List[str], exclude: List[str], options: dict):
+        self.paths = paths
+        self.include = include
+        self.exclude = exclude
+        self.options = options
+        self.contents: Dict[str, str] = {}
+        for path in self.find_files():
+            try:
+                self.contents[path] = read_file(path)
+            except (OSError, UnicodeDecodeError):
+                pass
+
+    def find_files(self) -> List[str]:
+        return [os.path.normpath(path) for path in iter_python_files(self.paths, self.include, self.exclude)]
+
+    def handle(self, paths: Set[str]) -> Iterator[FileResult]:
+        """
+        Reformat the files that have changed since they were last seen, out of `paths`.
+        """
+        from .api import reformat_file
+
+        for path in sorted(paths):
+            try:
+                source = read_file(path)
+            except (OSError, UnicodeDecodeError):
+                # Deleted, or not readable yet
+                self.contents.pop(path, None)
+                continue
+            old_source = self.contents.get(path)
+            if source == old_source:
+                continue
+            lines = None if old_source is None else changed_line_ranges(old_source, source)
+            try:
+                reformatted = reformat_file(source, lines=lines, **self.options)
+                # Only now, so that after an error, the next change is compared
+                # with the contents from before the failed one.
+                self.contents[path] = source
+                if reformatted == source:
+                    continue
+                # Don't overwrite a change made while reformatting. It will be
+                # handled next time.
+                if read_file(path) != source:
+                    continue
+                data = reformatted.encode("utf-8")
+                write_atomic(path, data)
+            except Exception as e:
+                yield FileResult(path, error=repr(e))
+                continue
+            self.contents[path] = reformatted
+            yield FileResult(path, changed=True, bytes_written=len(data))
+
+
+def read_file(path: str) -> str:
+    with open(path, encoding="utf-8", newline="") as f:
+        return f.read()
+
+
+def changed_line_ranges(old: str, new: str) -> List[LineRange]:
+    """
+    Return the lines of `new` that are different from `old`, like `changed_lines` does for git.
+    """
+    matcher = difflib.SequenceMatcher(None, old.split("\n"), new.split("\n"), autojunk=False)
+    return [
+        LineRange(new_start + 1, new_end)
+        for tag, _, _, new_start, new_end in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+class PollingWatcher:
+    """
+    Finds changed files by checking their modification times and sizes every `interval` seconds.
+    """
+
+    def __init__(self, find_files: Callable[[], List[str]], interval: float = 0.25):
+        self.find_files = find_files
+        self.interval = interval
+        self.stats = self.scan()
+
+    def scan(self):
+        stats = {}
+        for path in self.find_files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+        return stats
+
+    def wait(self, timeout: Optional[float]) -> Set[str]:
+        """
+        Return the files that have changed, or been added, waiting for up to `timeout` seconds for some.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+            if delay > 0:
+                time.sleep(delay)
+            stats = self.scan()
+            changed = {path for path, stat in stats.items() if self.stats.get(path) != stat}
+            self.stats = stats
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """
+    Finds changed files with Linux's inotify, which says which files were written without having to look.
+
+    Directories are watched rather than files, so that files replaced by
+    renaming, as many editors save them, are noticed too.
+    """
+
+    @staticmethod
+    def available() -> bool:
+        return sys.platform.startswith("linux") and load_libc() is not None
+
+    def __init__(self, paths: List[str], include: List[str], exclude: List[str]):
+        self.libc = load_libc()
+        self.include = include
+        self.exclude = exclude
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # Directory for each watch descriptor, and the directory given on the
+        # command line that it is in, or None for the directory of a file.
+        self.directories: Dict[int, tuple] = {}
+        self.files: Set[str] = set()
+        for path in paths:
+            if os.path.isdir(path):
+                self.add_tree(path, path)
+            else:
+                self.files.add(path)
+                self.add_directory(os.path.dirname(path) or ".", None)
+
+    def add_directory(self, directory: str, root: Optional[str]):
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            # Deleted already, or not readable
+            return
+        # A directory can be both given on the command line and contain a file
+        # that was, so keep the root if there is one.
+        if self.directories.get(wd, (None, None))[1] is None:
+            self.directories[wd] = (directory, root)
+
+    def add_tree(self, directory: str, root: str) -> Set[str]:
+        """
+        Watch a directory and the ones inside it, returning the files already in them.
+        """
+        files = set()
+        for dir_path, dirs, names in os.walk(directory):
+            rel_dir = os.path.relpath(dir_path, root)
+            dirs[:] = [name for name in dirs if not excluded(os.path.join(rel_dir, name), self.exclude)]
+            self.add_directory(dir_path, root)
+            for name in names:
+                path = os.path.normpath(os.path.join(dir_path, name))
+                if is_included(os.path.relpath(path, root), self.include, self.exclude):
+                    files.add(path)
+        return files
+
+    def wait(self, timeout: Optional[float]) -> Set[str]:
+        """
+        Return the files that have been written, or added, waiting for up to `timeout` seconds for some.
+        """
+        changed = set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not changed:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not select.select([self.fd], [], [], remaining)[0]:
+                break
+            data = os.read(self.fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset : offset + name_length].rstrip(b"\0"))
+                offset += name_length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost, so anything could have changed.
+                    changed.update(self.all_files())
+                    continue
+                if wd not in self.directories or not name:
+                    continue
+                directory, root = self.directories[wd]
+                path = os.path.normpath(os.path.join(directory, name))
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO) and root is not None:
+                        if not excluded(os.path.relpath(path, root), self.exclude):
+                            changed.update(self.add_tree(path, root))
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and self.wanted(path, root):
+                    changed.add(path)
+        return changed
+
+    def wanted(self, path: str, root: Optional[str]) -> bool:
+        if path in self.files:
+            return True
+        return root is not None and is_included(os.path.relpath(path, root), self.include, self.exclude)
+
+    def all_files(self) -> Set[str]:
+        files = set(self.files)
+        for directory, root in self.directories.values():
+            if root is None:
+                continue
+            for name in os.listdir(directory):
+                path = os.path.normpath(os.path.join(directory, name))
+                if os.path.isfile(path) and self.wanted(path, root):
+                    files.add(path)
+        return files
+
+    def close(self):
+        os.close(self.fd)
+
+
+def excluded(rel_path: str, exclude: List[str]) -> bool:
+    """
+    Return whether a directory is skipped by `iter_python_files`, given its path relative to the one being walked.
+    """
+    return not is_included(rel_path, ["*"], exclude)
+
+
+def load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
@@ -0,0 +1,53 @@
+# fmt: off
+# Black tends to obfuscate these tests, turned off for whole file
+import pytest
+
+from table_format import QuoteStyle, SnippetResult, reformat, reformat_many
+from table_format.batch import parallel_map
+
+SNIPPETS = [
+    "[[1, 2], [34, 5]]",
+    "[[1, 2]",
+    "",
+    '[["a", f(x)], [None, 2]]',
+]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_reformat_many(jobs):
+    results = reformat_many(SNIPPETS * 10, jobs=jobs, quote_style=QuoteStyle.DOUBLE)
+    assert len(results) == 40
+    assert results[:4] == [
+        SnippetResult(output=reformat(SNIPPETS[0], quote_style=QuoteStyle.DOUBLE)),
+        SnippetResult(error='AssertionError("Couldn\'t parse input as Python code")'),
+        SnippetResult(output=""),
+        SnippetResult(output=reformat(SNIPPETS[3], quote_style=QuoteStyle.DOUBLE)),
+    ]
+    assert results[4:] == results[:4] * 9
+
+
+def test_reformat_many_bad_options():
+    with pytest.raises(ValueError):
+        reformat_many(["[[1]]"], engine="bogus")
+
+
+@pytest.mark.parametrize("jobs", [0, -1])
+def test_reformat_many_bad_jobs(jobs):
+    with pytest.raises(ValueError, match="jobs must be at least 1"):
+        reformat_many(["[[1]]"], jobs=jobs)
+
+
+@pytest.mark.parametrize("jobs, chunksize", [(1, 1), (2, 1), (3, 4)])
+def test_parallel_map(jobs, chunksize):
+    items = (i for i in range(50))
+    assert list(parallel_map(abs, items, jobs=jobs, chunksize=chunksize)) == list(range(50))
+
+
+def fail_at_ten():
+    yield from range(10)
+    raise ValueError("Bad item")
+
+
+def test_parallel_map_items_error():
+    with pytest.raises(ValueError, match="Bad item"):
+        list(parallel_map(abs, fail_at_ten(), jobs=2))
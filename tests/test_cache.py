@@ -0,0 +1,96 @@
+# fmt: off
+# Black tends to obfuscate these tests, turned off for whole file
+import os
+
+from table_format import QuoteStyle, ReformatStats
+from table_format.cache import Cache, content_hash, get_cache_dir
+from table_format.runner import reformat_paths
+
+OPTIONS = {"align_commas": False, "add_noqa": None, "quote_style": QuoteStyle.SINGLE}
+
+FORMATTED = "# fmt: off\nx = [\n    [1,  2],\n    [34, 5],\n]\n"
+UNFORMATTED = "# fmt: off\nx = [\n    [1, 2],\n    [34, 5],\n]\n"
+
+
+def test_cache_round_trip(tmp_path):
+    path = tmp_path / "a.py"
+    path.write_text(FORMATTED)
+    cache = Cache.read(OPTIONS, cache_dir=str(tmp_path / "cache"))
+    assert not cache.is_formatted(str(path))
+    cache.mark_formatted(str(path))
+    cache.write()
+
+    cache = Cache.read(OPTIONS, cache_dir=str(tmp_path / "cache"))
+    assert cache.is_formatted(str(path))
+    path.write_text(UNFORMATTED)
+    assert not cache.is_formatted(str(path))
+    # Only the cache file itself is left, no temporary files.
+    assert os.listdir(tmp_path / "cache") == [os.path.basename(cache.path)]
+
+
+def test_cache_keyed_on_options_and_version(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path)
+    path = Cache(OPTIONS, cache_dir=cache_dir).path
+    assert Cache(dict(OPTIONS), cache_dir=cache_dir).path == path
+    assert Cache(dict(OPTIONS, align_commas=True), cache_dir=cache_dir).path != path
+    assert Cache(dict(OPTIONS, add_noqa=["E202"]), cache_dir=cache_dir).path != path
+    assert Cache(dict(OPTIONS, add_noqa=[]), cache_dir=cache_dir).path == path
+    noqa_path = Cache(dict(OPTIONS, add_noqa=["E202", "E501"]), cache_dir=cache_dir).path
+    assert Cache(dict(OPTIONS, add_noqa=["E501", "E202", "E501"]), cache_dir=cache_dir).path == noqa_path
+    assert Cache(dict(OPTIONS, quote_style=QuoteStyle.DOUBLE), cache_dir=cache_dir).path != path
+    monkeypatch.setattr("table_format.cache.VERSION", "0.0.0")
+    assert Cache(OPTIONS, cache_dir=cache_dir).path != path
+
+
+def test_cache_mark_formatted_hash(tmp_path):
+    # The hash of what was checked is recorded, not of what is in the file
+    # now, which could have been changed since.
+    path = tmp_path / "a.py"
+    path.write_text(UNFORMATTED)
+    cache = Cache(OPTIONS, cache_dir=str(tmp_path / "cache"))
+    cache.mark_formatted(str(path), content_hash(FORMATTED.encode("utf-8")))
+    assert not cache.is_formatted(str(path))
+    path.write_text(FORMATTED)
+    assert cache.is_formatted(str(path))
+
+
+def test_cache_unreadable(tmp_path):
+    cache = Cache(OPTIONS, cache_dir=str(tmp_path))
+    with open(cache.path, "w") as f:
+        f.write("not json")
+    assert Cache.read(OPTIONS, cache_dir=str(tmp_path)).files == {}
+
+
+def test_cache_dir(monkeypatch):
+    monkeypatch.setenv("TABLE_FORMAT_CACHE_DIR", "/tmp/tf-cache")
+    assert get_cache_dir() == "/tmp/tf-cache"
+    monkeypatch.delenv("TABLE_FORMAT_CACHE_DIR")
+    assert get_cache_dir().endswith("table-format")
+
+
+def test_reformat_paths_with_cache(tmp_path):
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "a.py").write_text(FORMATTED)
+    (tmp_path / "src" / "b.py").write_text(UNFORMATTED)
+    (tmp_path / "src" / "bad.py").write_text("x = [")
+    cache = Cache.read(OPTIONS, cache_dir=str(tmp_path / "cache"))
+
+    # Checking only adds the files that are formatted already.
+    results = list(reformat_paths([str(tmp_path / "src")], jobs=1, cache=cache, check=True, **OPTIONS))
+    assert [(os.path.basename(r.path), r.changed, r.error is None) for r in results] == [
+        ("a.py", False, True),
+        ("b.py", True, True),
+        ("bad.py", False, False),
+    ]
+    assert sorted(os.path.basename(path) for path in cache.files) == ["a.py"]
+
+    # Reformatting adds the files that were changed.
+    list(reformat_paths([str(tmp_path / "src")], jobs=1, cache=cache, **OPTIONS))
+    assert sorted(os.path.basename(path) for path in cache.files) == ["a.py", "b.py"]
+
+    # Now the formatted files are skipped without being parsed.
+    stats = ReformatStats()
+    results = list(reformat_paths([str(tmp_path / "src")], jobs=1, cache=cache, stats=stats, **OPTIONS))
+    assert [r.changed for r in results] == [False, False, False]
+    assert results[2].error is not None
+    assert stats.tables == 0
@@ -0,0 +1,89 @@
+# fmt: off
+# Black tends to obfuscate these tests, turned off for whole file
+import pytest
+
+from table_format import QuoteStyle, is_file_formatted, is_formatted, reformat, reformat_file
+
+FORMATTED = """[  # Opening
+    [1,  'a',   f(x)      ],  # One
+    # After one
+    (34, 'b\\n', {'k': [1]}),
+]"""
+
+
+@pytest.mark.parametrize("code, options", [
+    (FORMATTED, {}),
+    (FORMATTED.replace("'a'", '"a"'), {}),
+    (FORMATTED.replace("'a',  ", '"a",  '), {"quote_style": QuoteStyle.DOUBLE}),
+    (FORMATTED.replace("],  #", "] ,  #"), {}),
+    (FORMATTED, {"align_commas": True}),
+    (FORMATTED, {"add_noqa": ["E202"]}),
+    (FORMATTED.replace("1,  ", "1, "), {}),
+    (FORMATTED.replace("f(x)", "f( x )"), {}),
+    (FORMATTED.replace("f(x)      ]", "f(x)]"), {}),
+    ("[[0x10, 2]]", {}),
+    ("[\n    [0x10, 2],\n]", {}),
+    ("[\n    [16, 2],\n]", {}),
+    ("[\n    [-1.50, 2],\n]", {}),
+    ("[\n    *[a, b],\n]", {}),
+    ("", {}),
+])
+def test_is_formatted_matches_reformat(code, options):
+    assert is_formatted(code, **options) == (reformat(code, **options) == code)
+
+
+def test_is_formatted_trailing_whitespace():
+    assert is_formatted(FORMATTED + "\n")
+
+
+def test_is_formatted_guess_indent():
+    code = "  [\n      [1, 2],\n  ]"
+    assert is_formatted(code, guess_indent=True)
+    assert not is_formatted(code)
+
+
+@pytest.mark.parametrize("code", ["[[1, 2]", "[\n    [a for a in b],\n]"])
+def test_is_formatted_invalid(code):
+    with pytest.raises(AssertionError):
+        is_formatted(code)
+
+
+MODULE = """import foo
+
+# fmt: off
+X = [
+    [1,  2],
+    [34, 5],
+]
+
+Y = [[1, 2], [34, 5]]
+
+def f(items=[1, 2, 3]):
+    return items[
+        0
+    ]
+"""
+
+
+@pytest.mark.parametrize("source", [
+    MODULE,
+    MODULE.replace("[1,  2],", "[1, 2],"),
+    MODULE.replace("\n", "\r\n"),
+    MODULE.replace("X = [", "X = ([").replace("\n]\n", "\n])\n"),
+    MODULE.replace("# fmt: off\n", ""),
+    MODULE.replace("[34, 5],", "[34, 5],  # Comment"),
+    MODULE.replace("[34, 5],", "[f( x ), 5],"),
+    MODULE.replace("X = [", "match [").replace("\n]\n", "\n]:\n    case _:\n        pass\n"),
+    "# fmt: off\nx = [\n    y[\n        1\n    ],\n]\n",
+    "# fmt: off\nx = [\n    [1, 2],\n    [[3], 4],\n]\n",
+    "x = 1  # \x0c\n" + MODULE,
+    "s = '\u2028'\n" + MODULE.replace("[1,  2],", "[1, 2],"),
+    MODULE.replace("\n", "\r"),
+])
+def test_is_file_formatted_matches_reformat_file(source):
+    assert is_file_formatted(source) == (reformat_file(source) == source)
+
+
+def test_is_file_formatted_invalid():
+    with pytest.raises(AssertionError):
+        is_file_formatted("# fmt: off\nx = [\n")
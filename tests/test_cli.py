@@ -1,7 +1,18 @@
 # fmt: off
 # Black tends to obfuscate these tests, turned off for whole file
 
+import json
 import subprocess
+import threading
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory, monkeypatch):
+    cache_dir = tmp_path_factory.mktemp('cache')
+    monkeypatch.setenv('TABLE_FORMAT_CACHE_DIR', str(cache_dir))
+    return cache_dir
 
 
 def test_cli_simple():
@@ -15,3 +26,266 @@ def test_cli_quote_style():
     assert output == b'''[
     ["hi"],
 ]'''
+
+
+def test_cli_engine():
+    output = subprocess.check_output(['table-format', '--engine', 'fast'], input=b'[[1, 2], [34, 5]]')  # noqa:S607
+    assert output == b'''[
+    [1,  2],
+    [34, 5],
+]'''
+
+
+def test_cli_profile(tmp_path):
+    pstats_file = tmp_path / 'profile.pstats'
+    result = subprocess.run(['table-format', f'--profile={pstats_file}'],  # noqa:S607
+                            input=b'[[1, 2], [34, f(x)]]', capture_output=True)
+    assert result.returncode == 0
+    assert result.stdout == b'''[
+    [1,  2   ],
+    [34, f(x)],
+]'''
+    assert b'layout' in result.stderr
+    assert b'tables: 1, rows: 2, cells: 4' in result.stderr
+    assert pstats_file.exists()
+
+
+def test_cli_profile_files(tmp_path):
+    (tmp_path / 'a.py').write_text('# fmt: off\nx = [\n    [1, 2],\n    [34, 5],\n]\n')
+    result = subprocess.run(['table-format', str(tmp_path), '--profile'], capture_output=True)  # noqa:S607
+    assert result.returncode == 0
+    assert b'1 file reformatted' in result.stderr
+    assert b'tables: 1, rows: 2, cells: 4' in result.stderr
+
+
+def test_cli_files(tmp_path):
+    formatted = tmp_path / 'formatted.py'
+    formatted.write_text('# fmt: off\nx = [\n    [1,  2],\n    [34, 5],\n]\n')
+    unformatted = tmp_path / 'unformatted.py'
+    unformatted.write_text('# fmt: off\nx = [\n    [1, 2],\n    [34, 5],\n]\n')
+    result = subprocess.run(['table-format', str(formatted), str(unformatted)], capture_output=True)  # noqa:S607
+    assert result.returncode == 0
+    assert result.stderr == f'''reformatted {unformatted}
+1 file reformatted (45 bytes written), 1 file left unchanged, 0 files failed to reformat.
+'''.encode()
+    assert unformatted.read_text() == formatted.read_text()
+
+
+def test_cli_files_error(tmp_path):
+    bad = tmp_path / 'bad.py'
+    bad.write_text('x = [')
+    result = subprocess.run(['table-format', str(bad)], capture_output=True)  # noqa:S607
+    assert result.returncode == 1
+    assert b'cannot format' in result.stderr
+    assert bad.read_text() == 'x = ['
+
+
+def test_cli_directories(tmp_path):
+    table = '# fmt: off\nx = [\n    [1, 2],\n    [34, 5],\n]\n'
+    for name in ['a.py', 'b.py', 'sub/c.py', 'sub/skip_me.py', 'sub/data.txt', '.tox/d.py']:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_text(table)
+    (tmp_path / 'sub' / 'bad.py').write_text('x = [')
+    result = subprocess.run(['table-format', str(tmp_path), '-j', '2', '--exclude', 'skip_*.py'],  # noqa:S607
+                            capture_output=True)
+    assert result.returncode == 1
+    assert result.stderr.endswith(b'3 files reformatted (135 bytes written), 0 files left unchanged, '
+                                  b'1 file failed to reformat.\n')
+    assert b'cannot format' in result.stderr
+    for name in ['a.py', 'b.py', 'sub/c.py']:
+        assert (tmp_path / name).read_text() != table
+    for name in ['sub/skip_me.py', 'sub/data.txt', '.tox/d.py']:
+        assert (tmp_path / name).read_text() == table
+
+
+def test_cli_check(tmp_path):
+    formatted = tmp_path / 'formatted.py'
+    formatted.write_text('# fmt: off\nx = [\n    [1,  2],\n    [34, 5],\n]\n')
+    unformatted = tmp_path / 'unformatted.py'
+    unformatted.write_text('# fmt: off\nx = [\n    [1, 2],\n    [34, 5],\n]\n')
+    result = subprocess.run(['table-format', '--check', str(formatted)], capture_output=True)  # noqa:S607
+    assert result.returncode == 0
+    assert result.stderr == (b'0 files would be reformatted, 1 file would be left unchanged, '
+                             b'0 files would fail to reformat.\n')
+    result = subprocess.run(['table-format', '--check', str(formatted), str(unformatted)],  # noqa:S607
+                            capture_output=True)
+    assert result.returncode == 1
+    assert result.stdout == b''
+    assert result.stderr == f'''would reformat {unformatted}
+1 file would be reformatted, 1 file would be left unchanged, 0 files would fail to reformat.
+'''.encode()
+    assert unformatted.read_text() == '# fmt: off\nx = [\n    [1, 2],\n    [34, 5],\n]\n'
+
+
+def test_cli_diff(tmp_path):
+    unformatted = tmp_path / 'unformatted.py'
+    unformatted.write_text('# fmt: off\nx = [\n    [1, 2],\n    [34, 5],\n]\n')
+    result = subprocess.run(['table-format', '--diff', str(unformatted)], capture_output=True)  # noqa:S607
+    assert result.returncode == 0
+    assert result.stdout == f'''--- {unformatted}\t(original)
++++ {unformatted}\t(reformatted)
+@@ -1,5 +1,5 @@
+ # fmt: off
+ x = [
+-    [1, 2],
++    [1,  2],
+     [34, 5],
+ ]
+'''.encode()
+    result = subprocess.run(['table-format', '--diff', '--check', str(unformatted)],  # noqa:S607
+                            capture_output=True)
+    assert result.returncode == 1
+    assert unformatted.read_text() == '# fmt: off\nx = [\n    [1, 2],\n    [34, 5],\n]\n'
+
+
+def test_cli_check_stdin():
+    result = subprocess.run(['table-format', '--check'], input=b'[\n    [1,  2],\n    [34, 5],\n]\n',  # noqa:S607
+                            capture_output=True)
+    assert result.returncode == 0
+    assert result.stdout == b''
+    result = subprocess.run(['table-format', '--check', '--diff'], input=b'[[1, 2], [34, 5]]',  # noqa:S607
+                            capture_output=True)
+    assert result.returncode == 1
+    assert result.stdout.startswith(b'--- stdin\t(original)\n+++ stdin\t(reformatted)\n')
+
+
+def test_cli_cache(tmp_path, cache_dir):
+    unformatted = tmp_path / 'unformatted.py'
+    unformatted.write_text('# fmt: off\nx = [\n    [1, 2],\n    [34, 5],\n]\n')
+    result = subprocess.run(['table-format', str(unformatted)], capture_output=True)  # noqa:S607
+    assert b'1 file reformatted' in result.stderr
+    assert len(list(cache_dir.iterdir())) == 1
+    # The file is now known to be formatted, so it isn't parsed at all.
+    result = subprocess.run(['table-format', str(unformatted), '--profile'], capture_output=True)  # noqa:S607
+    assert result.returncode == 0
+    assert b'1 file left unchanged' in result.stderr
+    assert b'tables: 0' in result.stderr
+    result = subprocess.run(['table-format', str(unformatted), '--profile', '--no-cache'],  # noqa:S607
+                            capture_output=True)
+    assert result.returncode == 0
+    assert b'tables: 1' in result.stderr
+
+
+def test_cli_jsonl():
+    records = b'''{"id": 1, "code": "[[1, 2], [34, 5]]"}
+{"id": "b", "code": "[[\\"a\\"]]", "options": {"quote_style": "double", "align_commas": false}}
+
+not json
+{"id": 3, "code": "[[1]"}
+'''
+    for jobs in ['1', '2']:
+        result = subprocess.run(['table-format', '--jsonl', '--align-commas', '-j', jobs],  # noqa:S607
+                                input=records, capture_output=True)
+        assert result.returncode == 1
+        assert [json.loads(line) for line in result.stdout.splitlines()] == [
+            {'id': 1, 'output': '[\n    [1 , 2],\n    [34, 5],\n]'},
+            {'id': 'b', 'output': '[\n    ["a"],\n]'},
+            {'id': None, 'error': "JSONDecodeError('Expecting value: line 1 column 1 (char 0)')"},
+            {'id': 3, 'error': 'AssertionError("Couldn\'t parse input as Python code")'},
+        ]
+
+
+def test_cli_stream(tmp_path):
+    path = tmp_path / 'table.py'
+    path.write_bytes(b'  [\n   [1, 2],\n   [34, 5],  # c\n  ]\n')
+    expected = b'  [\n    [1,  2],\n    [34, 5],  # c\n]'
+    # From a file, which can be read twice, and from a pipe, which is copied first.
+    with open(path, 'rb') as f:
+        assert subprocess.check_output(['table-format', '--stream'], stdin=f) == expected  # noqa:S607
+    assert subprocess.check_output(['table-format', '--stream'], input=path.read_bytes()) == expected  # noqa:S607
+    result = subprocess.run(['table-format', '--stream'], input=b'[[1], x', capture_output=True)  # noqa:S607
+    assert result.returncode == 1
+    assert result.stdout == b'[[1], x'
+
+
+def test_cli_workers():
+    code = b'[\n  [1, f(x)],\n  [34, g(y)],\n]'
+    expected = subprocess.check_output(['table-format'], input=code)  # noqa:S607
+    assert subprocess.check_output(['table-format', '--workers', '2'], input=code) == expected  # noqa:S607
+
+
+def test_cli_budget():
+    code = b'[\n  [1, f(x)],\n  [34, g(y)],\n]'
+    result = subprocess.run(['table-format', '--budget', '1000ms,3cells'], input=code, capture_output=True)  # noqa:S607
+    assert result.returncode == 3
+    assert result.stdout == code
+    assert b"BudgetExceeded" in result.stderr
+    result = subprocess.run(['table-format', '--budget', '60000,4cells'], input=code, capture_output=True)  # noqa:S607
+    assert result.returncode == 0
+    assert result.stdout == subprocess.check_output(['table-format'], input=code)  # noqa:S607
+    result = subprocess.run(['table-format', '--budget', '1s'], input=code, capture_output=True)  # noqa:S607
+    assert result.returncode == 2
+    # --check keeps to the budget too.
+    result = subprocess.run(['table-format', '--check', '--budget', '3cells'],  # noqa:S607
+                            input=code, capture_output=True)
+    assert result.returncode == 3
+
+
+@pytest.mark.parametrize("option", [
+    ['--workers', '2'], ['--budget', '200ms'], ['--stream'], ['--from-csv'], ['--guess-indent'], ['--engine', 'fast'],
+])
+def test_cli_files_stdin_only_options(tmp_path, option):
+    path = tmp_path / 'table.py'
+    path.write_text('# fmt: off\nx = [\n    [1, 2],\n    [34, 5],\n]\n')
+    result = subprocess.run(['table-format', str(path)] + option, capture_output=True)  # noqa:S607
+    assert result.returncode == 2
+    assert f"{option[0]} can't be used with files".encode() in result.stderr
+    assert path.read_text() == '# fmt: off\nx = [\n    [1, 2],\n    [34, 5],\n]\n'
+
+
+def test_cli_files_atomic_write(tmp_path):
+    table = tmp_path / 'table.py'
+    table.write_text('# fmt: off\nx = [\n    [1, 2],\n    [34, 5],\n]\n')
+    table.chmod(0o751)
+    link = tmp_path / 'link.py'
+    link.symlink_to(table)
+    formatted = tmp_path / 'formatted.py'
+    formatted.write_text('# fmt: off\nx = [\n    [1,  2],\n    [34, 5],\n]\n')
+    formatted_mtime = formatted.stat().st_mtime_ns
+    result = subprocess.run(['table-format', str(link), str(formatted)], capture_output=True)  # noqa:S607
+    assert result.returncode == 0
+    assert b'1 file reformatted (45 bytes written), 1 file left unchanged' in result.stderr
+    # The file the link points to is replaced, keeping its permissions.
+    assert link.is_symlink()
+    assert table.read_text() == formatted.read_text()
+    assert table.stat().st_mode & 0o777 == 0o751
+    # Formatted files aren't written to at all, and no temporary files are left.
+    assert formatted.stat().st_mtime_ns == formatted_mtime
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['formatted.py', 'link.py', 'table.py']
+
+
+def test_cli_from_csv(tmp_path):
+    path = tmp_path / 'data.tsv'
+    path.write_bytes('﻿a\tb\r\n1\t"x\r\ny"\r\n'.encode())
+    expected = b"[\n    ['a', 'b'     ],\n    [1,   'x\\r\\ny'],\n]"
+    # From a file, and from a pipe, which is copied first. The byte order mark is skipped.
+    with open(path, 'rb') as f:
+        assert subprocess.check_output(['table-format', '--from-csv', 'excel-tab', '--csv-numbers'],  # noqa:S607
+                                       stdin=f) == expected
+    assert subprocess.check_output(['table-format', '--from-csv', 'excel-tab', '--csv-numbers'],  # noqa:S607
+                                   input=path.read_bytes()) == expected
+    output = subprocess.check_output(['table-format', '--from-csv'], input=b'a,b\n')  # noqa:S607
+    assert output == b"[\n    ['a', 'b'],\n]"
+
+
+def test_cli_watch(tmp_path):
+    table = tmp_path / 'table.py'
+    source = '# fmt: off\nx = [\n    [1,  2],\n    [34, 5],\n]\n\ny = [\n    [1, 2],\n    [34, 5],\n]\n'
+    table.write_text(source)
+    process = subprocess.Popen(['table-format', '--watch', str(tmp_path)], stderr=subprocess.PIPE)  # noqa:S607
+    # So that a missing line fails the test, rather than blocking it
+    timer = threading.Timer(30, process.kill)
+    timer.start()
+    try:
+        assert process.stderr.readline() == b'Watching 1 file for changes, press Ctrl-C to stop.\n'
+        # Only the changed table is reformatted.
+        table.write_text(source.replace('[1,  2]', '[1, 22]'))
+        assert process.stderr.readline() == f'reformatted {table}\n'.encode()
+        expected = source.replace('[1,  2]', '[1,  22]').replace('[34, 5],\n]\n\ny', '[34, 5 ],\n]\n\ny')
+        assert table.read_text() == expected
+        table.write_text('# fmt: off\nx = [\n    [1, 2],\n')
+        assert process.stderr.readline().startswith(f'error: cannot format {table}'.encode())
+    finally:
+        timer.cancel()
+        process.kill()
+        process.wait()
@@ -0,0 +1,55 @@
+# fmt: off
+# Black tends to obfuscate these tests, turned off for whole file
+import ast
+import importlib.util
+import os
+import pickle
+
+import pytest
+
+from table_format import QuoteStyle, core
+
+
+def load_interpreted_core():
+    """
+    Load the pure Python version of `table_format.core`, even if it is compiled.
+    """
+    path = os.path.join(os.path.dirname(core.__file__), "core.py")
+    if not os.path.exists(path):
+        pytest.skip("core.py isn't installed")
+    spec = importlib.util.spec_from_file_location("table_format._interpreted_core", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def lay_out(module, nodes, rows):
+    """
+    Render cells and lay out a table using `module`, the way `reformat` does.
+    """
+    rendered = [[module.fast_render_cell(node, QuoteStyle.SINGLE) for node in nodes] for _ in range(rows)]
+    layout = module.TableLayout(
+        module.column_widths(rendered), indent=" " * module.get_indent_size("        x"),
+        noqa_markers=module.NoqaMarkers(["E501"]),
+    )
+    output = [layout.head("", [])]
+    for idx, row in enumerate(rendered):
+        output.append(layout.row(row, "[", f"# row {idx % 10}", ""))
+    output.append(layout.tail([]))
+    return "".join(output)
+
+
+NODES = [ast.parse(code, mode="eval").body for code in ["1", "-2.5", "'a'", "name", "None", "b'x'"]]
+
+
+def test_interpreted_core_same_output():
+    interpreted = load_interpreted_core()
+    assert lay_out(interpreted, NODES, 50) == lay_out(core, NODES, 50)
+
+
+def test_noqa_markers_pickle():
+    # Needed for rendering in worker processes, when compiled too.
+    markers = core.NoqaMarkers(["E202", "E501"])
+    unpickled = pickle.loads(pickle.dumps(markers))
+    assert unpickled.items == markers.items
+    assert unpickled.add_to("# Comment") == markers.add_to("# Comment") == "noqa: E202,E501  Comment"
@@ -0,0 +1,50 @@
+# fmt: off
+# Black tends to obfuscate these tests, turned off for whole file
+import io
+
+import pytest
+
+from table_format import iter_table_from_csv, reformat
+
+DATA = 'Date,Description,Amount\r\n2021-04-06,"Opened, with ""quotes""",0\r\n\r\n2021-04-07,It\'s é\\,-300\r\n'
+
+
+def table_from_csv(data, **options):
+    return "".join(iter_table_from_csv(io.StringIO(data, newline=""), **options))
+
+
+def test_iter_table_from_csv():
+    assert table_from_csv(DATA) == """[
+    ['Date',       'Description',           'Amount'],
+    ['2021-04-06', 'Opened, with "quotes"', '0'     ],
+    ['2021-04-07', 'It\\'s \\xe9\\\\',          '-300'  ],
+]"""
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"numbers": True},
+    {"align_commas": True, "add_noqa": ["E501", "E202"], "quote_style": "double"},
+])
+def test_iter_table_from_csv_same_as_reformat(options):
+    output = table_from_csv(DATA + 'a,"b\r\nc"\r\nd\r\n', **options)
+    assert reformat(output, **{name: value for name, value in options.items() if name != "numbers"}) == output
+
+
+@pytest.mark.parametrize("item, expected", [
+    ("0", "0"), ("-300", "-300"), ("-0", "-0"), ("1.50", "1.5"), ("1e3", "1000.0"), ("2E-2", "0.02"),
+    ("007", "'007'"), ("1_000", "'1_000'"), ("+1", "'+1'"), ("1.", "'1.'"), ("1e400", "'1e400'"),
+    ("0x1F", "'0x1F'"), ("nan", "'nan'"), ("", "''"), (" 1", "' 1'"),
+])
+def test_iter_table_from_csv_numbers(item, expected):
+    assert table_from_csv(f'"{item}"\n', numbers=True) == f"[\n    [{expected}],\n]"
+    if not expected.startswith("'"):
+        # The same as for the number in Python code
+        assert reformat(f"[[{item}]]") == f"[\n    [{expected}],\n]"
+
+
+def test_iter_table_from_csv_dialect_and_position():
+    file = io.StringIO("skipped\na\tb\n\n1\t22\n", newline="")
+    file.readline()
+    assert "".join(iter_table_from_csv(file, dialect="excel-tab")) == "[\n    ['a', 'b' ],\n    ['1', '22'],\n]"
+    assert table_from_csv("") == "[\n]"
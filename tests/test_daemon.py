@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for :mod:`table_format.daemon`."""
+# fmt: off
+
+import http.client
+import json
+import subprocess
+import threading
+
+import pytest
+
+from table_format import Engine, QuoteStyle
+from table_format.daemon import make_server, parse_options
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = make_server("localhost", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, body, headers):
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    connection.request("POST", "/", body=body, headers=headers)
+    response = connection.getresponse()
+    return response.status, response.read().decode("utf-8")
+
+
+def test_parse_options():
+    options = {"align-commas": "true", "guess_indent": False, "--add-noqa": "E202,E501", "quote-style": "double"}
+    assert parse_options(options) == dict(
+        align_commas=True,
+        guess_indent=False,
+        add_noqa=["E202", "E501"],
+        quote_style=QuoteStyle.DOUBLE,
+        engine=Engine.LIBCST,
+    )
+    with pytest.raises(ValueError):
+        parse_options({"bogus": "1"})
+    with pytest.raises(ValueError):
+        parse_options({"quote-style": "fancy"})
+    with pytest.raises(ValueError):
+        parse_options({"align-commas": "maybe"})
+
+
+def test_parse_options_defaults():
+    from table_format.cli import make_argument_parser
+
+    defaults = make_argument_parser().parse_args(["--align-commas", "--add-noqa=E202", "--engine=fast"])
+    options = {"align_commas": False, "add_noqa": ["E501", "E202"], "quote_style": "double"}
+    assert parse_options(options, defaults=defaults) == dict(
+        align_commas=False,
+        guess_indent=False,
+        add_noqa=["E501", "E202"],
+        quote_style=QuoteStyle.DOUBLE,
+        engine=Engine.FAST,
+    )
+    assert parse_options({}, defaults=defaults)["align_commas"] is True
+
+
+def test_daemon_headers(server):
+    status, output = post(server, '[[1, "a"], [22, b]]', {"X-Align-Commas": "true", "X-Quote-Style": "double"})
+    assert status == 200
+    assert output == '''[
+    [1 , "a"],
+    [22, b  ],
+]'''
+
+
+def test_daemon_ignores_other_headers(server):
+    status, output = post(server, '[[1]]', {"X-Forwarded-For": "127.0.0.1"})
+    assert status == 200
+    assert output == '[\n    [1],\n]'
+
+
+def test_daemon_errors(server):
+    status, output = post(server, '[', {})
+    assert status == 400
+    assert "Couldn't parse" in output
+
+    status, output = post(server, '[[1]]', {"X-Quote-Style": "fancy"})
+    assert status == 400
+    assert "invalid choice" in output
+
+
+@pytest.mark.parametrize("content_length", [None, "x", "-1"])
+def test_daemon_bad_content_length(server, content_length):
+    connection = http.client.HTTPConnection(*server.server_address[:2])
+    connection.putrequest("POST", "/")
+    if content_length is not None:
+        connection.putheader("Content-Length", content_length)
+    connection.endheaders()
+    response = connection.getresponse()
+    assert response.status == 400
+    assert "Content-Length" in response.read().decode("utf-8")
+
+
+def test_daemon_json(server):
+    headers = {"Content-Type": "application/json"}
+    status, output = post(server, json.dumps({"code": "[[1], [22]]", "options": {"add_noqa": "E202"}}), headers)
+    assert status == 200
+    assert json.loads(output) == {"output": "[\n    [1 ],  # noqa: E202\n    [22],  # noqa: E202\n]"}
+
+    status, output = post(server, json.dumps({"code": "1"}), headers)
+    assert status == 400
+    assert "Expected a list" in json.loads(output)["error"]
+
+
+def test_client(server):
+    port = str(server.server_address[1])
+    command = ['table-formatd', '--client', '--port', port, '--quote-style', 'double']
+    output = subprocess.check_output(command, input=b'[["hi"]]')  # noqa:S603
+    assert output == b'''[
+    ["hi"],
+]'''
+
+    result = subprocess.run(['table-formatd', '--client', '--port', port], input=b'[', capture_output=True)  # noqa:S607
+    assert result.returncode == 1
+    assert result.stdout == b'['
+    assert b"Couldn't parse" in result.stderr
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""Differential tests checking that the tokenizer engine gives the same output as the libcst engine."""
+# fmt: off
+
+import random
+
+import pytest
+
+from table_format import Engine, QuoteStyle, reformat
+from table_format.tokens import Unsupported, tokenize_table
+
+# Inputs that the tokenizer engine handles itself
+SUPPORTED = [
+    "[[a, b, c], [defg, hi, jkl]]",
+    "[\n    [a, b],\n    [defg, hi],\n]",
+    "    [\n        [a, b],\n        [defg, hi],\n    ]",
+    "[  # Opening\n    [abc, defg],\n    [1, 2],\n]",
+    "[\n    # Leading\n    # More leading\n    [abc, defg],\n    # Middle\n\n    [1, 2],\n"
+    "    [3, 4]\n    # Trailing\n]",
+    "[\n    [abc, defg],  # Stuff\n    [1, 2]  # More stuff\n]",
+    "[\n    [abc, de],    # C1\n    [1, 2, 3],    # C2\n    [4, 5, 6, 7], # C3\n    []            # C4\n]",
+    "[\n    [abc, defg],\n    [1, 2],  # A comment\n    [34, 56],  # noqa: X111\n"
+    "    [7, 8]  # noqa:X111,X999 and more\n]",
+    "\n[\n\n    [], #   \n\n]    ",
+    "\n[\n\n    # c1\n    [],  # eol\n    # c2\n\n    #\n\n    # c3\n\n    # c4\n    [],\n    # c5\n\n]    ",
+    "[\n    (1, 2, 3),\n    ['a', 'b', 'c'],\n    (),\n    (4,),\n]",
+    "[\n    [(1, 2), (3, 4)],\n    [[1, 2], [3, 4]],\n]",
+    "[\n    [  function_call(\n       arg1,\n       arg2 ,\n       (tuple_1,),\n     ),\n"
+    "     a   +   b /2 or  3\n    ]]",
+    "[\n    [a +\n     b, c],\n]",
+    "[\n    [None, True, False, 0, -1, 1.5, -2.50, 1_000, 0x1F, 1e3, 3j, 1e1000],\n]",
+    "[\n    ['x', \"y\", 'it\"s', \"it's\", '', u'u', U'U', r'\\d', b'b', f'{x!r}', 'a' 'b', '\\n', 'é', '''t''']\n]",
+    "[\n    [x.y, f(x)[1], {'a': 1}, {1, 2}, lambda x: x, [i for i in y], not x, -x, ~x, x if y else z],\n]",
+    "[\n    [1, 2,],\n    [3, 4,],\n]",
+    "[\r\n    [1, 2],\r\n    [3, 4],\r\n]",
+]
+
+# Inputs that the tokenizer engine leaves to libcst
+UNSUPPORTED = [
+    "[]",
+    "[\n    # Only a comment\n]",
+    "[[1], [2]]  # trailing",
+    "[\n    [1,  # comment inside row\n     2],\n]",
+    "[\n    [1]\n    , [2]\n]",
+    "[[x for x in y]]",
+    "[*[1, 2]]",
+    "[[*a, b]]",
+    "[(1)]",
+    "[([1, 2])]",
+    "[[1][0]]",
+    "[{1, 2}]",
+    "[[1], 2]",
+    "[[1, , 2]]",
+    "[[1:2]]",
+    "[[if]]",
+    "[[1] [2]]",
+    "(1, 2)",
+    "1",
+    "[",
+    "[[1]",
+    "[[1]]]",
+]
+
+
+def assert_same_output(code, **options):
+    try:
+        expected = reformat(code, engine=Engine.LIBCST, **options)
+    except AssertionError:
+        with pytest.raises(AssertionError):
+            reformat(code, engine=Engine.FAST, **options)
+    else:
+        assert reformat(code, engine=Engine.FAST, **options) == expected
+
+
+@pytest.mark.parametrize("code", SUPPORTED)
+def test_supported(code):
+    tokenize_table(code)
+    assert_same_output(code)
+
+
+@pytest.mark.parametrize("code", UNSUPPORTED)
+def test_unsupported(code):
+    with pytest.raises(Unsupported):
+        tokenize_table(code)
+    assert_same_output(code)
+
+
+@pytest.mark.parametrize("code", SUPPORTED)
+@pytest.mark.parametrize("options", [
+    dict(align_commas=True),
+    dict(guess_indent=True),
+    dict(add_noqa=["E202", "E501"]),
+    dict(quote_style=QuoteStyle.DOUBLE),
+])
+def test_options(code, options):
+    assert_same_output(code, **options)
+
+
+def test_engine_names():
+    assert reformat("[[1]]", engine="fast") == reformat("[[1]]", engine="libcst")
+    with pytest.raises(ValueError):
+        reformat("[[1]]", engine="bogus")
+
+
+CELLS = [
+    "1", "-1", "0x1f", "1.50", "None", "True", "x", "a.b", "'s'", '"d"', '"x\'y"', "'é'", "'\\n'", "b'x'", "u'x'",
+    "f'{x}'", "foo(1, b=2)", "a + b * c", "(a + b) * c", "-x", "[1, 2]", "(1,)", "(1, 2)", "{'a': 1}", "lambda x: x",
+    "x[1:2]", "'a' 'b'", "...", "Decimal('1.0')", "(  a  )", "x  or  y", "f(\n  1,\n  2)",
+]
+
+GAPS = ["", " ", "  # comment", "\n", "\n\n", "  # comment\n", "\n    # own line\n", "\n\n    # after blank\n\n"]
+
+
+def random_table(rng):
+    parts = ["[", rng.choice(GAPS)]
+    for _ in range(rng.randint(1, 5)):
+        cells = [rng.choice(CELLS) for _ in range(rng.randint(0, 4))]
+        if rng.random() < 0.3:
+            row = "(" + ", ".join(cells) + ("," if len(cells) == 1 else "") + ")"
+        else:
+            row = "[" + ", ".join(cells) + ("," if cells and rng.random() < 0.2 else "") + "]"
+        parts.extend(["\n    ", row, ",", rng.choice(GAPS)])
+    if rng.random() < 0.5:
+        # No trailing comma
+        parts[-2] = ""
+        parts[-1] = rng.choice(GAPS) + "\n"
+    parts.append("\n]")
+    return "".join(parts)
+
+
+def test_random_tables():
+    rng = random.Random(12345)
+    for _ in range(300):
+        code = random_table(rng)
+        assert_same_output(code, quote_style=rng.choice(list(QuoteStyle)), align_commas=rng.random() < 0.5)
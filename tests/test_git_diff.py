@@ -0,0 +1,184 @@
+# fmt: off
+# Black tends to obfuscate these tests, turned off for whole file
+import subprocess
+
+import pytest
+
+from table_format import reformat_file
+from table_format.git_diff import LineRange, changed_lines, parse_diff
+
+SOURCE = """# fmt: off
+X = [
+    [1, 2],
+    [34, 5],
+]
+
+def f():
+    y = [
+        [1, 2],
+        [34, 5],
+    ]
+    return y[
+        0
+    ]
+"""
+
+X_FORMATTED = """X = [
+    [1,  2],
+    [34, 5],
+]"""
+
+Y_FORMATTED = """    y = [
+        [1,  2],
+        [34, 5],
+    ]"""
+
+
+@pytest.mark.parametrize("lines, x, y", [
+    ([], False, False),
+    ([(1, 1)], False, False),
+    ([(2, 2)], True, False),
+    ([(4, 6)], True, False),
+    ([(6, 7)], False, False),
+    ([(10, 10)], False, True),
+    ([(3, 3), (11, 20)], True, True),
+    ([(13, 14)], False, False),
+    # Deleted lines, between lines 3 and 4, 5 and 6, and 11 and 12
+    ([(4, 3)], True, False),
+    ([(6, 5)], False, False),
+    ([(12, 11)], False, False),
+])
+def test_reformat_file_lines(lines, x, y):
+    output = reformat_file(SOURCE, lines=lines)
+    assert (X_FORMATTED in output) == x
+    assert (Y_FORMATTED in output) == y
+
+
+def test_reformat_file_lines_parenthesized():
+    # The tokenizer can't tell whether libcst includes the parentheses, so it
+    # asks libcst.
+    source = "# fmt: off\nx = ([\n    [1, 2],\n    [34, 5],\n])\n"
+    assert reformat_file(source, lines=[(3, 3)]) == reformat_file(source)
+
+
+def test_reformat_file_lines_newlines():
+    output = reformat_file(SOURCE.replace("\n", "\r\n"), lines=[(3, 3)])
+    assert output.replace("\r\n", "\n") == SOURCE.replace(X_FORMATTED.replace("1,  2", "1, 2"), X_FORMATTED)
+    assert output.count("\r\n") == SOURCE.count("\n")
+
+
+@pytest.mark.parametrize("before", ["x = 1  # \x0c\n", "s = '\u2028'\n"])
+def test_reformat_file_lines_other_line_breaks(before):
+    # Only \n counts as a line break for git, like for Python apart from \r.
+    output = reformat_file(before + SOURCE, lines=[(4, 4)])
+    assert output == before + SOURCE.replace(X_FORMATTED.replace("1,  2", "1, 2"), X_FORMATTED)
+
+
+def test_reformat_file_lines_bad_syntax():
+    # Like without `lines`, even though the error isn't in a table.
+    with pytest.raises(AssertionError):
+        reformat_file("x = 1 +* 2\n" + SOURCE, lines=[(1, 100)])
+
+
+def test_parse_diff():
+    diff = """diff --git a/a.py b/a.py
+index 1111111..2222222 100644
+--- a/a.py
++++ b/a.py
+@@ -3 +3 @@ X = [
+-    [1, 2],
++++ b/other.py
+@@ -10,2 +9,0 @@ def f():
+-    pass
+-    pass
+@@ -20,0 +20,3 @@ def g():
++    a
++    b
++    c
+diff --git a/old.py b/old.py
+deleted file mode 100644
+--- a/old.py
++++ /dev/null
+@@ -1 +0,0 @@
+-x = 1
+diff --git "a/sp\\303\\251cial.py" "b/sp\\303\\251cial.py"
+--- "a/sp\\303\\251cial.py"
++++ "b/sp\\303\\251cial.py"
+@@ -1 +1 @@
+-x = 1
++x = 2
+"""
+    # Added lines can look like headers, e.g. "++ b/other.py" above.
+    assert parse_diff(diff, "/repo") == {
+        "/repo/a.py": [LineRange(3, 3), LineRange(10, 9), LineRange(20, 22)],
+        "/repo/spécial.py": [LineRange(1, 1)],
+    }
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for args in [
+        ["init", "-q"],
+        ["config", "user.email", "test@example.com"],
+        ["config", "user.name", "Test"],
+    ]:
+        subprocess.run(["git"] + args, check=True)  # noqa:S607
+    (tmp_path / "a.py").write_text(SOURCE)
+    (tmp_path / "b.py").write_text(SOURCE)
+    subprocess.run(["git", "add", "."], check=True)  # noqa:S607
+    subprocess.run(["git", "commit", "-q", "-m", "Initial"], check=True)  # noqa:S607
+    return tmp_path
+
+
+def test_changed_lines(repo):
+    (repo / "a.py").write_text(SOURCE.replace("[34, 5],\n    ]", "[34, 6],\n    ]"))
+    (repo / "new.py").write_text("x = 1\n")
+    assert changed_lines(["."]) == {
+        str(repo / "a.py"): [LineRange(10, 10)],
+        str(repo / "new.py"): [LineRange(1, 2**62)],
+    }
+    subprocess.run(["git", "commit", "-q", "-am", "Change"], check=True)  # noqa:S607
+    assert changed_lines(["."]) == {str(repo / "new.py"): [LineRange(1, 2**62)]}
+    assert changed_lines(["."], since="HEAD~1") == {
+        str(repo / "a.py"): [LineRange(10, 10)],
+        str(repo / "new.py"): [LineRange(1, 2**62)],
+    }
+    assert changed_lines(["b.py"], since="HEAD~1") == {}
+
+
+def test_cli_changed_only_symlink(repo, tmp_path_factory):
+    # Files found through a symlink are the same files that git reports.
+    link = tmp_path_factory.mktemp("links") / "repo"
+    link.symlink_to(repo)
+    (repo / "a.py").write_text(SOURCE.replace("[34, 5],\n    ]", "[34, 6],\n    ]"))
+    result = subprocess.run(["table-format", "--changed-only", "--check", "--no-cache", str(link / "a.py")],  # noqa:S607
+                            capture_output=True)
+    assert result.returncode == 1
+    assert f"would reformat {link / 'a.py'}".encode() in result.stderr
+
+
+def test_changed_lines_not_a_repo(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("GIT_CEILING_DIRECTORIES", str(tmp_path.parent))
+    with pytest.raises(AssertionError, match="git failed"):
+        changed_lines(["."])
+
+
+def test_cli_changed_only(repo):
+    (repo / "a.py").write_text(SOURCE.replace("[34, 5],\n    ]", "[34, 6],\n    ]"))
+    result = subprocess.run(["table-format", "--changed-only", "--no-cache"], capture_output=True)  # noqa:S607
+    assert result.returncode == 0
+    assert result.stderr.decode().splitlines()[-1] == (
+        "1 file reformatted (134 bytes written), 0 files left unchanged, 0 files failed to reformat."
+    )
+    output = (repo / "a.py").read_text()
+    assert Y_FORMATTED.replace("[34, 5]", "[34, 6]") in output
+    assert X_FORMATTED not in output
+    assert (repo / "b.py").read_text() == SOURCE
+
+    subprocess.run(["git", "commit", "-q", "-am", "Change"], check=True)  # noqa:S607
+    result = subprocess.run(["table-format", "--since", "HEAD~1", "--check", "--no-cache"],  # noqa:S607
+                            capture_output=True)
+    assert result.returncode == 0
+    assert b"1 file would be left unchanged" in result.stderr
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for :mod:`table_format.lsp`."""
+# fmt: off
+
+import io
+import json
+import subprocess
+from collections import deque
+
+import pytest
+
+from table_format.lsp import (
+    CONTENT_MODIFIED,
+    REQUEST_CANCELLED,
+    SERVER_CANCELLED,
+    Document,
+    LanguageServer,
+    ProtocolError,
+    minimal_edits,
+    read_message,
+    write_message,
+)
+
+URI = "file:///test.py"
+SOURCE = """def test():
+    assert x == [
+        [1, 2],
+        [34, 5],
+    ]
+"""
+
+
+def request(request_id, method, params):
+    return {"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}
+
+
+def notification(method, params):
+    return {"jsonrpc": "2.0", "method": method, "params": params}
+
+
+def did_open(text=SOURCE):
+    return notification("textDocument/didOpen", {
+        "textDocument": {"uri": URI, "languageId": "python", "version": 1, "text": text},
+    })
+
+
+def range_formatting(request_id, start, end):
+    return request(request_id, "textDocument/rangeFormatting", {
+        "textDocument": {"uri": URI},
+        "range": {"start": {"line": start[0], "character": start[1]}, "end": {"line": end[0], "character": end[1]}},
+        "options": {"tabSize": 4, "insertSpaces": True},
+    })
+
+
+def run(messages, initialization_options=None, capabilities=None):
+    responses = []
+    server = LanguageServer(responses.append)
+    pending = deque([
+        request(0, "initialize", {"capabilities": capabilities or {},
+                                  "initializationOptions": initialization_options or {}}),
+        notification("initialized", {}),
+    ] + messages)
+    while pending:
+        server.process(pending)
+    assert "result" in responses[0]
+    return {response["id"]: response for response in responses[1:]}
+
+
+def apply_edits(text, edits):
+    document = Document(text)
+    for edit in reversed(edits):
+        document.apply_change({"range": edit["range"], "text": edit["newText"]}, "utf-16")
+    return document.text
+
+
+def test_range_formatting():
+    responses = run([did_open(), range_formatting(1, (1, 16), (5, 0))], {"guess_indent": True})
+    edits = responses[1]["result"]
+    # Only the spaces that are needed are inserted.
+    assert edits == [{"range": {"start": {"line": 2, "character": 12}, "end": {"line": 2, "character": 12}},
+                      "newText": " "}]
+    assert apply_edits(SOURCE, edits) == SOURCE.replace("[1, 2]", "[1,  2]")
+
+
+def test_range_formatting_newlines():
+    text = SOURCE.replace("\n", "\r\n")
+    responses = run([did_open(text), range_formatting(1, (1, 16), (5, 0))], {"align_commas": True})
+    assert apply_edits(text, responses[1]["result"]) == text.replace("[1, 2]", "[1 , 2]").replace(
+        "        [", "    [").replace("    ]", "]")
+
+
+def test_range_formatting_formatted():
+    text = SOURCE.replace("[1, 2]", "[1,  2]")
+    responses = run([did_open(text), range_formatting(1, (1, 16), (5, 0))], {"guess_indent": True})
+    assert responses[1]["result"] == []
+
+
+def test_range_formatting_error():
+    responses = run([did_open(), range_formatting(1, (0, 0), (1, 0))])
+    assert "Couldn't parse" in responses[1]["error"]["message"]
+
+
+def test_range_formatting_utf16():
+    # Positions count UTF-16 code units by default, so the emoji counts as two.
+    text = "x = [  # 😀\n    [é, 1],\n    [aa, 22],\n]\n"
+    change = notification("textDocument/didChange", {
+        "textDocument": {"uri": URI, "version": 2},
+        "contentChanges": [{"range": {"start": {"line": 0, "character": 11}, "end": {"line": 0, "character": 11}},
+                            "text": " ok"}],
+    })
+    responses = run([did_open(text), change, range_formatting(1, (0, 4), (4, 0))])
+    edited = text.replace("😀", "😀 ok")
+    assert apply_edits(edited, responses[1]["result"]) == "x = [  # 😀 ok\n    [é,  1 ],\n    [aa, 22],\n]\n"
+
+
+@pytest.mark.parametrize("encoding", ["utf-16", "utf-32"])
+def test_document_positions(encoding):
+    document = Document("a😀b\r\nc\n")
+    for offset, character in [(0, 0), (1, 1), (2, 3 if encoding == "utf-16" else 2)]:
+        position = {"line": 0, "character": character}
+        assert document.position(offset, encoding) == position
+        assert document.offset(position, encoding) == offset
+    assert document.position(5, encoding) == {"line": 1, "character": 0}
+    # Past the end of a line, or of the document
+    assert document.offset({"line": 0, "character": 99}, encoding) == 3
+    assert document.offset({"line": 9, "character": 0}, encoding) == 7
+
+
+def test_stale_requests():
+    change = notification("textDocument/didChange", {
+        "textDocument": {"uri": URI, "version": 2}, "contentChanges": [{"text": SOURCE}],
+    })
+    responses = run([
+        did_open(),
+        range_formatting(1, (1, 16), (5, 0)),
+        change,
+        range_formatting(2, (1, 16), (5, 0)),
+        range_formatting(3, (1, 16), (5, 0)),
+        notification("$/cancelRequest", {"id": 4}),
+        range_formatting(4, (1, 16), (5, 0)),
+        range_formatting(5, (1, 16), (5, 0)),
+    ])
+    assert responses[1]["error"]["code"] == CONTENT_MODIFIED
+    assert responses[2]["error"]["code"] == SERVER_CANCELLED
+    assert responses[3]["error"]["code"] == SERVER_CANCELLED
+    assert responses[4]["error"]["code"] == REQUEST_CANCELLED
+    assert "result" in responses[5]
+
+
+def test_cancelled_forgotten():
+    server = LanguageServer(lambda response: None)
+    pending = deque([
+        request(0, "initialize", {}),
+        request(1, "shutdown", None),
+        notification("$/cancelRequest", {"id": 1}),
+        notification("$/cancelRequest", {"id": 2}),
+    ])
+    while pending:
+        server.process(pending)
+    # Answered or unknown requests can't be cancelled.
+    assert server.cancelled == server.unanswered == set()
+
+
+def test_minimal_edits():
+    assert minimal_edits("a\nb\nc\n", "a\nb\nc\n") == []
+    assert minimal_edits("a\nbb\nc\n", "a\nb  b\nc\n") == [(3, 3, "  ")]
+    assert minimal_edits("a\nc\n", "a\nb\nc\n") == [(2, 2, "b\n")]
+
+
+def test_read_write_message():
+    stream = io.BytesIO()
+    write_message(stream, {"id": 1, "result": "é"})
+    stream.seek(0)
+    assert read_message(stream) == {"id": 1, "result": "é"}
+    assert read_message(stream) is None
+
+
+@pytest.mark.parametrize("header", [b"Content-Length: x", b"Content-Length: -1", b"Content-Length: \xff"])
+def test_read_message_bad_length(header):
+    with pytest.raises(ProtocolError):
+        read_message(io.BytesIO(header + b"\r\n\r\n{}"))
+
+
+def test_cli_lsp():
+    messages = [
+        request(1, "initialize", {"capabilities": {}}),
+        did_open(),
+        range_formatting(2, (1, 16), (5, 0)),
+        request(3, "shutdown", None),
+        notification("exit", None),
+    ]
+    stdin = io.BytesIO()
+    for message in messages:
+        write_message(stdin, message)
+    result = subprocess.run(['table-format', '--lsp', '--guess-indent'],  # noqa:S607
+                            input=stdin.getvalue(), capture_output=True)
+    assert result.returncode == 0
+    stdout = io.BytesIO(result.stdout)
+    responses = []
+    while True:
+        response = read_message(stdout)
+        if response is None:
+            break
+        responses.append(response)
+    assert [response["id"] for response in responses] == [1, 2, 3]
+    assert responses[0]["result"]["capabilities"]["documentRangeFormattingProvider"] is True
+    assert apply_edits(SOURCE, responses[1]["result"]) == SOURCE.replace("[1, 2]", "[1,  2]")
+    assert json.dumps(responses[2]) == '{"jsonrpc": "2.0", "id": 3, "result": null}'
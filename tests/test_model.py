@@ -0,0 +1,113 @@
+# fmt: off
+# Black tends to obfuscate these tests, turned off for whole file
+import random
+
+import pytest
+
+from table_format import QuoteStyle, column_widths, parse_table, reformat
+
+TABLE = """[  # Opening
+    # Before
+    [1, "a"],  # One
+    *[foo(x), 2],
+    (3, 4, 5),
+    # After
+]"""
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"align_commas": True},
+    {"add_noqa": ["E202", "E501"]},
+    {"quote_style": QuoteStyle.DOUBLE},
+])
+def test_render_matches_reformat(options):
+    model = parse_table(TABLE)
+    assert model.render(**options) == reformat(TABLE, **options)
+
+
+def test_render_indents():
+    code = """  [
+        [1, 2],
+    ]"""
+    model = parse_table(code, engine="fast")
+    assert model.render() == reformat(code)
+    assert model.render(guess_indent=True) == reformat(code, guess_indent=True)
+
+
+def test_render_many_times():
+    model = parse_table(TABLE)
+    first = model.render()
+    assert model.render(align_commas=True) == reformat(TABLE, align_commas=True)
+    assert model.render(quote_style="double") == reformat(TABLE, quote_style="double")
+    assert model.render(quote_style="single") == first
+
+
+def test_replace_row():
+    model = parse_table(TABLE)
+    model.replace_row(1, "[foobar(x, y), 2]")
+    assert model.render() == reformat(TABLE.replace("*[foo(x), 2]", "[foobar(x, y), 2]"))
+    assert model.col_widths == [12, 3, 1]
+
+
+def test_insert_row():
+    model = parse_table(TABLE)
+    model.insert_row(0, "(10, 20, 30, 40)", comment="# New")
+    assert model.render() == """[  # Opening
+    # Before
+    (10,     20,  30, 40),  # New
+    [1,      'a'],          # One
+    [foo(x), 2  ],
+    (3,      4,   5 ),
+    # After
+]"""
+
+
+def test_delete_row():
+    model = parse_table(TABLE)
+    model.delete_row(1)
+    model.delete_row(1)
+    assert len(model) == 1
+    assert model.col_widths == [1, 3]
+    assert model.render() == """[  # Opening
+    # Before
+    [1, 'a'],  # One
+    # After
+]"""
+
+
+def test_edited_rows_and_quote_style():
+    model = parse_table(TABLE)
+    model.replace_row(0, "['x', 'y']")
+    assert model.render(quote_style="double") == reformat(TABLE.replace('[1, "a"]', "['x', 'y']"), quote_style="double")
+
+
+@pytest.mark.parametrize("row_code", ["x", "1, 2", "(1)", "[1, 2", "[x for x in y]"])
+def test_bad_row(row_code):
+    model = parse_table(TABLE)
+    with pytest.raises(AssertionError):
+        model.replace_row(0, row_code)
+    assert model.render() == reformat(TABLE)
+
+
+def test_widths_kept_up_to_date():
+    rng = random.Random(0)
+    cells = ["1", "22", "333", "f(x)", "'text'", "None"]
+    model = parse_table("[\n    [1],\n]")
+    rows = [["1"]]
+    for _ in range(500):
+        row = [rng.choice(cells) for _ in range(rng.randrange(1, 5))]
+        action = rng.choice(["insert", "replace", "delete"]) if rows else "insert"
+        index = rng.randrange(len(rows) + (action == "insert"))
+        if action == "insert":
+            model.insert_row(index, f"[{', '.join(row)}]")
+            rows.insert(index, row)
+        elif action == "replace":
+            model.replace_row(index, f"[{', '.join(row)}]")
+            rows[index] = row
+        else:
+            model.delete_row(index)
+            del rows[index]
+        assert model.col_widths == column_widths(model.rows)
+    expected = "[\n" + "".join(f"    [{', '.join(row)}],\n" for row in rows) + "]"
+    assert model.render() == reformat(expected)
@@ -1,8 +1,26 @@
 # fmt: off
 # Black tends to obfuscate these tests, turned off for whole file
+import ast
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
-from table_format import QuoteStyle, reformat, reformat_as_single_line
+from table_format import (
+    DEFAULT_CELL_CACHE_SIZE,
+    BudgetExceeded,
+    CellCache,
+    NoqaMarkers,
+    QuoteStyle,
+    ReformatStats,
+    TableFormatter,
+    cell_cache,
+    fast_render_cell,
+    reformat,
+    reformat_as_single_line,
+    reformat_ast_as_single_line,
+    reformat_file,
+)
 
 
 def test_reformat_empty():
@@ -133,6 +151,18 @@ def test_align_end_of_line_comments_with_ragged_rows_and_align_commas():
 ]"""
 
 
+def test_align_end_of_line_comments_with_ragged_rows_and_add_noqa():
+    assert reformat("""[
+    [abc, de],
+    [1, 2, 3],  # noqa:E501 C2
+    [4, 5, 6, 7],
+]""", add_noqa=["E202"]) == """[
+    [abc, de],        # noqa: E202
+    [1,   2,  3],     # noqa: E202,E501  C2
+    [4,   5,  6, 7],  # noqa: E202
+]"""
+
+
 def test_preserve_comments_with_guess_indent():
     assert reformat("""[
     # Leading stuff
@@ -167,6 +197,23 @@ def test_whitespace_in_item():
 ]"""
 
 
+def test_line_break_in_item():
+    assert reformat("""[
+    [a +
+     b, c],
+]""") == """[
+    [a + b, c],
+]"""
+
+
+def test_starred_item():
+    assert reformat("""[
+    [*a, b],
+]""") == """[
+    [*a, b],
+]"""
+
+
 # This would be nice, but hard.
 # def test_preserve_quotes():
 #     assert reformat("""[[""]]""") == """[\n    [""],\n]"""
@@ -187,6 +234,16 @@ def test_add_noqa():
 ]"""
 
 
+def test_preserve_comment_after_opening_bracket():
+    assert reformat("""[  # Opening
+    [abc, defg],
+    [1, 2],
+]""") == """[  # Opening
+    [abc, defg],
+    [1,   2   ],
+]"""
+
+
 def test_whitespace_lines_and_comments():
     assert reformat("""
 [
@@ -342,3 +399,303 @@ def test_reformat_as_single_line_prefer_double_quotes():
     """, quote_style=QuoteStyle.DOUBLE) == """
     f"{'x'}"
     """.strip()
+
+
+def test_reformat_file():
+    assert reformat_file("""
+x = [
+    [1, 2],
+    [345, 6],
+]
+
+# fmt: off
+def test_foo():
+    assert foo() == [
+        [1, 2],  # Comment
+        [345, "6"],
+    ]
+    assert bar() == [[1, 2], [3, 4]]  # Single line, not a table
+    assert baz() == [
+        [a, b],
+        [c,  # Comment inside row, would be lost
+         d],
+    ]
+# fmt: on
+
+y = [
+    [1, 2],
+    [345, 6],
+]
+""") == """
+x = [
+    [1, 2],
+    [345, 6],
+]
+
+# fmt: off
+def test_foo():
+    assert foo() == [
+        [1,   2  ],  # Comment
+        [345, '6'],
+    ]
+    assert bar() == [[1, 2], [3, 4]]  # Single line, not a table
+    assert baz() == [
+        [a, b],
+        [c,  # Comment inside row, would be lost
+         d],
+    ]
+# fmt: on
+
+y = [
+    [1, 2],
+    [345, 6],
+]
+"""
+
+
+def test_reformat_file_options():
+    assert reformat_file("""# fmt: off
+x = [
+    [1, 'a'],
+    [234, 'bc'],
+]
+""", align_commas=True, add_noqa=["E202"], quote_style=QuoteStyle.DOUBLE) == """# fmt: off
+x = [
+    [1  , "a" ],  # noqa: E202
+    [234, "bc"],  # noqa: E202
+]
+"""
+
+
+@pytest.mark.parametrize("before", ["x = 1  # \x0c\n", "\x0c\n", "s = '\u2028'\n", "s = '\x85\\\n'\n"])
+def test_reformat_file_other_line_breaks(before):
+    # Only \r\n, \r and \n count as line breaks in Python.
+    source = "# fmt: off\nx = [\n    [1,2],\n    [333, 4],\n]\n"
+    assert reformat_file(before + source) == before + source.replace("[1,2]", "[1,   2]")
+
+
+def test_reformat_file_shares_noqa_markers(monkeypatch):
+    markers = []
+    monkeypatch.setattr("table_format.api.NoqaMarkers", lambda items: markers.append(NoqaMarkers(items)) or markers[-1])
+    table = "[\n    [1, 'a'],\n    [234, 'bc'],\n]\n"
+    output = reformat_file("# fmt: off\nx = " + table + "y = " + table, add_noqa=["E202"])
+    assert output.count("# noqa: E202") == 4
+    assert len(markers) == 1
+
+
+def test_reformat_file_bad_syntax():
+    with pytest.raises(AssertionError):
+        reformat_file("x = [")
+
+
+def test_cell_cache():
+    cell_cache.clear()
+    table = """[
+    [f(x), 'x', a+b],
+    [f(x), "x", a+b],
+    [f(x), 'x', a-b],
+]"""
+    expected = """[
+    [f(x), 'x', a + b],
+    [f(x), 'x', a + b],
+    [f(x), 'x', a - b],
+]"""
+    assert reformat(table) == expected
+    # Simple values like strings don't need the cache at all.
+    info = cell_cache.info()
+    assert (info.hits, info.misses, info.currsize) == (3, 3, 3)
+
+    # Quote style is part of the key
+    assert reformat(table, quote_style=QuoteStyle.DOUBLE) == expected.replace("'", '"')
+    assert cell_cache.info().misses == 6
+
+    cell_cache.clear()
+    assert cell_cache.info() == (0, 0, cell_cache.maxsize, 0)
+
+
+def test_cell_cache_eviction():
+    cache = CellCache(maxsize=2)
+    assert cache.get_or_render("a", lambda: "A") == "A"
+    assert cache.get_or_render("b", lambda: "B") == "B"
+    assert cache.get_or_render("a", lambda: "X") == "A"
+    assert cache.get_or_render("c", lambda: "C") == "C"  # evicts least recently used, "b"
+    assert cache.get_or_render("b", lambda: "B2") == "B2"
+    assert cache.info() == (1, 4, 2, 2)
+
+    cache.resize(0)
+    assert cache.get_or_render("a", lambda: "A2") == "A2"
+    assert cache.info().currsize == 0
+
+
+def test_cell_cache_threads():
+    cache = CellCache(maxsize=10)
+
+    def render_many(n):
+        return [cache.get_or_render(i % 20, lambda: str(i % 20)) for i in range(n, n + 1000)]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(render_many, range(16)))
+    for n, result in enumerate(results):
+        assert result == [str(i % 20) for i in range(n, n + 1000)]
+    info = cache.info()
+    assert info.hits + info.misses == 16000
+    assert info.currsize == 10
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"align_commas": True, "quote_style": "double"},
+    {"add_noqa": ["E501", "E202", "E501"], "engine": "fast"},
+    {"guess_indent": True, "add_noqa": ["E202"]},
+])
+def test_table_formatter(options):
+    formatter = TableFormatter(**options)
+    codes = [
+        """  [
+      [1, "a"],  # noqa: X111 Comment
+      [234, f( x )],  # Comment
+  ]""",
+        "[[1, 2], [34, 5]]  ",
+        "[[a, 'b'], [f(x), g(y)]]  # noqa:E501",
+        "",
+    ]
+    for _ in range(2):
+        for code in codes:
+            assert formatter.format(code) == reformat(code, **options)
+
+
+def test_table_formatter_options():
+    formatter = TableFormatter(add_noqa=["E501", "E202", "E501"], quote_style="double", engine="fast")
+    assert formatter.add_noqa == ["E202", "E501"]
+    assert formatter.quote_style == QuoteStyle.DOUBLE
+    with pytest.raises(ValueError):
+        TableFormatter(quote_style="fancy")
+    with pytest.raises(ValueError):
+        TableFormatter(engine="slow")
+
+
+def test_decompiler_threads():
+    # Each thread has its own decompilers, so they don't get mixed up.
+    cell_cache.resize(0)
+    try:
+        def render_many(n):
+            quote_style = [QuoteStyle.SINGLE, QuoteStyle.DOUBLE][n % 2]
+            return [reformat_as_single_line(f"f('a', {i})", quote_style=quote_style) for i in range(300)]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(render_many, range(8)))
+    finally:
+        cell_cache.resize(DEFAULT_CELL_CACHE_SIZE)
+    for n, result in enumerate(results):
+        quote = ["'", '"'][n % 2]
+        assert result == [f"f({quote}a{quote}, {i})" for i in range(300)]
+
+
+@pytest.mark.parametrize("engine", ["libcst", "fast"])
+def test_reformat_stats(engine):
+    cell_cache.clear()
+    stats = ReformatStats()
+    reformat("""[
+    [1, f(x), 'a'],
+    [None, f(x)],  # Comment
+]""", engine=engine, stats=stats)
+    reformat("[[f(x), g(y)]]", engine=engine, stats=stats)
+    assert (stats.tables, stats.rows, stats.cells) == (2, 3, 7)
+    assert (stats.direct_cells, stats.cached_cells, stats.decompiled_cells) == (3, 2, 2)
+    assert stats.engine_fallbacks == 0
+    assert "layout" in stats.durations
+    assert "tables: 2, rows: 3, cells: 7" in stats.report()
+
+
+def test_reformat_stats_engine_fallback():
+    cell_cache.clear()
+    stats = ReformatStats()
+    reformat("[[a, f(x)], [b, *c]]", engine="fast", stats=stats)
+    assert stats.engine_fallbacks == 1
+    assert list(stats.durations) == ["tokenize", "parse", "render", "comments", "layout"]
+    # Cells are only counted once, even though the fast engine started on them.
+    assert (stats.cells, stats.direct_cells, stats.cached_cells, stats.decompiled_cells) == (4, 2, 0, 2)
+
+
+def test_reformat_file_stats():
+    stats = ReformatStats()
+    reformat_file("# fmt: off\nx = [\n    [1, 2],\n]\ny = [\n    [3],\n    [4],\n]\n", stats=stats)
+    assert (stats.tables, stats.rows, stats.cells) == (2, 3, 4)
+    assert list(stats.durations) == ["parse", "find tables", "render", "comments", "layout"]
+
+
+@pytest.mark.parametrize("code", [
+    "x", "None", "True", "False", "0", "123", "1_000", "0x1F", "-4", "-4.5", "1.50", "1e3",
+    "''", "'x'", '"x"', "'x\"y'", '"x\'y"', "'\\n'", "'\\\\'", "'é'", "u'x'", "b'x\\x00'",
+])
+@pytest.mark.parametrize("quote_style", list(QuoteStyle))
+def test_fast_render_cell_matches_decompiler(code, quote_style):
+    node = ast.parse(code, mode="eval").body
+    rendered = fast_render_cell(node, quote_style)
+    assert rendered is not None
+    assert rendered == reformat_ast_as_single_line(node, quote_style)
+
+
+@pytest.mark.parametrize("code", ["f(x)", "a + b", "-x", "3j", "1e1000", "...", "f'{x}'", "(1, 2)"])
+def test_fast_render_cell_not_simple(code):
+    assert fast_render_cell(ast.parse(code, mode="eval").body, QuoteStyle.SINGLE) is None
+
+
+def test_reformat_big_table_memory():
+    # Peak memory should stay a small multiple of the output size, rather than
+    # growing with the number of tokens or output fragments.
+    code = "[\n" + "".join(
+        f"    [{i % 7}, name_{i % 13}, 'text {i % 5}', f(x, {i % 3})],  # row {i % 2}\n" for i in range(1000)
+    ) + "]"
+    reformat(code, engine="fast")  # Fill the cell cache
+    tracemalloc.start()
+    try:
+        output = reformat(code, engine="fast")
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert output.count("\n") == 1001
+    assert peak < 20 * len(output)
+
+
+@pytest.mark.parametrize("engine", ["libcst", "fast"])
+def test_reformat_workers(engine, monkeypatch):
+    # Use the worker processes even for small tables.
+    monkeypatch.setattr("table_format.api.PARALLEL_RENDER_MIN_CELLS", 0)
+    cell_cache.clear()
+    code = "[\n" + "".join(
+        f"    [{i}, f(x, {i % 50}), 'a', g(y)[{i % 7}]],  # row {i}\n" for i in range(200)
+    ) + "    [*rest, h(z)],\n]"
+    stats = ReformatStats()
+    output = reformat(code, engine=engine, workers=2, stats=stats)
+    assert stats.decompiled_cells == 59
+    cell_cache.clear()
+    assert output == reformat(code, engine=engine)
+
+
+def test_reformat_workers_invalid():
+    with pytest.raises(ValueError, match="workers must be at least 1"):
+        reformat("[[1]]", workers=0)
+
+
+@pytest.mark.parametrize("engine", ["libcst", "fast"])
+def test_reformat_max_cells(engine):
+    code = "[\n    [1, f(x)],\n    [2, g(y)],\n]"
+    assert reformat(code, engine=engine, max_cells=4) == reformat(code, engine=engine)
+    with pytest.raises(BudgetExceeded, match="more than 3 cells"):
+        reformat(code, engine=engine, max_cells=3)
+
+
+@pytest.mark.parametrize("engine", ["libcst", "fast"])
+def test_reformat_timeout(engine):
+    code = "[\n" + "".join(f"    [{i}, f(x, {i})],\n" for i in range(2000)) + "]"
+    with pytest.raises(BudgetExceeded, match="took more than 0.001 ms"):
+        reformat(code, engine=engine, timeout_ms=0.001)
+    assert reformat(code, engine=engine, timeout_ms=60000) == reformat(code, engine=engine)
+
+
+def test_reformat_budget_invalid():
+    with pytest.raises(ValueError, match="timeout_ms must be positive"):
+        reformat("[[1]]", timeout_ms=0)
+    with pytest.raises(ValueError, match="max_cells can't be negative"):
+        reformat("[[1]]", max_cells=-1)
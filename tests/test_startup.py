@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+"""Tests that :mod:`table_format` starts quickly, importing slow dependencies only when needed."""
+
+import subprocess
+import sys
+
+# Importing libcst etc. takes several hundred milliseconds, the CLI itself
+# should take a small fraction of that.
+IMPORT_TIME_BUDGET_MS = 100
+
+SLOW_MODULES = ["libcst", "parsy", "ast_decompiler"]
+
+
+def imported_slow_modules(code, input=b''):
+    report = f"print('\\n', sorted({{m.split('.')[0] for m in sys.modules}} & {set(SLOW_MODULES)!r}))"
+    check = f"import sys\n{code}\n{report}"
+    output = subprocess.check_output([sys.executable, '-c', check], input=input)  # noqa:S603
+    return output.decode().splitlines()[-1].strip()
+
+
+def test_import_is_lazy():
+    assert imported_slow_modules("import table_format; table_format.QuoteStyle") == "[]"
+    assert imported_slow_modules("import table_format.cli, table_format.daemon") == "[]"
+
+
+def test_public_names():
+    import table_format
+
+    # dir() doesn't import anything, star imports do.
+    assert imported_slow_modules("import table_format; dir(table_format)") == "[]"
+    assert {"reformat", "reformat_file", "is_formatted"} <= set(dir(table_format))
+    namespace = {}
+    exec("from table_format import *", namespace)  # noqa:S102
+    assert set(table_format.__all__) <= set(namespace)
+    assert namespace["reformat_as_single_line"] is table_format.api.reformat_as_single_line
+
+
+def test_empty_input_is_lazy():
+    code = "from table_format.cli import main; main()"
+    assert imported_slow_modules(code, input=b'  \n') == "[]"
+    assert imported_slow_modules(code, input=b'[]') == str(sorted(SLOW_MODULES))
+
+
+def test_help_is_lazy():
+    code = "\n".join([
+        "sys.argv[1:] = ['--help']",
+        "try:",
+        "    from table_format.cli import main",
+        "    main()",
+        "except SystemExit:",
+        "    pass",
+    ])
+    assert imported_slow_modules(code) == "[]"
+
+
+def test_import_time_budget():
+    # Best of a few runs, to avoid flakiness on busy machines
+    timings = []
+    for _ in range(3):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import table_format.cli'],  # noqa:S603
+                                capture_output=True, check=True)
+        for line in result.stderr.decode().splitlines():
+            # Lines look like "import time:  self [us] | cumulative | imported package"
+            parts = line.split("|")
+            if parts[-1].strip() == "table_format.cli":
+                timings.append(int(parts[1]) / 1000)
+    assert min(timings) < IMPORT_TIME_BUDGET_MS
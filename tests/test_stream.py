@@ -0,0 +1,76 @@
+# fmt: off
+# Black tends to obfuscate these tests, turned off for whole file
+import io
+import tracemalloc
+
+import pytest
+
+from table_format import reformat
+from table_format.api import DEFAULT_CELL_CACHE_SIZE, cell_cache
+from table_format.stream import iter_reformat
+
+
+def stream_reformat(code, **options):
+    return "".join(iter_reformat(io.StringIO(code), **options))
+
+
+@pytest.mark.parametrize("code", [
+    "[[1, 2], [34, 5]]",
+    "  [  # Opening\n  # Initial\n\n   [1, 'a'],  # End of row\n   # After row\n\n   (2,),\n\n   # Final\n  ]\n",
+    "\n\n  [\n    [1, 2, 3],\n    [4],  # Ragged\n    [5, 6],\n  ]\n\n  \n",
+    "[\n  # Comment line, ignored when guessing the indent\n"
+    "        [1, f(x, y)],\n        [-1.5, {'a': (1, 2)}],\n    ]",
+    "[\n\n        [1, '''a\nb'''],\n ]",
+    "[[1, 2],\n    [3, 4]]  ",
+])
+@pytest.mark.parametrize("options", [
+    {},
+    {"guess_indent": True},
+    {"align_commas": True, "add_noqa": ["E501", "E202"], "quote_style": "double"},
+])
+def test_iter_reformat(code, options):
+    assert stream_reformat(code, **options) == reformat(code, **options)
+
+
+@pytest.mark.parametrize("code", [
+    "",
+    "   ",
+    "[]",
+    "[[1, 2],  # Comment\n [3, 4]]",
+])
+def test_iter_reformat_fallback(code):
+    # Things that the tokenizer doesn't handle are passed to `reformat`.
+    assert stream_reformat(code) == reformat(code)
+
+
+def test_iter_reformat_error():
+    pieces = iter_reformat(io.StringIO("[[1], x"))
+    with pytest.raises(AssertionError, match="Couldn't parse"):
+        next(pieces)
+
+
+def test_iter_reformat_from_position():
+    f = io.StringIO("ignored\n[[1, 2], [34, 5]]")
+    f.readline()
+    assert "".join(iter_reformat(f)) == reformat("[[1, 2], [34, 5]]")
+
+
+def test_iter_reformat_memory():
+    def peak_memory(rows):
+        code = "[\n" + "".join(f"    [{row}, 'cell {row}', {row * 1.5}],\n" for row in range(rows)) + "]\n"
+        f = io.StringIO(code)
+        tracemalloc.start()
+        try:
+            for _ in iter_reformat(f):
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    # Memory use doesn't grow with the number of rows. The cell cache is
+    # bounded too, but by more than these tables would fill.
+    cell_cache.resize(0)
+    try:
+        assert peak_memory(4000) < peak_memory(400) * 1.5
+    finally:
+        cell_cache.resize(DEFAULT_CELL_CACHE_SIZE)
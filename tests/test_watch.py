@@ -0,0 +1,104 @@
+# fmt: off
+# Black tends to obfuscate these tests, turned off for whole file
+import os
+
+import pytest
+
+from table_format.git_diff import LineRange
+from table_format.runner import DEFAULT_EXCLUDES, DEFAULT_INCLUDES, is_included
+from table_format.watch import InotifyWatcher, PollingWatcher, WatchedFiles, changed_line_ranges, watch
+
+SOURCE = '# fmt: off\nx = [\n    [1, 2],\n    [34, 5],\n]\n\ny = [\n    [1, 2],\n    [34, 5],\n]\n'
+
+
+def test_changed_line_ranges():
+    assert changed_line_ranges("a\nb\nc\n", "a\nb\nc\n") == []
+    assert changed_line_ranges("a\nb\nc\n", "a\nB\nc\n") == [LineRange(2, 2)]
+    assert changed_line_ranges("a\nb\nc\n", "a\nc\nd\ne\n") == [LineRange(2, 1), LineRange(3, 4)]
+
+
+def test_is_included():
+    assert is_included("a.py", DEFAULT_INCLUDES, DEFAULT_EXCLUDES)
+    assert is_included("sub/a.py", DEFAULT_INCLUDES, DEFAULT_EXCLUDES)
+    assert not is_included("a.txt", DEFAULT_INCLUDES, DEFAULT_EXCLUDES)
+    assert not is_included("sub/.tox/a.py", DEFAULT_INCLUDES, DEFAULT_EXCLUDES)
+    assert not is_included("sub/a.py", DEFAULT_INCLUDES, ["sub/*"])
+
+
+def test_watched_files(tmp_path):
+    path = tmp_path / "a.py"
+    path.write_text(SOURCE)
+    watched = WatchedFiles([str(tmp_path)], DEFAULT_INCLUDES, DEFAULT_EXCLUDES, {})
+    assert list(watched.handle({str(path)})) == []
+    # Only the table with changed lines is reformatted.
+    path.write_text(SOURCE.replace("[34, 5],\n]\n\ny", "[34, 6],\n]\n\ny"))
+    [result] = watched.handle({str(path)})
+    assert (result.path, result.changed, result.bytes_written) == (str(path), True, len(SOURCE) + 1)
+    assert path.read_text() == SOURCE.replace("[1, 2],\n    [34, 5],\n]\n\ny", "[1,  2],\n    [34, 6],\n]\n\ny")
+    # Files as they were last written are left alone.
+    mtime = path.stat().st_mtime_ns
+    assert list(watched.handle({str(path)})) == []
+    assert path.stat().st_mtime_ns == mtime
+    # After an error, the tables changed before it are still reformatted.
+    path.write_text(SOURCE.replace("[1, 2],\n    [34, 5]", "[1, 2],\n    [34, 7]") + "z = (\n")
+    [result] = watched.handle({str(path)})
+    assert result.error is not None
+    path.write_text(SOURCE.replace("[1, 2],\n    [34, 5]", "[1, 2],\n    [34, 7]") + "z = 1\n")
+    [result] = watched.handle({str(path)})
+    assert result.error is None
+    assert "[1,  2],\n    [34, 7]" in path.read_text()
+    # New files are reformatted throughout, and deleted files forgotten.
+    new_path = tmp_path / "b.py"
+    new_path.write_text(SOURCE)
+    path.unlink()
+    [result] = watched.handle({str(path), str(new_path)})
+    assert result.path == str(new_path)
+    assert str(path) not in watched.contents
+
+
+@pytest.mark.parametrize("watcher_class", [PollingWatcher, InotifyWatcher])
+def test_watchers(tmp_path, watcher_class, monkeypatch):
+    if watcher_class is InotifyWatcher and not InotifyWatcher.available():
+        pytest.skip("inotify isn't available")
+    monkeypatch.chdir(tmp_path)
+    for name in ["sub", ".tox"]:
+        os.mkdir(name)
+    if watcher_class is PollingWatcher:
+        watched = WatchedFiles(["."], DEFAULT_INCLUDES, DEFAULT_EXCLUDES, {})
+        watcher = PollingWatcher(watched.find_files, interval=0.01)
+    else:
+        watcher = InotifyWatcher(["."], DEFAULT_INCLUDES, DEFAULT_EXCLUDES)
+    assert watcher.wait(0.05) == set()
+    for name in ["a.py", "sub/b.txt", ".tox/c.py"]:
+        with open(name, "w") as f:
+            f.write(SOURCE)
+    assert watcher.wait(2) == {"a.py"}
+    # Directories that are added, and files replaced by renaming them, are noticed.
+    os.makedirs("new/sub")
+    with open("new/sub/d.py", "w") as f:
+        f.write(SOURCE)
+    with open("sub/e.py.tmp", "w") as f:
+        f.write(SOURCE)
+    os.rename("sub/e.py.tmp", "sub/e.py")
+    changed = set()
+    while len(changed) < 2:
+        more = watcher.wait(2)
+        assert more
+        changed |= more
+    assert changed == {os.path.join("new", "sub", "d.py"), os.path.join("sub", "e.py")}
+    assert watcher.wait(0.05) == set()
+
+
+@pytest.mark.parametrize("polling", [True, False])
+def test_watch_closes_watcher(tmp_path, polling, monkeypatch):
+    closed = []
+    for watcher_class in [PollingWatcher, InotifyWatcher]:
+        monkeypatch.setattr(watcher_class, "close", lambda self, close=watcher_class.close: closed.append(close(self)))
+    path = tmp_path / "a.py"
+    path.write_text(SOURCE)
+    # Change the file as soon as it is watched, so that there is a result.
+    changed = SOURCE.replace("34, 5", "34, 56")
+    results = watch([str(tmp_path)], polling=polling, on_ready=lambda count: path.write_text(changed))
+    assert next(results).path == str(path)
+    results.close()
+    assert closed == [None]